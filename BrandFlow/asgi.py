@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Las vistas async de login y registro (/api/user/async/...) solo liberan el
+worker mientras se hashea la contraseña cuando se sirven desde aquí, p. ej.
+``uvicorn BrandFlow.asgi:application``.
 """
 
 import os
@@ -14,3 +18,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BrandFlow.settings')
 
 application = get_asgi_application()
+
+# El autocompletado se arma al arrancar, en segundo plano (ver brand_control/autocomplete.py)
+from brand_control.autocomplete import autocomplete_index  # noqa: E402
+
+autocomplete_index.warm()
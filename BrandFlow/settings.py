@@ -77,6 +77,7 @@ TEMPLATES = [
 
 
 WSGI_APPLICATION = 'BrandFlow.wsgi.application'
+ASGI_APPLICATION = 'BrandFlow.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -133,6 +134,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = []
+# Headers con información de sesión (ver user_control.middleware.SessionMiddleware)
+CORS_EXPOSE_HEADERS = ['X-Session-Id', 'X-User-Id', 'X-Session-Authenticated']
 AUTH_USER_MODEL = 'user_control.Users'
 
 # DRF settings para desarrollo
@@ -140,11 +143,24 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Arma el usuario con los claims del token, sin consultar la base
+        'user_control.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Paginación por cursor (keyset): cada vista define su ``keyset_ordering``
+    'DEFAULT_PAGINATION_CLASS': 'brand_control.pagination.KeysetPagination',
+    # JSON con orjson (si no está instalado, json estándar como DRF)
+    'DEFAULT_RENDERER_CLASSES': [
+        'brand_control.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'brand_control.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # JWT Settings
@@ -168,6 +184,8 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
+    'TOKEN_OBTAIN_SERIALIZER': 'user_control.serializer.TokenObtainPairWithClaimsSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user_control.serializer.TokenRefreshWithClaimsSerializer',
     'TOKEN_TYPE_CLAIM': 'token_type',
 
     'JTI_CLAIM': 'jti',
@@ -177,6 +195,31 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Revocación de JWT por versión (Users.token_version), cacheada por usuario
+JWT_CHECK_TOKEN_VERSION = True
+JWT_TOKEN_VERSION_CACHE_TIMEOUT = 60  # segundos
+
+# El autocompletado de productos vive en memoria de cada proceso; se rearma
+# cada tanto para incorporar cambios hechos por otros workers
+AUTOCOMPLETE_REFRESH_SECONDS = 300
+
+# Cantidad y largo promedio de documentos para el ranking BM25 (brand_control/search.py)
+SEARCH_STATS_CACHE_TIMEOUT = 300  # segundos
+
+# Caché de fragmentos JSON de productos y categorías (brand_control/fragments.py)
+FRAGMENT_CACHE_ALIAS = 'default'
+FRAGMENT_CACHE_TIMEOUT = 3600  # segundos
+
+# Sincronización incremental del catálogo (brand_control/sync.py)
+CATALOG_SYNC_TOMBSTONE_DAYS = 90  # días que se conservan los borrados; tokens anteriores reciben una copia completa
+
+# Reservas de stock de los carritos (StockReservation en brand_control/models.py)
+STOCK_RESERVATION_TTL = 900  # segundos que una línea de carrito retiene su stock
+
+# Pool acotado para hashear contraseñas (user_control/hashing.py)
+PASSWORD_HASH_WORKERS = None  # None = cantidad de CPUs
+PASSWORD_HASH_MAX_QUEUE = 64  # hashes en espera antes de responder 503
+
 # Cookie settings optimizados para desarrollo
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_HTTPONLY = True
@@ -196,8 +239,22 @@ CSRF_COOKIE_HTTPONLY = False  # Permitir acceso desde JavaScript en desarrollo
 CSRF_COOKIE_SAMESITE = 'Lax'
 
 # Configuración de sesiones
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Caché local + compartida con respaldo en la base; solo se escribe cuando la
+# sesión cambió o el vencimiento necesita deslizarse (ver user_control/sessions.py).
+# Con LocMemCache en SESSION_CACHE_ALIAS no hay nivel compartido y se usa la base
+SESSION_ENGINE = 'user_control.sessions'
 SESSION_SAVE_EVERY_REQUEST = True
+SESSION_CACHE_ALIAS = 'default'
+SESSION_WRITE_THROUGH = True
+SESSION_SLIDE_INTERVAL = 300  # segundos
+SESSION_LOCAL_CACHE_TTL = 2  # segundos
+
+# En producción 'default' debería ser una caché compartida (Redis/Memcached)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
 
 # Configuración para pruebas
 import sys
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BrandFlow.settings')
 
 application = get_wsgi_application()
+
+# El autocompletado se arma al arrancar, en segundo plano (ver brand_control/autocomplete.py)
+from brand_control.autocomplete import autocomplete_index  # noqa: E402
+
+autocomplete_index.warm()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BrandControlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'brand_control'
+
+    def ready(self):
+        from . import signals  # noqa: F401
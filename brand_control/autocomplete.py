@@ -0,0 +1,319 @@
+"""
+Autocompletado de nombres de productos y categorías en memoria.
+
+Cada nombre se guarda en un arreglo ordenado con una clave por palabra
+("camiseta roja" -> "camiseta roja", "roja"), así un prefijo se resuelve con
+dos ``bisect`` y sin consultar la base. Los resultados se ordenan por
+unidades vendidas (``OrderDetails``); las categorías suman las ventas de sus
+productos.
+
+El índice se arma en segundo plano al arrancar el proceso (``warm``, desde
+BrandFlow/wsgi.py y asgi.py) y se mantiene con señales (ver signals.py); si
+una request llega antes de que termine, espera ese mismo armado. Como vive
+en cada proceso, también se reconstruye cada ``AUTOCOMPLETE_REFRESH_SECONDS``
+para recoger cambios hechos por otros workers: esa reconstrucción corre en un
+hilo aparte y mientras tanto se sigue usando el índice anterior. Nunca hay
+más de un armado en curso por proceso.
+
+Las ventas se guardan por producto también para los inactivos: al
+reactivarse un producto recupera su posición.
+"""
+
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+from .search import fold
+
+logger = logging.getLogger(__name__)
+
+_PREFIX_CACHE_SIZE = 1024
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall(fold(text or '')))
+
+
+def name_keys(name):
+    """Una clave por cada palabra del nombre, desde esa palabra hasta el final"""
+    words = normalize(name).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    """Arreglo ordenado de (clave, id) con el nombre y las ventas de cada id"""
+
+    def __init__(self):
+        self.keys = []
+        self.items = {}
+        self._cache = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Índice completo a partir de ``(id, nombre, ventas)``: las claves se ordenan una sola vez"""
+        index = cls()
+        keys = []
+        for pk, name, sales in rows:
+            index.items[pk] = {'id': pk, 'name': name, 'sales': sales}
+            keys.extend((key, pk) for key in name_keys(name))
+        keys.sort()
+        index.keys = keys
+        return index
+
+    def upsert(self, pk, name, sales=None):
+        current = self.items.get(pk)
+        if sales is None:
+            sales = current['sales'] if current else 0
+        if current and current['name'] == name:
+            current['sales'] = sales
+            self._forget(name)
+            return
+        self.remove(pk)
+        self.items[pk] = {'id': pk, 'name': name, 'sales': sales}
+        for key in name_keys(name):
+            insort(self.keys, (key, pk))
+        self._forget(name)
+
+    def remove(self, pk):
+        item = self.items.pop(pk, None)
+        if item is None:
+            return
+        for key in name_keys(item['name']):
+            position = bisect_left(self.keys, (key, pk))
+            if position < len(self.keys) and self.keys[position] == (key, pk):
+                del self.keys[position]
+        self._forget(item['name'])
+
+    def add_sales(self, pk, quantity):
+        item = self.items.get(pk)
+        if item is not None:
+            item['sales'] += quantity
+            self._forget(item['name'])
+
+    def _forget(self, name):
+        """Descarta solo los resultados cacheados de prefijos que incluyen a ``name``"""
+        keys = name_keys(name)
+        stale = [cached for cached in self._cache if any(key.startswith(cached[0]) for key in keys)]
+        for cached in stale:
+            del self._cache[cached]
+
+    def suggest(self, prefix, limit):
+        cached = self._cache.get((prefix, limit))
+        if cached is not None:
+            return cached
+
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + '\uffff',))
+        matches = {self.keys[i][1] for i in range(start, end)}
+        best = heapq.nsmallest(
+            limit,
+            (self.items[pk] for pk in matches),
+            key=lambda item: (-item['sales'], len(item['name']), item['name']),
+        )
+        result = [dict(item) for item in best]
+        if len(self._cache) >= _PREFIX_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[(prefix, limit)] = result
+        return result
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Se toma durante todo el armado: un solo hilo consulta la base a la vez
+        self._build_lock = threading.Lock()
+        # Cambios recibidos mientras se arma el índice (ver _apply)
+        self._pending = None
+        self._built_at = None
+        self.products = PrefixIndex()
+        self.categories = PrefixIndex()
+        # Categoría de cada producto, para sumarle las ventas
+        self.product_category = {}
+        # Unidades vendidas por producto, activo o no
+        self.product_sales = {}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Un armado en curso en el proceso padre no sigue en el hijo: los
+        # locks se recrean libres y el índice se arma en el primer uso
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._pending = None
+
+    @property
+    def refresh_seconds(self):
+        return getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 300)
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def build(self):
+        """Carga nombres y ventas con tres consultas"""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        from .models import Category, OrderDetails, Product
+
+        with self._lock:
+            self._pending = []
+        try:
+            sales = dict(
+                OrderDetails.objects.values_list('idproduct').annotate(total=Sum('quantity')).order_by()
+            )
+            product_rows = []
+            product_category = {}
+            category_sales = {}
+            for pk, name, category_id in Product.objects.filter(is_active=True).values_list('id', 'name', 'category_id'):
+                product_rows.append((pk, name, sales.get(pk) or 0))
+                product_category[pk] = category_id
+                if category_id is not None:
+                    category_sales[category_id] = category_sales.get(category_id, 0) + (sales.get(pk) or 0)
+            products = PrefixIndex.from_rows(product_rows)
+            product_sales = {pk: total for pk, total in sales.items() if total}
+            categories = PrefixIndex.from_rows(
+                (pk, name, category_sales.get(pk, 0)) for pk, name in Category.objects.values_list('id', 'name')
+            )
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self.products = products
+            self.categories = categories
+            self.product_category = product_category
+            self.product_sales = product_sales
+            self._built_at = time.monotonic()
+            # Lo que cambió mientras se leía la base se vuelve a aplicar sobre el índice nuevo
+            for method, args in pending:
+                method(*args)
+
+    def warm(self):
+        """Arma el índice en segundo plano al arrancar el proceso, sin demorar el arranque"""
+        if self._built_at is None and self._build_lock.acquire(blocking=False):
+            threading.Thread(target=self._refresh, name='autocomplete-build', daemon=True).start()
+
+    def ensure_built(self):
+        if self._built_at is None:
+            # Sin índice no hay nada que servir: un hilo lo arma y el resto espera
+            with self._build_lock:
+                if self._built_at is None:
+                    self._build()
+        elif time.monotonic() - self._built_at > self.refresh_seconds:
+            # Vencido: se rearma en segundo plano, salvo que ya haya un armado en curso
+            if self._build_lock.acquire(blocking=False):
+                threading.Thread(target=self._refresh, name='autocomplete-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self._build()
+        except Exception:
+            logger.exception('No se pudo reconstruir el índice de autocompletado')
+            # Se reintenta en el próximo intervalo, no en cada request
+            with self._lock:
+                if self._built_at is not None:
+                    self._built_at = time.monotonic()
+        finally:
+            # El hilo tiene su propia conexión a la base
+            connection.close()
+            self._build_lock.release()
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+            self.products = PrefixIndex()
+            self.categories = PrefixIndex()
+            self.product_category = {}
+            self.product_sales = {}
+
+    def suggest(self, query, limit=10):
+        self.ensure_built()
+        prefix = normalize(query)
+        if not prefix:
+            return {'products': [], 'categories': []}
+        with self._lock:
+            return {
+                'products': self.products.suggest(prefix, limit),
+                'categories': self.categories.suggest(prefix, limit),
+            }
+
+    # Actualizaciones incrementales; si el índice no está armado no hace falta
+    # nada, se leerá completo de la base en el primer uso.
+
+    def _apply(self, method, *args):
+        with self._lock:
+            if self._pending is not None:
+                # Un armado en curso pudo haber leído la base antes de este cambio
+                self._pending.append((method, args))
+            if self.is_built:
+                method(*args)
+
+    def update_product(self, pk, name, category_id, is_active=True):
+        self._apply(self._update_product, pk, name, category_id, is_active)
+
+    def _update_product(self, pk, name, category_id, is_active):
+        if not is_active:
+            return self._hide_product(pk)
+        sales = self.product_sales.get(pk, 0)
+        if pk not in self.product_category:
+            # Nuevo o reactivado: sus ventas vuelven a sumar en la categoría
+            self.categories.add_sales(category_id, sales)
+        elif self.product_category[pk] != category_id:
+            self.categories.add_sales(self.product_category[pk], -sales)
+            self.categories.add_sales(category_id, sales)
+        self.product_category[pk] = category_id
+        self.products.upsert(pk, name, sales)
+
+    def remove_product(self, pk):
+        self._apply(self._remove_product, pk)
+
+    def _remove_product(self, pk):
+        self._hide_product(pk)
+        self.product_sales.pop(pk, None)
+
+    def _hide_product(self, pk):
+        """Saca el producto de las sugerencias; sus ventas se conservan"""
+        if pk in self.product_category:
+            self.categories.add_sales(self.product_category.pop(pk), -self.product_sales.get(pk, 0))
+        self.products.remove(pk)
+
+    def update_category(self, pk, name):
+        self._apply(self._update_category, pk, name)
+
+    def _update_category(self, pk, name):
+        self.categories.upsert(pk, name)
+
+    def remove_category(self, pk):
+        self._apply(self._remove_category, pk)
+
+    def _remove_category(self, pk):
+        self.categories.remove(pk)
+
+    def record_sales(self, quantities):
+        """Suma unidades vendidas: ``{product_id: cantidad}``"""
+        # No se guardan para repetir tras un armado: el SUM del armado puede
+        # incluirlas ya, y contarlas dos veces es peor que perderlas hasta el
+        # próximo refresco
+        with self._lock:
+            if not self.is_built:
+                return
+            for pk, quantity in quantities.items():
+                self.product_sales[pk] = self.product_sales.get(pk, 0) + quantity
+                self.products.add_sales(pk, quantity)
+                self.categories.add_sales(self.product_category.get(pk), quantity)
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,146 @@
+"""
+Exportaciones completas en NDJSON o CSV que se escriben a medida que se leen.
+
+Las filas se leen por lotes con paginación por clave (``pk > último``): cada
+consulta trae a lo sumo ``chunk_size`` filas sin importar el tamaño de la
+tabla. No se mantiene una transacción abierta entre lotes: la descarga dura
+lo que tarde el cliente y una transacción larga retiene versiones viejas en
+InnoDB. Cada fila sale una sola vez, con el estado que tenía al leer su lote.
+Cada fila se convierte con el mapper de fastlist.py, así el contenido es el
+mismo que devuelve la API.
+
+Con ``compress=True`` la salida se comprime con gzip a medida que se genera.
+Bajo ASGI la respuesta recibe un iterador asíncrono que genera cada bloque
+en un hilo (``sync_to_async``): Django consume un iterador síncrono entero
+antes de enviar nada.
+"""
+
+import csv
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .fastlist import get_row_mapper
+from .models import Order, OrderDetails, Product
+from .renderers import FastJSONRenderer
+from .serializer import OrderDetailsSerializer, OrderSerializer, ProductSerializer
+
+# Nombre -> (modelo, serializer)
+EXPORTS = {
+    'products': (Product, ProductSerializer),
+    'orders': (Order, OrderSerializer),
+    'order-details': (OrderDetails, OrderDetailsSerializer),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+DEFAULT_CHUNK_SIZE = 1000
+# Se junta la salida en bloques de este tamaño antes de escribirla
+BUFFER_SIZE = 64 * 1024
+
+
+def iter_items(queryset, serializer_class, request=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Representaciones (dicts) de todas las filas del queryset, leídas por lotes"""
+    fields = list(serializer_class().fields)
+    mapper = get_row_mapper(serializer_class, fields)
+    pk = queryset.model._meta.pk.name
+    queryset = queryset.order_by(pk)
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(**{f'{pk}__gt': last})
+        if mapper is None:
+            rows = list(batch[:chunk_size])
+            items = serializer_class(rows, many=True, context={'request': request}).data
+            last = rows[-1].pk if rows else None
+        else:
+            rows = list(batch.values(*mapper.columns)[:chunk_size])
+            map_row = mapper.bind(request)
+            items = [map_row(row) for row in rows]
+            last = rows[-1][pk] if rows else None
+        yield from items
+        if len(rows) < chunk_size:
+            break
+
+
+def ndjson_lines(items):
+    renderer = FastJSONRenderer()
+    for item in items:
+        yield renderer.render(item) + b'\n'
+
+
+class _Echo:
+    """Archivo falso para csv.writer: devuelve la línea en vez de guardarla"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(items, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields).encode('utf-8')
+    for item in items:
+        yield writer.writerow(['' if item[name] is None else item[name] for name in fields]).encode('utf-8')
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks):
+    # wbits 16 + MAX_WBITS: formato gzip (con cabecera), no zlib
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(name, output, queryset=None, request=None, compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Bytes de la exportación ``name`` en el formato ``output``"""
+    model, serializer_class = EXPORTS[name]
+    if queryset is None:
+        queryset = model.objects.all()
+    items = iter_items(queryset, serializer_class, request, chunk_size)
+    if output == 'csv':
+        chunks = csv_lines(items, list(serializer_class().fields))
+    else:
+        chunks = ndjson_lines(items)
+    chunks = buffered(chunks)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def async_chunks(chunks):
+    """Iterador asíncrono sobre ``chunks``: cada bloque (y sus consultas) se genera en un hilo"""
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+def export_response(name, output, queryset=None, request=None, compress=False):
+    chunks = export_stream(name, output, queryset, request, compress)
+    # DRF envuelve el HttpRequest de Django
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = async_chunks(chunks)
+    response = StreamingHttpResponse(
+        chunks,
+        content_type='application/gzip' if compress else FORMATS[output],
+    )
+    filename = f'{name}.{output}' + ('.gz' if compress else '')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,182 @@
+"""
+Listados de solo lectura armados con ``values()``.
+
+``get_row_mapper`` compila, a partir de los campos de un ModelSerializer,
+una función que convierte cada fila de ``values()`` en el mismo dict que
+devolvería el serializer. Los campos cuyo valor de la base ya es su
+representación (enteros, textos, pks) se copian tal cual; el resto usa el
+``to_representation`` del propio campo de DRF, así el resultado es idéntico.
+Los campos calculados se arman con la propiedad del modelo sobre las columnas
+declaradas en ``Meta.field_sources``.
+
+Si el serializer tiene algo que no se puede resolver desde una fila (campos
+anidados, ``SerializerMethodField``, fuentes con puntos) no hay mapper y la
+vista usa el camino habitual.
+"""
+
+import datetime
+import threading
+from decimal import Decimal
+from functools import partial
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# El valor que trae la base ya es la representación de DRF
+IDENTITY_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.PrimaryKeyRelatedField)
+
+_mappers = {}
+_lock = threading.Lock()
+
+
+class RowMapper:
+    def __init__(self, function, columns):
+        self.function = function
+        self.columns = columns
+
+    def bind(self, request):
+        """Función ``fila -> dict`` para este request"""
+        # Como DateTimeField.default_timezone(), pero una vez por request
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        return partial(self.function, request=request, tz=tz)
+
+    def __call__(self, row, request=None):
+        return self.bind(request)(row)
+
+
+def get_row_mapper(serializer_class, field_names):
+    """Mapper para esos campos del serializer (compilado una sola vez), o None"""
+    key = (serializer_class, tuple(field_names))
+    if key not in _mappers:
+        with _lock:
+            if key not in _mappers:
+                _mappers[key] = compile_row_mapper(serializer_class, field_names)
+    return _mappers[key]
+
+
+def compile_row_mapper(serializer_class, field_names):
+    # Sin contexto: los campos no deben quedar atados a un request en particular
+    fields = serializer_class().fields
+    model = serializer_class.Meta.model
+    concrete = {field.name: field for field in model._meta.concrete_fields}
+    sources = getattr(serializer_class.Meta, 'field_sources', {})
+
+    namespace = {'SimpleNamespace': SimpleNamespace}
+    columns = {model._meta.pk.name}
+    entries = []
+    for position, name in enumerate(field_names):
+        field = fields[name]
+        converter = f'_convert_{position}'
+
+        if name in sources:
+            prop = getattr(model, field.source, None)
+            if not isinstance(prop, property):
+                return None
+            deps = list(sources[name])
+            columns.update(deps)
+            namespace[converter] = _computed(prop.fget, deps, field.to_representation)
+            entries.append(f'{name!r}: {converter}(row)')
+            continue
+
+        if field.source not in concrete or field.source == '*':
+            return None
+        column = field.source
+        columns.add(column)
+        if isinstance(field, serializers.FileField):
+            namespace[converter] = _file_url(concrete[column].storage, field)
+            entries.append(f'{name!r}: {converter}(row[{column!r}], request)')
+        elif isinstance(field, IDENTITY_FIELDS) and not getattr(field, 'pk_field', None):
+            entries.append(f'{name!r}: row[{column!r}]')
+        elif isinstance(field, serializers.BooleanField):
+            # Con valores de la base (bool, 0/1) equivale a BooleanField.to_representation
+            entries.append(f'{name!r}: None if row[{column!r}] is None else bool(row[{column!r}])')
+        elif _is_plain_decimal(field):
+            namespace[converter] = _decimal(field)
+            entries.append(f'{name!r}: None if row[{column!r}] is None else {converter}(row[{column!r}])')
+        elif _is_plain_datetime(field):
+            namespace[converter] = _datetime(field)
+            entries.append(f'{name!r}: None if row[{column!r}] is None else {converter}(row[{column!r}], tz)')
+        elif isinstance(field, serializers.Field) and not isinstance(field, serializers.BaseSerializer):
+            namespace[converter] = field.to_representation
+            entries.append(f'{name!r}: None if row[{column!r}] is None else {converter}(row[{column!r}])')
+        else:
+            return None
+
+    source = 'def map_row(row, request, tz):\n    return {' + ', '.join(entries) + '}\n'
+    exec(compile(source, f'<row mapper {serializer_class.__name__}>', 'exec'), namespace)
+    return RowMapper(namespace['map_row'], sorted(columns))
+
+
+def _is_plain_decimal(field):
+    return (
+        isinstance(field, serializers.DecimalField)
+        and field.decimal_places is not None
+        and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        and not field.localize
+        and not field.normalize_output
+    )
+
+
+def _decimal(field):
+    """DecimalField.to_representation sin cuantizar si ya tiene los decimales del campo"""
+    exponent = -field.decimal_places
+
+    def convert(value):
+        if isinstance(value, Decimal) and value.as_tuple().exponent == exponent:
+            return f'{value:f}'
+        return field.to_representation(value)
+    return convert
+
+
+def _is_plain_datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    return (
+        isinstance(field, serializers.DateTimeField)
+        and not hasattr(field, 'timezone')
+        and output_format is not None
+        and output_format.lower() == ISO_8601
+    )
+
+
+def _datetime(field):
+    """DateTimeField.to_representation en ISO 8601 con la zona horaria ya resuelta"""
+    def convert(value, tz):
+        if isinstance(value, str):
+            return value
+        aware = value.utcoffset() is not None
+        if tz is not None and aware:
+            value = value.astimezone(tz)
+        elif tz is None and aware:
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        elif tz is not None:
+            # Caso raro (datetime sin zona con USE_TZ): se deja a DRF
+            return field.to_representation(value)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _computed(getter, deps, to_representation):
+    def convert(row):
+        value = getter(SimpleNamespace(**{dep: row[dep] for dep in deps}))
+        return None if value is None else to_representation(value)
+    return convert
+
+
+def _file_url(storage, field):
+    """Igual que FileField.to_representation, pero con el nombre guardado en la fila"""
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+    def convert(name, request):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
@@ -0,0 +1,158 @@
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import BooleanField, Case, CharField, Count, Max, Q, Value, When
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+# Rangos de precio para el facet ``price``: (etiqueta, desde, hasta)
+PRICE_BANDS = [
+    ('0-10', None, Decimal('10')),
+    ('10-25', Decimal('10'), Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100+', Decimal('100'), None),
+]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'si'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+
+class ProductFacetFilter(BaseFilterBackend):
+    """
+    Filtros por ``category``, ``type``, ``min_price``/``max_price``,
+    ``in_stock`` e ``is_active``. ``category`` y ``type`` aceptan varios
+    valores separados por coma.
+
+    ``facet_counts`` calcula los conteos de todos los facets con un único
+    GROUP BY sobre las combinaciones (categoría, tipo, rango, stock); cada
+    facet se cuenta aplicando los filtros de los demás, así el cliente ve
+    cuántos productos suma al elegir otro valor.
+    """
+
+    def parse(self, request):
+        params = request.query_params
+        filters = {}
+        if params.get('category'):
+            try:
+                filters['category'] = {int(value) for value in params['category'].split(',') if value}
+            except ValueError:
+                raise ValidationError({'category': 'Debe ser una lista de ids separados por coma'})
+        if params.get('type'):
+            filters['type'] = {value for value in params['type'].split(',') if value}
+        for name in ('min_price', 'max_price'):
+            if params.get(name):
+                try:
+                    filters[name] = Decimal(params[name])
+                except InvalidOperation:
+                    raise ValidationError({name: 'Debe ser un número'})
+        for name in ('in_stock', 'is_active'):
+            if params.get(name):
+                value = params[name].lower()
+                if value not in TRUE_VALUES | FALSE_VALUES:
+                    raise ValidationError({name: 'Debe ser true o false'})
+                filters[name] = value in TRUE_VALUES
+        return filters
+
+    def base_filter(self, filters):
+        """Condiciones que no son facets (rango de precio y activo)"""
+        condition = Q()
+        if 'min_price' in filters:
+            condition &= Q(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            condition &= Q(price__lte=filters['max_price'])
+        if 'is_active' in filters:
+            condition &= Q(is_active=filters['is_active'])
+        return condition
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.parse(request)
+        queryset = queryset.filter(self.base_filter(filters))
+        if 'category' in filters:
+            queryset = queryset.filter(category_id__in=filters['category'])
+        if 'type' in filters:
+            queryset = queryset.filter(type__in=filters['type'])
+        if 'in_stock' in filters:
+            queryset = queryset.filter(stock__gt=0) if filters['in_stock'] else queryset.filter(stock__lte=0)
+        return queryset
+
+    def facet_version(self, request, queryset, version_field='updated_at'):
+        """
+        (conteo, última versión) de las filas que cuentan los facets: cambia
+        con altas, bajas y ediciones de cualquiera de ellas, no solo de la página.
+        """
+        version = queryset.filter(self.base_filter(self.parse(request))).aggregate(
+            count=Count('pk'), last=Max(version_field)
+        )
+        return version['count'], version['last']
+
+    def facet_counts(self, request, queryset):
+        filters = self.parse(request)
+        band = Case(
+            *[When(_band_condition(low, high), then=Value(label)) for label, low, high in PRICE_BANDS],
+            output_field=CharField(),
+        )
+        in_stock = Case(When(stock__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField())
+        rows = (
+            queryset.filter(self.base_filter(filters))
+            .annotate(price_band=band, has_stock=in_stock)
+            .values('category_id', 'type', 'price_band', 'has_stock')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+
+        checks = {
+            'category': lambda row: row['category_id'] in filters['category'],
+            'type': lambda row: row['type'] in filters['type'],
+            'in_stock': lambda row: row['has_stock'] == filters['in_stock'],
+        }
+        active = [name for name in checks if name in filters]
+        facets = {'category': Counter(), 'type': Counter(), 'price': Counter(), 'in_stock': Counter()}
+        total = 0
+        for row in rows:
+            failed = [name for name in active if not checks[name](row)]
+            if not failed:
+                total += row['count']
+                facets['price'][row['price_band']] += row['count']
+            # Cada facet ignora su propio filtro
+            for name, key in (('category', 'category_id'), ('type', 'type'), ('in_stock', 'has_stock')):
+                if not failed or failed == [name]:
+                    facets[name][row[key]] += row['count']
+
+        return {
+            'total': total,
+            **{
+                name: [{'value': value, 'count': count} for value, count in counter.most_common()]
+                for name, counter in facets.items()
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        params = [
+            ('category', 'string', 'Ids de categoría separados por coma'),
+            ('type', 'string', 'Tipos separados por coma'),
+            ('min_price', 'number', 'Precio mínimo (inclusive)'),
+            ('max_price', 'number', 'Precio máximo (inclusive)'),
+            ('in_stock', 'boolean', 'Solo productos con (o sin) stock'),
+            ('is_active', 'boolean', 'Solo productos activos (o inactivos)'),
+            ('facets', 'boolean', 'Incluye los conteos por facet en la respuesta'),
+        ]
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': description,
+                'schema': {'type': schema_type},
+            }
+            for name, schema_type, description in params
+        ]
+
+
+def _band_condition(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
@@ -0,0 +1,161 @@
+"""
+Caché de representaciones JSON ya renderizadas.
+
+Cada objeto se guarda como los bytes de su JSON bajo la clave de su pk, junto
+con la versión (``updated_at``) y el host con el que se armó (las URLs de las
+imágenes son absolutas). Un listado junta los fragmentos sin volver a pasar
+por el serializer; solo se serializan los que faltan o quedaron viejos.
+
+Las señales borran la entrada al guardar o eliminar. Los cambios hechos con
+``queryset.update()`` no disparan señales, pero sí mueven ``updated_at`` y el
+fragmento deja de coincidir con la versión.
+"""
+
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .renderers import FastJSONRenderer
+
+# Con estos parámetros el cuerpo no es la representación completa
+SPARSE_PARAMS = ('fields', 'omit', 'view')
+
+
+class FragmentCache:
+    """Acepta instancias de modelo o filas de ``values()`` (dicts)"""
+
+    def __init__(self, name, version_field=None, pk_field='id'):
+        self.name = name
+        self.version_field = version_field
+        self.pk_field = pk_field
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600)
+
+    def key(self, pk):
+        return f'brand_control:fragment:{self.name}:{pk}'
+
+    def version(self, instance):
+        if self.version_field is None:
+            return None
+        value = _value(instance, self.version_field)
+        return value.isoformat() if value else None
+
+    def usable(self, request):
+        return not any(request.query_params.get(param) for param in SPARSE_PARAMS)
+
+    def get_many(self, instances, request, serialize):
+        """
+        Bytes JSON de cada instancia, en el mismo orden.
+
+        ``serialize`` recibe la lista de instancias sin fragmento válido y
+        devuelve sus representaciones (dicts).
+        """
+        host = request.build_absolute_uri('/')
+        keys = [self.key(_value(instance, self.pk_field)) for instance in instances]
+        cached = self.cache.get_many(keys)
+
+        fragments = []
+        missing = []
+        for key, instance in zip(keys, instances):
+            entry = cached.get(key)
+            if entry and entry[0] == self.version(instance) and entry[1] == host:
+                fragments.append(entry[2])
+            else:
+                fragments.append(None)
+                missing.append((len(fragments) - 1, key, instance))
+
+        if missing:
+            renderer = FastJSONRenderer()
+            rendered = serialize([instance for _, _, instance in missing])
+            to_store = {}
+            for (position, key, instance), data in zip(missing, rendered):
+                fragments[position] = renderer.render(data)
+                to_store[key] = (self.version(instance), host, fragments[position])
+            self.cache.set_many(to_store, self.timeout)
+
+        with self._lock:
+            self.hits += len(instances) - len(missing)
+            self.misses += len(missing)
+        return fragments
+
+    def invalidate(self, pk):
+        self.cache.delete(self.key(pk))
+
+    def invalidate_many(self, pks):
+        self.cache.delete_many([self.key(pk) for pk in pks])
+
+    def metrics(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+            }
+
+    def reset_metrics(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def _value(item, name):
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+product_fragments = FragmentCache('product', version_field='updated_at')
+category_fragments = FragmentCache('category', version_field='updated_at')
+
+
+class FragmentListResponse(Response):
+    """
+    Respuesta de listado armada con fragmentos JSON ya renderizados.
+
+    Con un renderer JSON el cuerpo se arma concatenando bytes. ``data`` se
+    decodifica recién si alguien la lee (API navegable, tests, agregar
+    claves); en ese caso se renderiza de la forma habitual.
+    """
+
+    def __init__(self, envelope, fragments, **kwargs):
+        self.envelope = envelope
+        self.fragments = fragments
+        self._materialized = None
+        super().__init__(None, **kwargs)
+
+    @property
+    def data(self):
+        if self._materialized is None:
+            results = [json.loads(fragment) for fragment in self.fragments]
+            self._materialized = results if self.envelope is None else {**self.envelope, 'results': results}
+        return self._materialized
+
+    @data.setter
+    def data(self, value):
+        # Response.__init__ asigna data=None; no hay nada que guardar
+        if value is not None:
+            self._materialized = value
+
+    @property
+    def rendered_content(self):
+        if self._materialized is not None or not isinstance(self.accepted_renderer, JSONRenderer):
+            return super().rendered_content
+        self['Content-Type'] = self.content_type or self.accepted_renderer.media_type
+        results = b'[' + b','.join(self.fragments) + b']'
+        if self.envelope is None:
+            return results
+        head = self.accepted_renderer.render({k: v for k, v in self.envelope.items() if k != 'results'})
+        separator = b',' if len(head) > 2 else b''
+        return head[:-1] + separator + b'"results":' + results + b'}'
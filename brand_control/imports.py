@@ -0,0 +1,184 @@
+"""
+Importación masiva de productos desde CSV o NDJSON.
+
+Las filas se leen del stream de a una y se procesan por lotes. Cada fila se
+valida con ``ProductImportSerializer`` (las reglas de ``ProductSerializer``,
+con la categoría por nombre y el ``sku`` obligatorio), las categorías se
+resuelven con un único mapa nombre -> id y el lote se guarda con
+``bulk_create(update_conflicts=True)``: los sku nuevos se insertan y los
+existentes se actualizan. Al actualizar solo se pisan las columnas que trae
+el archivo, así una planilla sin ``stock`` no lo deja en cero.
+
+``bulk_create`` no dispara señales: el índice de búsqueda, el autocompletado,
+la caché de fragmentos y el registro de cambios de la sincronización
+(``CatalogChange``) se actualizan acá, una vez por lote.
+
+Los errores se informan por fila (número de fila de datos, desde 1) y no
+frenan el resto de la importación.
+"""
+
+import codecs
+import csv
+import json
+
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from .autocomplete import autocomplete_index
+from .fragments import product_fragments
+from .models import Category, Product, record_catalog_changes
+from .search import INDEXED_FIELDS, index_products
+from .serializer import ProductSerializer
+
+INPUT_FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 1000
+# Errores que se devuelven en el resumen; el resto solo se cuenta
+MAX_REPORTED_ERRORS = 1000
+
+
+class ProductImportSerializer(ProductSerializer):
+    """Una fila de la importación"""
+    category = serializers.CharField(required=False, allow_blank=True, max_length=100)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['sku', 'name', 'description', 'price', 'stock', 'url_download', 'type', 'is_active', 'category']
+        # La unicidad del sku la resuelve el upsert, no una consulta por fila
+        extra_kwargs = {'sku': {'required': True, 'allow_null': False, 'allow_blank': False, 'validators': []}}
+
+
+def read_rows(stream, input_format):
+    """
+    Dicts de las filas de un stream binario. Una línea de NDJSON ilegible llega
+    como un ``ValueError`` para informarla como error de esa fila.
+    """
+    text = codecs.getreader('utf-8-sig')(stream)
+    if input_format == 'csv':
+        # Una celda vacía es un dato ausente: se usa el valor por defecto
+        for row in csv.DictReader(text):
+            yield {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+    for line in text:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = ValueError('JSON inválido')
+            if not isinstance(row, (dict, ValueError)):
+                row = ValueError('Cada línea debe ser un objeto JSON')
+            yield row
+
+
+class ProductImporter:
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.validator = ProductImportSerializer()
+        self.categories = None
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self, rows):
+        batch = []
+        for row in rows:
+            self.rows += 1
+            batch.append((self.rows, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        return self.summary()
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def add_error(self, number, row, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            sku = row.get('sku') if isinstance(row, dict) else None
+            self.errors.append({'row': number, 'sku': sku, 'errors': errors})
+
+    def category_map(self):
+        # Una sola consulta para toda la importación
+        if self.categories is None:
+            self.categories = {
+                name.casefold(): Category(id=pk, name=name)
+                for pk, name in Category.objects.values_list('id', 'name')
+            }
+        return self.categories
+
+    def validate(self, batch):
+        """Filas válidas como ``{sku: (número, datos)}``; si un sku se repite vale la última"""
+        valid = {}
+        for number, row in batch:
+            if isinstance(row, Exception):
+                self.add_error(number, {}, {'non_field_errors': [str(row)]})
+                continue
+            try:
+                data = self.validator.run_validation(row)
+            except serializers.ValidationError as exc:
+                self.add_error(number, row, exc.detail)
+                continue
+            category = data.pop('category', None)
+            if category:
+                data['category_id'] = self.category_map().get(category.casefold())
+                if data['category_id'] is None:
+                    self.add_error(number, row, {'category': [f'Categoría desconocida: {category}']})
+                    continue
+            if data['sku'] in valid:
+                previous, _ = valid.pop(data['sku'])
+                self.add_error(previous, row, {'sku': ['Repetido más adelante en el archivo, se usa la última fila']})
+            valid[data['sku']] = (number, data)
+        return valid
+
+    def import_batch(self, batch):
+        valid = self.validate(batch)
+        if not valid:
+            return
+        skus = list(valid)
+        with transaction.atomic():
+            existing = set(Product.objects.filter(sku__in=skus).values_list('sku', flat=True))
+
+            # Un upsert por combinación de columnas presentes (en general una sola)
+            groups = {}
+            for number, data in valid.values():
+                groups.setdefault(frozenset(data), []).append(Product(**data))
+            for columns, products in groups.items():
+                update_fields = sorted(columns - {'sku'}) + ['updated_at']
+                Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    update_fields=update_fields,
+                    # MySQL no admite indicar la restricción (ON DUPLICATE KEY UPDATE)
+                    unique_fields=['sku'] if connection.features.supports_update_conflicts_with_target else None,
+                )
+
+            # Valores finales (los ids no siempre vuelven de bulk_create)
+            saved = list(
+                Product.objects.filter(sku__in=skus)
+                .values('id', 'category_id', 'is_active', *INDEXED_FIELDS)
+            )
+            record_catalog_changes('product', [row['id'] for row in saved])
+            index_products({row['id']: {field: row[field] for field in INDEXED_FIELDS} for row in saved})
+            product_fragments.invalidate_many([row['id'] for row in saved])
+
+            def update_autocomplete():
+                for row in saved:
+                    autocomplete_index.update_product(row['id'], row['name'], row['category_id'], row['is_active'])
+            transaction.on_commit(update_autocomplete)
+
+        self.created += len(skus) - len(existing)
+        self.updated += len(existing)
+
+
+def import_products(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Importa un iterable de filas (dicts) y devuelve el resumen"""
+    return ProductImporter(batch_size).run(rows)
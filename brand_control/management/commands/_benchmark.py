@@ -0,0 +1,34 @@
+"""Utilidades compartidas por los comandos ``benchmark_*``"""
+
+import time
+from decimal import Decimal
+
+from brand_control.models import Product
+
+
+def add_sample_argument(parser, what='productos'):
+    parser.add_argument(
+        '--sample',
+        type=int,
+        default=0,
+        help=f'Crea esta cantidad de {what} de prueba y los descarta al terminar'
+    )
+
+
+def create_sample_products(count, name='Producto {}'):
+    Product.objects.bulk_create([
+        Product(name=name.format(i), description='Descripción de prueba ' * 5,
+                price=Decimal('19.99'), stock=i % 7, review_count=i % 4, rating_sum=(i % 4) * 4)
+        for i in range(count)
+    ])
+
+
+def best_time(function, repeat):
+    """El menor tiempo, en segundos, de ``repeat`` ejecuciones de ``function``"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,69 @@
+import io
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from brand_control import renderers
+from brand_control.models import Order, Product
+from brand_control.renderers import FastJSONParser, FastJSONRenderer
+from brand_control.serializer import OrderSerializer, ProductSerializer
+
+from ._benchmark import add_sample_argument, best_time, create_sample_products
+
+
+class Command(BaseCommand):
+    help = 'Compara el renderer y parser JSON de DRF contra los de orjson con listados de productos y órdenes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Filas por listado')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones de cada variante')
+        add_sample_argument(parser, 'productos y órdenes')
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING('orjson no está instalado: ambas variantes usan json estándar'))
+        with transaction.atomic():
+            if options['sample']:
+                create_sample_products(options['sample'], name='Producto ñ {}')
+                Order.objects.bulk_create([
+                    Order(total=Decimal('59.97'), status='confirmed') for _ in range(options['sample'])
+                ])
+            self.run(options['rows'], options['repeat'])
+            # Los datos de prueba no quedan en la base
+            transaction.set_rollback(True)
+
+    def run(self, rows, repeat):
+        request = Request(RequestFactory().get('/'))
+        context = {'request': request}
+        products = Product.objects.order_by('-created_at', '-id')[:rows]
+        orders = Order.objects.order_by('-created_at', '-idorder')[:rows]
+        datasets = {
+            'Product': ProductSerializer(products, many=True, context=context).data,
+            'Order': OrderSerializer(orders, many=True, context=context).data,
+            # Decimal y datetime sin convertir, los resuelve el encoder
+            'Product values()': list(products.values()),
+        }
+
+        for label, data in datasets.items():
+            default_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+            body = default_renderer.render(data)
+            if fast_renderer.render(data) != body:
+                self.stderr.write(self.style.ERROR(f'{label}: las salidas no coinciden'))
+                return
+            render_default = best_time(lambda: default_renderer.render(data), repeat)
+            render_fast = best_time(lambda: fast_renderer.render(data), repeat)
+            parse_default = best_time(lambda: JSONParser().parse(io.BytesIO(body)), repeat)
+            parse_fast = best_time(lambda: FastJSONParser().parse(io.BytesIO(body)), repeat)
+
+            self.stdout.write(f'{label} ({len(data)} filas, {len(body) / 1024:.0f} KiB)')
+            for name, slow, fast in (('render', render_default, render_fast), ('parse', parse_default, parse_fast)):
+                self.stdout.write(
+                    f'  {name:>6}: DRF {slow * 1000:.2f} ms, orjson {fast * 1000:.2f} ms '
+                    + self.style.SUCCESS(f'mejora {slow / fast:.1f}x')
+                )
+
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from brand_control.fastlist import get_row_mapper
+from brand_control.models import Product
+from brand_control.serializer import ProductSerializer
+
+from ._benchmark import add_sample_argument, best_time, create_sample_products
+
+
+class Command(BaseCommand):
+    help = 'Compara el listado de productos con ProductSerializer contra el camino con values()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Productos por listado')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones de cada variante')
+        add_sample_argument(parser)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['sample']:
+                create_sample_products(options['sample'])
+            self.run(options['rows'], options['repeat'])
+            # Los productos de prueba no quedan en la base
+            transaction.set_rollback(True)
+
+    def run(self, rows, repeat):
+        request = Request(RequestFactory().get('/'))
+        queryset = Product.objects.order_by('-created_at', '-id')[:rows]
+        mapper = get_row_mapper(ProductSerializer, list(ProductSerializer().fields))
+
+        def with_serializer():
+            return ProductSerializer(list(queryset), many=True, context={'request': request}).data
+
+        def with_values():
+            map_row = mapper.bind(request)
+            return [map_row(row) for row in queryset.values(*mapper.columns)]
+
+        if [dict(item) for item in with_serializer()] != with_values():
+            self.stderr.write(self.style.ERROR('Las salidas no coinciden'))
+            return
+
+        # Lectura + serialización completa, y solo la conversión con las filas ya leídas
+        instances = list(queryset)
+        rows = list(queryset.values(*mapper.columns))
+        map_row = mapper.bind(request)
+        variants = {
+            'total': (with_serializer, with_values),
+            'conversión': (
+                lambda: ProductSerializer(instances, many=True, context={'request': request}).data,
+                lambda: [map_row(row) for row in rows],
+            ),
+        }
+        for label, (slow, fast) in variants.items():
+            slow_time = best_time(slow, repeat)
+            fast_time = best_time(fast, repeat)
+            self.stdout.write(
+                f'{label:>11}: serializer {slow_time * 1000:.1f} ms, values {fast_time * 1000:.1f} ms '
+                f'({len(rows) / fast_time:,.0f} filas/s)'
+            )
+            self.stdout.write(self.style.SUCCESS(f'{"":>11}  mejora {slow_time / fast_time:.1f}x'))
+
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from brand_control.exports import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, export_stream
+
+
+class Command(BaseCommand):
+    help = 'Exporta productos, órdenes o detalles de órdenes en NDJSON o CSV sin cargar la tabla en memoria'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS), help='Qué exportar')
+        parser.add_argument('--output', choices=list(FORMATS), default='ndjson', help='Formato de salida')
+        parser.add_argument('--gzip', action='store_true', help='Comprime la salida con gzip')
+        parser.add_argument('--file', help='Archivo de destino (por defecto la salida estándar)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help='Filas leídas por consulta'
+        )
+
+    def handle(self, *args, **options):
+        chunks = export_stream(
+            options['name'], options['output'], compress=options['gzip'], chunk_size=options['chunk_size']
+        )
+        if options['file']:
+            written = 0
+            with open(options['file'], 'wb') as destination:
+                for chunk in chunks:
+                    destination.write(chunk)
+                    written += len(chunk)
+            self.stderr.write(self.style.SUCCESS(f'Exportado {options["name"]} a {options["file"]} ({written} bytes)'))
+            return
+        binary = getattr(self.stdout, 'buffer', None)
+        if binary is not None:
+            self.stdout.flush()
+            for chunk in chunks:
+                binary.write(chunk)
+            binary.flush()
+        elif options['gzip']:
+            raise CommandError('--gzip necesita --file o una salida binaria')
+        else:
+            # Los bloques terminan siempre en fin de línea: se decodifican enteros
+            for chunk in chunks:
+                self.stdout.write(chunk.decode('utf-8'), ending='')
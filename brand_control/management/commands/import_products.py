@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brand_control.imports import DEFAULT_BATCH_SIZE, INPUT_FORMATS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Importa (o actualiza por sku) productos desde un archivo CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo a importar')
+        parser.add_argument('--input', choices=INPUT_FORMATS, help='Formato (por defecto según la extensión)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Filas validadas y guardadas por lote'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['input'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        start = time.perf_counter()
+        try:
+            with open(path, 'rb') as source:
+                summary = import_products(read_rows(source, input_format), options['batch_size'])
+        except OSError as exc:
+            raise CommandError(f'No se pudo leer {path}: {exc}')
+        elapsed = time.perf_counter() - start
+
+        for error in summary['errors']:
+            self.stderr.write(f"Fila {error['row']} ({error['sku'] or 'sin sku'}): {error['errors']}")
+        if summary['error_count'] > len(summary['errors']):
+            self.stderr.write(f"... y {summary['error_count'] - len(summary['errors'])} errores más")
+        self.stdout.write(self.style.SUCCESS(
+            f"Filas: {summary['rows']}, creados: {summary['created']}, actualizados: {summary['updated']}, "
+            f"con errores: {summary['error_count']} ({elapsed:.1f} s)"
+        ))
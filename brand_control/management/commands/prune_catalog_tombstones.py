@@ -0,0 +1,37 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from brand_control.models import CatalogChange, CatalogSyncState
+
+
+class Command(BaseCommand):
+    help = 'Elimina los borrados del registro de cambios de la sincronización más viejos que la retención'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'CATALOG_SYNC_TOMBSTONE_DAYS', 90),
+            help='Días de borrados que se conservan'
+        )
+
+    def handle(self, *args, **options):
+        limit = timezone.now() - datetime.timedelta(days=options['days'])
+        # Solo los ya numerados: los pendientes todavía no los vio ningún cliente
+        old = CatalogChange.objects.filter(deleted=True, sequence__isnull=False, changed_at__lt=limit)
+        CatalogSyncState.objects.bulk_create([CatalogSyncState(id=1)], ignore_conflicts=True)
+        with transaction.atomic():
+            state = CatalogSyncState.objects.select_for_update().get(id=1)
+            through = old.aggregate(through=Max('sequence'))['through']
+            deleted = 0
+            if through is not None:
+                deleted, _ = old.filter(sequence__lte=through).delete()
+                # Los clientes con un token anterior reciben una copia completa
+                state.pruned_through = max(state.pruned_through, through)
+                state.save(update_fields=['pruned_through'])
+        self.stdout.write(self.style.SUCCESS(f'Borrados eliminados: {deleted}'))
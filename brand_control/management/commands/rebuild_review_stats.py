@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from brand_control.models import Product, Reviews
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los agregados de reseñas de los productos por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Cantidad de productos procesados por lote'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = Product.REVIEW_STATS_FIELDS
+        histogram = {
+            f'rating_{rating}': Count('idreviews', filter=Q(rating=rating))
+            for rating in Product.RATING_VALUES
+        }
+
+        current = Product.objects.order_by('id').values('id', *fields)
+        last_id = 0
+        checked = 0
+        fixed = 0
+        while True:
+            batch = list(current.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]['id']
+
+            # Un único GROUP BY por lote para todos los productos
+            stats = {
+                row.pop('idproduct'): row
+                for row in Reviews.objects.filter(idproduct__in=[row['id'] for row in batch])
+                .values('idproduct')
+                .annotate(review_count=Count('idreviews'), rating_sum=Sum('rating'), **histogram)
+                .order_by()
+            }
+            # Solo se reescriben los productos cuyos agregados no coinciden
+            now = timezone.now()
+            products = []
+            for row in batch:
+                expected = stats.get(row['id'], {})
+                values = {field: expected.get(field) or 0 for field in fields}
+                if all(row[field] == values[field] for field in fields):
+                    continue
+                products.append(Product(id=row['id'], updated_at=now, **values))
+
+            if products:
+                with transaction.atomic():
+                    Product.objects.bulk_update(products, fields + ['updated_at'])
+            checked += len(batch)
+            fixed += len(products)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Productos revisados: {checked}, agregados corregidos: {fixed}')
+        )
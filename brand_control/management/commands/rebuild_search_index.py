@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from brand_control.models import Product, ProductSearchDocument, ProductSearchPosting
+from brand_control.search import INDEXED_FIELDS, STATS_CACHE_KEY, build_index_rows
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de productos por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Cantidad de productos indexados por lote'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            ProductSearchPosting.objects.all().delete()
+            ProductSearchDocument.objects.all().delete()
+
+            current = Product.objects.order_by('id').values('id', *INDEXED_FIELDS)
+            last_id = 0
+            indexed = 0
+            terms = 0
+            while True:
+                batch = list(current.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1]['id']
+
+                documents = []
+                postings = []
+                for row in batch:
+                    document, rows = build_index_rows(row['id'], row)
+                    documents.append(document)
+                    postings.extend(rows)
+                ProductSearchDocument.objects.bulk_create(documents)
+                ProductSearchPosting.objects.bulk_create(postings, batch_size=1000)
+                indexed += len(documents)
+                terms += len(postings)
+
+        cache.delete(STATS_CACHE_KEY)
+        self.stdout.write(
+            self.style.SUCCESS(f'Productos indexados: {indexed}, términos: {terms}')
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from brand_control.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Libera por lotes las reservas de stock de carritos que ya vencieron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservas liberadas por transacción')
+
+    def handle(self, *args, **options):
+        # Limpieza periódica (cron): lo vencido ya no descuenta del disponible
+        # y se libera al reservar o vender el producto, esto barre el resto
+        released = StockReservation.objects.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reservas liberadas: {released}'))
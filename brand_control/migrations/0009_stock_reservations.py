@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand_control', '0008_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservationCounter',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reservation_counter', serialize=False, to='brand_control.product')),
+                ('reserved', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('line', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservation', to='brand_control.shoppcartdetails')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='brand_control.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at', 'id'], name='reservation_expiry_idx')],
+            },
+        ),
+    ]
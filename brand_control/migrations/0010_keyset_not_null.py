@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def backfill_created_at(apps, schema_editor):
+    # Antes los NULL quedaban al final del listado (los más viejos): se les
+    # da la fecha más antigua de la tabla y el desempate por id los mantiene así
+    for name in ('Product', 'Order', 'ShoppCart'):
+        model = apps.get_model('brand_control', name)
+        missing = model.objects.filter(created_at__isnull=True)
+        if missing.exists():
+            oldest = model.objects.aggregate(oldest=Min('created_at'))['oldest'] or timezone.now()
+            missing.update(created_at=oldest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand_control', '0009_stock_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='shoppcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='reviews',
+            index=models.Index(fields=['-date', '-idreviews'], name='reviews_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppcart',
+            index=models.Index(fields=['-created_at', '-idshoppcart'], name='shoppcart_keyset_idx'),
+        ),
+    ]
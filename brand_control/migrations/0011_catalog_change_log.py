@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_catalog_changes(apps, schema_editor):
+    # Lo existente y los borrados conocidos entran con sequence 0: los tokens
+    # anteriores (con fecha) piden una copia completa, que ya los incluye
+    CatalogChange = apps.get_model('brand_control', 'CatalogChange')
+    CatalogTombstone = apps.get_model('brand_control', 'CatalogTombstone')
+    apps.get_model('brand_control', 'CatalogSyncState').objects.create(id=1)
+    for name in ('product', 'category'):
+        model = apps.get_model('brand_control', name)
+        deleted = set(CatalogTombstone.objects.filter(model=name).values_list('object_id', flat=True))
+        rows = [(pk, False) for pk in model.objects.values_list('pk', flat=True).iterator()]
+        rows += [(pk, True) for pk in deleted]
+        for start in range(0, len(rows), 5000):
+            CatalogChange.objects.bulk_create([
+                CatalogChange(model=name, object_id=pk, deleted=is_deleted, sequence=0)
+                for pk, is_deleted in rows[start:start + 5000]
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand_control', '0010_keyset_not_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(choices=[('product', 'Producto'), ('category', 'Categoría')], max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('sequence', models.BigIntegerField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogSyncState',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(default=1, primary_key=True, serialize=False)),
+                ('sequence', models.BigIntegerField(default=0)),
+                ('pruned_through', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_catalog_changes, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='CatalogTombstone',
+        ),
+        migrations.RemoveIndex(
+            model_name='category',
+            name='category_sync_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_sync_idx',
+        ),
+        migrations.AddIndex(
+            model_name='catalogchange',
+            index=models.Index(fields=['sequence', 'id'], name='catalog_change_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogchange',
+            constraint=models.UniqueConstraint(fields=('model', 'object_id'), name='catalog_change_object_uniq'),
+        ),
+    ]
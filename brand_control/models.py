@@ -1,7 +1,15 @@
-from django.db import models
+import datetime
+from decimal import Decimal
+
+from django.db import connection, models, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
 from django.conf import settings
 from user_control.models import Users
+from .autocomplete import autocomplete_index
+from .fragments import product_fragments
 
 
 # Create your models here.
@@ -10,13 +18,223 @@ class Category(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
     def __str__(self):
         return self.name
 
 
+def _case_by_pk(model, field_name, values):
+    """
+    ``CASE pk WHEN ... THEN ... ELSE columna END`` para ``{pk: valor}``.
+    
+    Se arma como SQL porque con miles de filas compilar una expresión
+    When(pk=...) por fila cuesta mucho más que ejecutar el UPDATE.
+    """
+    quote = connection.ops.quote_name
+    field = model._meta.get_field(field_name)
+    sql = 'CASE %s %s ELSE %s END' % (
+        quote(model._meta.pk.column),
+        ' '.join(['WHEN %s THEN %s'] * len(values)),
+        quote(field.column),
+    )
+    params = []
+    for pk, value in values.items():
+        params.extend((pk, field.get_db_prep_save(value, connection)))
+    return RawSQL(sql, params, output_field=field)
+
+
+def _reserved():
+    """Unidades reservadas del producto de la fila (0 sin contador); una lectura por clave primaria"""
+    counter = StockReservationCounter.objects.filter(product=OuterRef('pk')).values('reserved')
+    return Coalesce(Subquery(counter), 0)
+
+
+def _expired_holds(now):
+    """Unidades de reservas vencidas del producto de la fila, que todavía suman en el contador"""
+    expired = (
+        StockReservation.objects.filter(product=OuterRef('pk'), expires_at__lte=now)
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(expired), 0)
+
+
+class ProductQuerySet(models.QuerySet):
+    """Operaciones de stock atómicas: un UPDATE condicional, sin leer antes la fila"""
+    
+    def with_available_stock(self):
+        """
+        Anota ``available_stock`` (stock menos lo reservado) con un LEFT JOIN
+        al contador; las reservas vencidas que todavía no se liberaron no cuentan.
+        """
+        return self.annotate(
+            available_stock=F('stock') - Coalesce(F('reservation_counter__reserved'), 0) + _expired_holds(timezone.now())
+        )
+    
+    def decrease_stock(self, product_id, quantity):
+        """UPDATE ... SET stock = stock - n WHERE stock >= n + reservado; True si se descontó"""
+        if quantity <= 0:
+            return False
+        StockReservation.objects.reclaim([product_id])
+        updated = self.filter(pk=product_id, stock__gte=quantity + _reserved()).update(
+            stock=F('stock') - quantity,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            record_catalog_changes('product', [product_id])
+        return updated == 1
+    
+    def increase_stock(self, product_id, quantity):
+        """UPDATE ... SET stock = stock + n; True si el producto existe"""
+        if quantity <= 0:
+            return False
+        updated = self.filter(pk=product_id).update(
+            stock=F('stock') + quantity,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            record_catalog_changes('product', [product_id])
+        return updated == 1
+    
+    def decrease_stock_bulk(self, quantities):
+        """
+        Descuenta varias cantidades ({product_id: n}) en un único UPDATE, sin
+        tocar lo reservado por carritos (ver StockReservation).
+        
+        Devuelve False si algún producto no alcanza; en ese caso el llamador
+        debe revertir la transacción porque las demás filas ya se descontaron.
+        """
+        quantities = {pk: n for pk, n in quantities.items() if n > 0}
+        if not quantities:
+            return False
+        StockReservation.objects.reclaim(quantities)
+        amount = Case(
+            *[When(pk=pk, then=Value(n)) for pk, n in quantities.items()],
+            output_field=IntegerField(),
+        )
+        updated = self.filter(pk__in=quantities, stock__gte=amount + _reserved()).update(
+            stock=F('stock') - amount,
+            updated_at=timezone.now(),
+        )
+        if updated != len(quantities):
+            return False
+        record_catalog_changes('product', quantities)
+        return True
+    
+    def increase_stock_bulk(self, quantities):
+        """Suma varias cantidades ({product_id: n}) en un único UPDATE; devuelve las filas actualizadas"""
+        quantities = {pk: n for pk, n in quantities.items() if n > 0}
+        if not quantities:
+            return 0
+        amount = Case(
+            *[When(pk=pk, then=Value(n)) for pk, n in quantities.items()],
+            output_field=IntegerField(),
+        )
+        updated = self.filter(pk__in=quantities).update(
+            stock=F('stock') + amount,
+            updated_at=timezone.now(),
+        )
+        record_catalog_changes('product', quantities)
+        return updated
+    
+    def apply_bulk_changes(self, changes, user=None, reason='Ajuste masivo', chunk_size=500):
+        """
+        Aplica ``[{'id', 'price'?, 'stock'?, 'is_active'?}]`` en una sola
+        transacción, con un UPDATE ... CASE por lote de ``chunk_size`` ids.
+        Las filas se bloquean antes de leer el stock anterior; las que no
+        cambian no se tocan. Cada cambio de stock deja un movimiento
+        'adjustment' con la diferencia.
+        
+        Devuelve ``(productos actualizados, movimientos creados)``. Lanza
+        ValueError si hay ids repetidos o inexistentes (no se aplica nada).
+        """
+        # Solo se usa el id: el usuario puede venir de los claims del JWT
+        user_id = getattr(user, 'pk', None)
+        by_id = {}
+        for change in changes:
+            if change['id'] in by_id:
+                raise ValueError(f"Producto repetido: {change['id']}")
+            by_id[change['id']] = change
+        ids = list(by_id)
+        now = timezone.now()
+        updated = 0
+        movements = 0
+        changed_ids = []
+        visibility = []
+        
+        with transaction.atomic():
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                current = {
+                    row[0]: row for row in self.select_for_update().filter(pk__in=chunk)
+                    .values_list('id', 'price', 'stock', 'is_active', 'name', 'category_id')
+                }
+                missing = sorted(set(chunk) - set(current))
+                if missing:
+                    raise ValueError(f"Productos inexistentes: {', '.join(map(str, missing[:20]))}")
+                
+                values = {'price': {}, 'stock': {}, 'is_active': {}}
+                for pk in chunk:
+                    _, price, stock, is_active, name, category_id = current[pk]
+                    for field, previous in (('price', price), ('stock', stock), ('is_active', is_active)):
+                        if field in by_id[pk] and by_id[pk][field] != previous:
+                            values[field][pk] = by_id[pk][field]
+                    if pk in values['is_active']:
+                        visibility.append((pk, name, category_id, values['is_active'][pk]))
+                changed = set().union(*values.values())
+                if not changed:
+                    continue
+                
+                updates = {
+                    field: _case_by_pk(self.model, field, per_product)
+                    for field, per_product in values.items() if per_product
+                }
+                updated += self.filter(pk__in=changed).update(**updates, updated_at=now)
+                record_catalog_changes('product', changed)
+                StockMovement.objects.bulk_create([
+                    StockMovement(
+                        product_id=pk,
+                        movement_type='adjustment',
+                        quantity=new_stock - current[pk][2],
+                        previous_stock=current[pk][2],
+                        new_stock=new_stock,
+                        reason=reason,
+                        user_id=user_id,
+                    )
+                    for pk, new_stock in values['stock'].items()
+                ])
+                movements += len(values['stock'])
+                changed_ids.extend(changed)
+            
+            # update() no dispara señales: cachés y autocompletado se actualizan acá
+            product_fragments.invalidate_many(changed_ids)
+            
+            def after_commit():
+                product_fragments.invalidate_many(changed_ids)
+                for pk, name, category_id, is_active in visibility:
+                    autocomplete_index.update_product(pk, name, category_id, is_active)
+            transaction.on_commit(after_commit)
+        return updated, movements
+    
+    def apply_review_delta(self, product_id, rating, delta):
+        """Suma (delta=1) o resta (delta=-1) una reseña a los agregados del producto"""
+        if rating not in Product.RATING_VALUES:
+            return False
+        updated = self.filter(pk=product_id).update(**{
+            'review_count': F('review_count') + delta,
+            'rating_sum': F('rating_sum') + rating * delta,
+            f'rating_{rating}': F(f'rating_{rating}') + delta,
+            'updated_at': timezone.now(),
+        })
+        if updated:
+            record_catalog_changes('product', [product_id])
+        return updated == 1
+
+
 class Product(models.Model):
     id = models.AutoField(primary_key=True)
+    # Código del producto en el catálogo de la empresa; clave de la importación masiva
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -26,29 +244,150 @@ class Product(models.Model):
     type = models.CharField(max_length=100, default='General')
     category_id = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, db_column='category_id')
     is_active = models.BooleanField(default=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Clave de la paginación por cursor: sin NULL para que el índice resuelva orden y filtro
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
+    # Agregados de reseñas mantenidos de forma incremental (ver ReviewsSerializerView)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    
+    RATING_VALUES = range(1, 6)
+    REVIEW_STATS_FIELDS = ['review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+    
+    objects = ProductQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_keyset_idx'),
+            # Filtros por facets (ver filters.py): el precio al final permite rangos
+            models.Index(fields=['is_active', 'category_id', 'price'], name='product_active_cat_price_idx'),
+            models.Index(fields=['is_active', 'type', 'price'], name='product_active_type_price_idx'),
+            models.Index(fields=['is_active', 'price'], name='product_active_price_idx'),
+        ]
+    
     def __str__(self):
         return self.name
     
     def update_stock(self, quantity, operation='decrease'):
-        """Actualiza el stock del producto"""
+        """Actualiza el stock del producto en la base con un UPDATE atómico"""
         if operation == 'decrease':
-            if self.stock >= quantity:
-                self.stock -= quantity
-                self.save()
-                return True
-            return False
+            success = Product.objects.decrease_stock(self.pk, quantity)
         elif operation == 'increase':
-            self.stock += quantity
-            self.save()
-            return True
-        return False
+            success = Product.objects.increase_stock(self.pk, quantity)
+        else:
+            return False
+        if success:
+            # Solo se recargan las columnas afectadas
+            self.refresh_from_db(fields=['stock', 'updated_at'])
+        return success
     
     def has_stock(self, quantity):
         """Verifica si hay stock suficiente"""
         return self.stock >= quantity
+    
+    def get_available_stock(self):
+        """Stock que se puede vender: el guardado menos lo reservado por carritos"""
+        if hasattr(self, 'available_stock'):
+            return self.available_stock
+        reserved = StockReservationCounter.objects.filter(product_id=self.pk).values_list('reserved', flat=True).first()
+        # Las reservas vencidas que todavía no se liberaron no cuentan
+        expired = StockReservation.objects.filter(product_id=self.pk, expires_at__lte=timezone.now()).aggregate(
+            total=Sum('quantity')
+        )['total']
+        return self.stock - (reserved or 0) + (expired or 0)
+    
+    @property
+    def rating_average(self):
+        """Promedio de calificaciones calculado con los agregados guardados"""
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
+    
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, f'rating_{rating}') for rating in self.RATING_VALUES}
+
+
+# Totales de órdenes y carritos calculados en la base
+TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total(price='price', quantity='quantity'):
+    """precio * cantidad de una línea de orden o carrito"""
+    return ExpressionWrapper(F(price) * F(quantity), output_field=TOTAL_FIELD)
+
+
+def sum_of_lines(price='price', quantity='quantity'):
+    """SUM(precio * cantidad), 0 si no hay líneas"""
+    return Coalesce(Sum(line_total(price, quantity)), Value(Decimal('0')), output_field=TOTAL_FIELD)
+
+
+def lines_total(lines, group_by, price='price'):
+    """Total de ``lines`` (ya filtradas por OuterRef) como subconsulta para anotar listados"""
+    totals = lines.order_by().values(group_by).annotate(total=sum_of_lines(price)).values('total')
+    return Coalesce(Subquery(totals), Value(Decimal('0')), output_field=TOTAL_FIELD)
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Anota ``items_total``: la suma de las líneas de cada orden, en la misma consulta"""
+        lines = OrderDetails.objects.filter(idorder=OuterRef('pk'))
+        return self.annotate(items_total=lines_total(lines, 'idorder'))
+    
+    def cancel(self):
+        """
+        Cancela las órdenes pendientes del queryset y restaura su stock.
+        
+        Todo ocurre en una transacción con las órdenes bloqueadas, así dos
+        cancelaciones simultáneas no devuelven el stock dos veces. La cantidad
+        de consultas no depende de las órdenes ni de las líneas: un UPDATE
+        suma el stock de todos los productos, los movimientos se insertan con
+        bulk_create y otro UPDATE cambia el estado. Devuelve los ids cancelados.
+        """
+        with transaction.atomic():
+            orders = dict(
+                self.select_for_update().filter(status='pending')
+                .order_by('idorder').values_list('idorder', 'user_id')
+            )
+            if not orders:
+                return []
+            lines = list(
+                OrderDetails.objects.filter(idorder__in=orders)
+                .order_by('idorder', 'idorderdetails').values_list('idorder', 'idproduct', 'quantity')
+            )
+            
+            quantities = {}
+            for _, product_id, quantity in lines:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            Product.objects.increase_stock_bulk(quantities)
+            stocks = dict(Product.objects.filter(pk__in=quantities).values_list('id', 'stock'))
+            
+            # Un movimiento por línea, con el stock acumulado en el orden de las líneas
+            running = {pk: stock - quantities[pk] for pk, stock in stocks.items()}
+            movements = []
+            for order_id, product_id, quantity in lines:
+                if product_id not in running or quantity <= 0:
+                    continue
+                movements.append(StockMovement(
+                    product_id=product_id,
+                    movement_type='in',
+                    quantity=quantity,
+                    previous_stock=running[product_id],
+                    new_stock=running[product_id] + quantity,
+                    reason=f'Restauración por cancelación de orden {order_id}',
+                    user_id=orders[order_id],
+                ))
+                running[product_id] += quantity
+            StockMovement.objects.bulk_create(movements)
+            
+            Order.objects.filter(pk__in=orders).update(status='cancelled', updated_at=timezone.now())
+        return list(orders)
 
 
 class Order(models.Model):
@@ -65,42 +404,36 @@ class Order(models.Model):
     date = models.DateTimeField(default=timezone.now)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
+    objects = OrderQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-idorder'], name='order_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Orden {self.idorder} - {self.user.username if self.user else 'Sin usuario'}"
     
     def calculate_total(self):
-        """Calcula el total de la orden"""
-        total = sum(detail.price * detail.quantity for detail in self.orderdetails_set.all())
-        self.total = total
-        self.save()
-        return total
+        """Calcula el total de la orden con un SUM en la base y guarda solo ese campo"""
+        self.total = self.orderdetails_set.aggregate(total=sum_of_lines())['total']
+        # updated_at también: el ETag de las órdenes se arma con él
+        self.save(update_fields=['total', 'updated_at'])
+        return self.total
     
     def cancel_order(self):
-        """Cancela la orden y restaura el stock"""
-        if self.status == 'pending':
-            # Restaurar stock de todos los productos
-            for detail in self.orderdetails_set.all():
-                previous_stock = detail.idproduct.stock
-                detail.idproduct.update_stock(detail.quantity, 'increase')
-                
-                # Crear movimiento de stock para restauración
-                StockMovement.objects.create(
-                    product=detail.idproduct,
-                    movement_type='in',
-                    quantity=detail.quantity,
-                    previous_stock=previous_stock,
-                    new_stock=detail.idproduct.stock,
-                    reason=f'Restauración por cancelación de orden {self.idorder}',
-                    user=self.user
-                )
-            
-            self.status = 'cancelled'
-            self.save()
-            return True
-        return False
+        """Cancela la orden (si sigue pendiente) y restaura el stock"""
+        if self.status != 'pending':
+            return False
+        # El estado se vuelve a verificar con la fila bloqueada (ver OrderQuerySet.cancel)
+        if not Order.objects.filter(pk=self.pk).cancel():
+            self.refresh_from_db(fields=['status', 'updated_at'])
+            return False
+        self.refresh_from_db(fields=['status', 'updated_at'])
+        return True
 
 
 class OrderDetails(models.Model):
@@ -116,42 +449,127 @@ class OrderDetails(models.Model):
     def save(self, *args, **kwargs):
         # Si es una nueva instancia, actualizar el stock
         if not self.pk:
-            if self.idproduct.has_stock(self.quantity):
-                previous_stock = self.idproduct.stock
-                self.idproduct.update_stock(self.quantity, 'decrease')
+            with transaction.atomic():
+                # El UPDATE condicional evita vender por encima del stock
+                # aunque haya compras concurrentes del mismo producto
+                if not self.idproduct.update_stock(self.quantity, 'decrease'):
+                    raise ValueError(f"Stock insuficiente para {self.idproduct.name}")
                 
                 # Crear movimiento de stock
                 StockMovement.objects.create(
                     product=self.idproduct,
                     movement_type='out',
                     quantity=self.quantity,
-                    previous_stock=previous_stock,
+                    previous_stock=self.idproduct.stock + self.quantity,
                     new_stock=self.idproduct.stock,
                     reason=f'Venta - Orden {self.idorder.idorder}',
                     user=self.idorder.user
                 )
-            else:
-                raise ValueError(f"Stock insuficiente para {self.idproduct.name}")
+                super().save(*args, **kwargs)
+            return
         
         super().save(*args, **kwargs)
 
 
+class ShoppCartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Anota ``items_total`` (precio actual * cantidad de cada línea) en la misma consulta"""
+        lines = ShoppCartDetails.objects.filter(idshoppcart=OuterRef('pk'))
+        return self.annotate(items_total=lines_total(lines, 'idshoppcart', 'idproduct__price'))
+
+
 class ShoppCart(models.Model):
     idshoppcart = models.AutoField(primary_key=True)
     user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='shopping_carts', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
+    objects = ShoppCartQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-idshoppcart'], name='shoppcart_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Carrito {self.idshoppcart} - {self.user.username if self.user else 'Sin usuario'}"
     
     def get_total(self):
-        """Calcula el total del carrito"""
-        return sum(detail.idproduct.price * detail.quantity for detail in self.shoppcartdetails_set.all())
+        """Calcula el total del carrito con un SUM en la base (o usa el de ``with_totals()``)"""
+        if hasattr(self, 'items_total'):
+            return self.items_total
+        return self.shoppcartdetails_set.aggregate(total=sum_of_lines('idproduct__price'))['total']
     
     def clear_cart(self):
-        """Vacía el carrito"""
-        self.shoppcartdetails_set.all().delete()
+        """Vacía el carrito y libera sus reservas"""
+        with transaction.atomic():
+            StockReservation.objects.filter(line__idshoppcart=self).release()
+            self.shoppcartdetails_set.all().delete()
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockReservation.objects.filter(line__idshoppcart=self).release()
+            return super().delete(*args, **kwargs)
+    
+    def checkout(self, user=None):
+        """
+        Convierte el carrito en una orden dentro de una sola transacción.
+        
+        La cantidad de consultas no depende de las líneas del carrito: las
+        reservas se liberan en bloque, el stock se descuenta con un único
+        UPDATE y los detalles y movimientos se insertan con bulk_create.
+        """
+        # Solo se usa el id: el usuario puede venir de los claims del JWT
+        user_id = self.user_id or getattr(user, 'pk', None)
+        with transaction.atomic():
+            details = list(self.shoppcartdetails_set.select_related('idproduct'))
+            if not details:
+                raise ValueError("El carrito está vacío")
+            # Las reservas del carrito se liberan y pasan a ser la venta; si
+            # alguna venció, lo que falte se valida contra el stock disponible
+            StockReservation.objects.filter(line__idshoppcart=self).release()
+            
+            # Un mismo producto puede aparecer en más de una línea
+            quantities = {}
+            products = {}
+            for detail in details:
+                quantities[detail.idproduct_id] = quantities.get(detail.idproduct_id, 0) + detail.quantity
+                products[detail.idproduct_id] = detail.idproduct
+            
+            if not Product.objects.decrease_stock_bulk(quantities):
+                raise ValueError("Stock insuficiente para completar la orden")
+            stocks = dict(Product.objects.filter(pk__in=quantities).values_list('id', 'stock'))
+            
+            order = Order.objects.create(
+                user_id=user_id,
+                total=sum(detail.idproduct.price * detail.quantity for detail in details),
+            )
+            # bulk_create no ejecuta OrderDetails.save: el stock ya se descontó arriba
+            OrderDetails.objects.bulk_create([
+                OrderDetails(
+                    idproduct=detail.idproduct,
+                    idorder=order,
+                    quantity=detail.quantity,
+                    price=detail.idproduct.price,
+                )
+                for detail in details
+            ])
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    product=products[product_id],
+                    movement_type='out',
+                    quantity=quantity,
+                    previous_stock=stocks[product_id] + quantity,
+                    new_stock=stocks[product_id],
+                    reason=f'Venta - Orden {order.idorder}',
+                    user_id=user_id,
+                )
+                for product_id, quantity in quantities.items()
+            ])
+            self.clear_cart()
+            # bulk_create no dispara post_save: se informan las ventas al autocompletado
+            transaction.on_commit(lambda: autocomplete_index.record_sales(quantities))
+        return order
 
 
 class ShoppCartDetails(models.Model):
@@ -164,10 +582,165 @@ class ShoppCartDetails(models.Model):
         return f"Carrito {self.idshoppcartdetails} - {self.idproduct.name}"
     
     def save(self, *args, **kwargs):
-        # Verificar stock antes de agregar al carrito
-        if not self.idproduct.has_stock(self.quantity):
-            raise ValueError(f"Stock insuficiente para {self.idproduct.name}")
-        super().save(*args, **kwargs)
+        # La línea reserva su cantidad por un tiempo (ver StockReservation);
+        # si no hay stock disponible no se guarda
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not StockReservation.objects.hold(self):
+                raise ValueError(f"Stock insuficiente para {self.idproduct.name}")
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockReservation.objects.filter(line=self).release()
+            return super().delete(*args, **kwargs)
+
+
+class StockReservationCounter(models.Model):
+    """
+    Unidades reservadas por carritos, por producto.
+    
+    Está separado de Product para que reservar no bloquee ni modifique la
+    fila del producto. Siempre vale la suma de las reservas existentes
+    (vencidas o no), así el disponible es ``stock - reserved`` sin recorrerlas.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='reservation_counter')
+    reserved = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Reservado de {self.product_id}: {self.reserved}"
+
+
+def _add_reserved(deltas):
+    """
+    Aplica ``{product_id: delta}`` a los contadores de reservas. Las bajas van
+    en un único UPDATE; cada alta es un UPDATE condicional que solo reserva si
+    queda stock disponible. Devuelve False si alguna alta no entró: el llamador
+    debe revertir la transacción.
+    """
+    deltas = {pk: n for pk, n in deltas.items() if n}
+    decreases = {pk: -n for pk, n in deltas.items() if n < 0}
+    increases = {pk: n for pk, n in deltas.items() if n > 0}
+    if decreases:
+        StockReservationCounter.objects.filter(pk__in=decreases).update(
+            reserved=F('reserved') - Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in decreases.items()],
+                output_field=IntegerField(),
+            )
+        )
+    if increases:
+        StockReservationCounter.objects.bulk_create(
+            [StockReservationCounter(product_id=pk) for pk in increases], ignore_conflicts=True
+        )
+        stock = Product.objects.filter(pk=OuterRef('pk')).values('stock')
+        for pk, n in increases.items():
+            # El stock se lee en la misma sentencia, sin bloquear la fila del producto
+            updated = StockReservationCounter.objects.filter(pk=pk, reserved__lte=Subquery(stock) - n).update(
+                reserved=F('reserved') + n
+            )
+            if not updated:
+                return False
+    return True
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def hold(self, line, ttl=None):
+        """
+        Reserva la cantidad de una línea de carrito por ``ttl`` segundos
+        (``STOCK_RESERVATION_TTL`` por defecto). Si la línea ya tenía reserva
+        la ajusta a la cantidad actual y renueva el vencimiento. Devuelve
+        False, sin reservar nada, si no hay stock disponible. Lanza ValueError
+        si la cantidad no es positiva.
+        """
+        if line.quantity <= 0:
+            raise ValueError("La cantidad debe ser mayor a cero")
+        if ttl is None:
+            ttl = getattr(settings, 'STOCK_RESERVATION_TTL', 900)
+        expires_at = timezone.now() + datetime.timedelta(seconds=ttl)
+        with transaction.atomic():
+            self.reclaim([line.idproduct_id])
+            current = self.select_for_update().filter(line=line).first()
+            deltas = {line.idproduct_id: line.quantity}
+            if current is not None:
+                deltas[current.product_id] = deltas.get(current.product_id, 0) - current.quantity
+            if not _add_reserved(deltas):
+                transaction.set_rollback(True)
+                return False
+            if current is None:
+                self.create(line=line, product_id=line.idproduct_id, quantity=line.quantity, expires_at=expires_at)
+            else:
+                self.filter(pk=current.pk).update(
+                    product_id=line.idproduct_id, quantity=line.quantity, expires_at=expires_at
+                )
+        return True
+    
+    def release(self):
+        """Borra las reservas del queryset y las descuenta de los contadores; devuelve cuántas eran"""
+        with transaction.atomic():
+            holds = list(self.select_for_update().values_list('id', 'product_id', 'quantity'))
+            if not holds:
+                return 0
+            deltas = {}
+            for _, product_id, quantity in holds:
+                deltas[product_id] = deltas.get(product_id, 0) - quantity
+            _add_reserved(deltas)
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in holds]).delete()
+        return len(holds)
+    
+    def reclaim(self, product_ids):
+        """
+        Libera las reservas vencidas de ``product_ids``. Se llama antes de
+        comprobar el disponible para que una reserva vencida no bloquee stock
+        hasta que pase ``release_stock_reservations``.
+        """
+        return self.filter(product_id__in=product_ids, expires_at__lte=timezone.now()).release()
+    
+    def release_expired(self, batch_size=1000, now=None):
+        """Libera las reservas vencidas en lotes de ``batch_size``, una transacción por lote"""
+        now = now or timezone.now()
+        released = 0
+        while True:
+            ids = list(
+                self.filter(expires_at__lte=now).order_by('expires_at', 'id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            # Se vuelve a filtrar con las filas bloqueadas: una reserva renovada
+            # mientras tanto no se libera
+            released += self.filter(pk__in=ids, expires_at__lte=now).release()
+            if len(ids) < batch_size:
+                break
+        return released
+
+
+class StockReservation(models.Model):
+    """
+    Reserva temporal de stock de una línea de carrito.
+    
+    Se crea o renueva al guardar la línea, pasa a ser venta en el checkout y
+    se libera al quitar la línea o vaciar el carrito. Las vencidas dejan de
+    contar como reservadas: se liberan al reservar o vender ese producto
+    (``reclaim``) y ``release_stock_reservations`` libera por lotes las de
+    carritos abandonados.
+    """
+    id = models.BigAutoField(primary_key=True)
+    line = models.OneToOneField(
+        ShoppCartDetails, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservation'
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+    
+    objects = StockReservationQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at', 'id'], name='reservation_expiry_idx'),
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_expiry_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Reserva {self.id} - {self.product_id} x {self.quantity}"
 
 
 class Reviews(models.Model):
@@ -178,6 +751,11 @@ class Reviews(models.Model):
     comment = models.TextField()
     date = models.DateTimeField(default=timezone.now)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-idreviews'], name='reviews_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Review {self.idreviews} - {self.idproduct.name}"
 
@@ -215,3 +793,93 @@ class StockMovement(models.Model):
     
     def __str__(self):
         return f"Movimiento {self.id} - {self.product.name} ({self.movement_type})"
+
+
+class ProductSearchDocument(models.Model):
+    """Datos por producto del índice de búsqueda (ver search.py)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+    signature = models.CharField(max_length=40)
+    
+    def __str__(self):
+        return f"Índice de {self.product_id}"
+
+
+class ProductSearchPosting(models.Model):
+    """Aparición de un término normalizado en un producto"""
+    id = models.BigAutoField(primary_key=True)
+    document = models.ForeignKey(ProductSearchDocument, on_delete=models.CASCADE, related_name='postings')
+    term = models.CharField(max_length=64)
+    frequency = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'document'], name='search_posting_term_document_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} -> {self.document_id}"
+
+
+class CatalogChange(models.Model):
+    """
+    Último cambio de cada producto o categoría, para la sincronización
+    incremental (ver sync.py).
+    
+    Se escribe en la misma transacción que el cambio, con ``sequence`` en
+    NULL; el número lo asigna después ``assign_catalog_sequences`` a las filas
+    ya confirmadas. Así el orden de ``sequence`` es el orden de confirmación
+    y un cliente nunca deja atrás una transacción lenta.
+    """
+    MODEL_CHOICES = [
+        ('product', 'Producto'),
+        ('category', 'Categoría'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    sequence = models.BigIntegerField(null=True, blank=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id'], name='catalog_change_object_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['sequence', 'id'], name='catalog_change_seq_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.model} {self.object_id} ({self.sequence})"
+
+
+class CatalogSyncState(models.Model):
+    """Fila única con el último ``sequence`` asignado; se bloquea para asignar el siguiente"""
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    sequence = models.BigIntegerField(default=0)
+    # Los borrados hasta acá ya se eliminaron: un token anterior pide copia completa
+    pruned_through = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Sincronización en {self.sequence}"
+
+
+def record_catalog_changes(model_name, ids, deleted=False):
+    """
+    Marca productos o categorías como cambiados (``model_name`` 'product' o
+    'category') en la transacción en curso. Hace falta en todo lo que escriba
+    esas tablas sin pasar por ``save()``/``delete()`` (que usan señales).
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    now = timezone.now()
+    CatalogChange.objects.bulk_create(
+        [CatalogChange(model=model_name, object_id=pk, deleted=deleted, sequence=None, changed_at=now) for pk in ids],
+        update_conflicts=True,
+        update_fields=['deleted', 'sequence', 'changed_at'],
+        # MySQL no admite indicar la restricción (ON DUPLICATE KEY UPDATE)
+        unique_fields=['model', 'object_id'] if connection.features.supports_update_conflicts_with_target else None,
+    )
@@ -0,0 +1,163 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) ordenada de forma descendente.
+
+    La posición se codifica con los valores de ``keyset_ordering`` del último
+    elemento de la página, de modo que la página N cuesta lo mismo que la 1.
+    El último campo de ``keyset_ordering`` debe ser único (la clave primaria)
+    y ninguno admite NULL: así el orden y el filtro los resuelve un índice
+    sobre esas columnas, también en MySQL (que no tiene NULLS LAST).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 200
+    keyset_ordering = ('created_at', 'id')
+
+    def get_keyset_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', self.keyset_ordering))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_keyset_ordering(view)
+        self.page_size_value = self.get_page_size(request)
+        model = queryset.model
+
+        queryset = queryset.order_by(*[f'-{name}' for name in self.ordering])
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded, model)
+            queryset = queryset.filter(self.build_filter(position, model))
+
+        # Se pide un elemento extra para saber si existe una página siguiente
+        results = list(queryset[:self.page_size_value + 1])
+        self.has_next = len(results) > self.page_size_value
+        results = results[:self.page_size_value]
+        self.last_position = self.get_position(results[-1]) if results else None
+        return results
+
+    def paginate_ranking(self, ranking, queryset, request):
+        """
+        Pagina una lista ``[(pk, score), ...]`` ya ordenada por relevancia.
+
+        El cursor guarda (score, pk) del último elemento. Los pks que no estén
+        en ``queryset`` (p. ej. por filtros) se saltean.
+        """
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            try:
+                raw = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+                last = (float(raw[0]), int(raw[1]))
+            except (TypeError, ValueError, IndexError, KeyError, UnicodeError):
+                raise NotFound('Cursor inválido')
+            ranking = [item for item in ranking if (item[1], item[0]) < last]
+
+        # Se piden lotes hasta completar la página (más uno para saber si hay otra)
+        results = []
+        wanted = self.page_size_value + 1
+        start = 0
+        while len(results) < wanted and start < len(ranking):
+            chunk = ranking[start:start + wanted * 2]
+            start += len(chunk)
+            found = queryset.in_bulk([pk for pk, _ in chunk])
+            results.extend((found[pk], score) for pk, score in chunk if pk in found)
+
+        self.has_next = len(results) > self.page_size_value
+        results = results[:self.page_size_value]
+        self.last_position = [results[-1][1], results[-1][0].pk] if results else None
+        return [instance for instance, _ in results]
+
+    def get_position(self, instance):
+        # Filas de values(): las claves son los nombres de los campos
+        if isinstance(instance, dict):
+            return [instance[name] for name in self.ordering]
+        # attname devuelve el valor crudo (p. ej. ``category_id_id`` en las FKs)
+        return [
+            getattr(instance, instance._meta.get_field(name).attname)
+            for name in self.ordering
+        ]
+
+    def build_filter(self, position, model):
+        """Arma la condición "estrictamente después de" para un orden descendente."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            condition |= equal & Q(**{f'{name}__lt': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, default=_encode_value).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, encoded, model):
+        try:
+            raw = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if not isinstance(raw, list) or len(raw) != len(self.ordering):
+                raise ValueError
+            if None in raw:
+                raise ValueError
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.ordering, raw)]
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound('Cursor inválido')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_position))
+
+    def get_first_link(self):
+        if self.cursor_query_param not in self.request.query_params:
+            return None
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder recorta los microsegundos y rompería la comparación
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
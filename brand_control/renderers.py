@@ -0,0 +1,66 @@
+"""
+Renderer y parser JSON con orjson.
+
+Generan el mismo JSON que los de DRF: los tipos que orjson no resuelve igual
+(``Decimal``, datetimes, textos traducibles, querysets...) pasan por el
+``default`` del encoder de DRF. Si orjson no está instalado, o el pedido
+requiere algo que orjson no ofrece (indentación, ``ensure_ascii``), se usa
+la implementación de DRF con la librería json estándar.
+"""
+
+import codecs
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser, get_encoding
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Con OPT_PASSTHROUGH_DATETIME las fechas usan el formato de DRF ("Z" en UTC)
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` con orjson"""
+
+    def __init__(self):
+        self.default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # Enteros de más de 64 bits, claves raras, recursión: que decida json
+            return super().render(data, accepted_media_type, renderer_context)
+        # Igual que DRF: la salida tiene que ser un subconjunto válido de javascript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """``JSONParser`` con orjson"""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # orjson rechaza NaN/Infinity siempre, como STRICT_JSON
+        if orjson is None or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+        encoding = get_encoding(parser_context or {})
+        try:
+            body = stream.read()
+            if codecs.lookup(encoding).name != 'utf-8':
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,227 @@
+"""
+Búsqueda de texto sobre productos con un índice invertido propio.
+
+Por cada producto se guarda un ``ProductSearchDocument`` (largo ponderado y
+huella del texto indexado) y un ``ProductSearchPosting`` por término con su
+frecuencia. Los textos se normalizan para español: minúsculas, sin acentos,
+sin stopwords y con un stemming liviano de plurales. El ranking es BM25.
+
+La cantidad de documentos y el largo promedio que usa BM25 se cachean
+``SEARCH_STATS_CACHE_TIMEOUT`` segundos: recalcularlos en cada búsqueda
+recorrería toda la tabla de documentos, y un desfase chico no cambia el
+orden de forma apreciable.
+"""
+
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+
+# Peso de cada campo en la frecuencia de los términos
+FIELD_WEIGHTS = {'name': 3, 'type': 2, 'description': 1}
+INDEXED_FIELDS = tuple(FIELD_WEIGHTS)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TERM_LENGTH = 64
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual
+cuando de del desde donde durante e el ella ellas ellos en entre era es esa esas
+ese eso esos esta estas este esto estos fue ha hasta hay la las le les lo los mas
+me mi mis muy ni no nos o os otra otras otro otros para pero poco por porque que
+quien se sea ser si sin sobre su sus tambien tan te tiene tu tus un una unas uno
+unos y ya
+""".split())
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+STATS_CACHE_KEY = 'brand_control:search_stats'
+
+
+def fold(text):
+    """Minúsculas y sin acentos ni diéresis (``Canción`` -> ``cancion``)"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def stem(word):
+    """Stemming liviano: lleva los plurales habituales al singular"""
+    if len(word) > 4 and word.endswith('ces'):
+        return word[:-3] + 'z'
+    if len(word) > 4 and word.endswith('es') and word[-3] not in 'aeiou':
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and word[-2] in 'aeiou':
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [
+        stem(token)[:MAX_TERM_LENGTH]
+        for token in _TOKEN_RE.findall(fold(text or ''))
+        if token not in STOPWORDS
+    ]
+
+
+def document_terms(values):
+    """Frecuencias ponderadas y largo de un producto a partir de sus campos"""
+    frequencies = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(values.get(field)):
+            frequencies[term] += weight
+    return frequencies, sum(frequencies.values())
+
+
+def document_signature(values):
+    text = '\x1f'.join(values.get(field) or '' for field in INDEXED_FIELDS)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def build_index_rows(product_id, values):
+    """Documento y postings (sin guardar) para un producto"""
+    from .models import ProductSearchDocument, ProductSearchPosting
+
+    frequencies, length = document_terms(values)
+    document = ProductSearchDocument(
+        product_id=product_id,
+        length=length,
+        signature=document_signature(values),
+    )
+    postings = [
+        ProductSearchPosting(document_id=product_id, term=term, frequency=frequency)
+        for term, frequency in frequencies.items()
+    ]
+    return document, postings
+
+
+def index_product(product):
+    """Reindexa un producto; no escribe nada si su texto no cambió"""
+    from .models import ProductSearchDocument, ProductSearchPosting
+
+    values = {field: getattr(product, field) for field in INDEXED_FIELDS}
+    current = (
+        ProductSearchDocument.objects.filter(product_id=product.pk)
+        .values_list('signature', flat=True).first()
+    )
+    if current == document_signature(values):
+        return False
+
+    document, postings = build_index_rows(product.pk, values)
+    with transaction.atomic():
+        if current is None:
+            document.save(force_insert=True)
+        else:
+            document.save(force_update=True)
+            ProductSearchPosting.objects.filter(document_id=product.pk).delete()
+        ProductSearchPosting.objects.bulk_create(postings)
+    return True
+
+
+def index_products(values_by_id):
+    """
+    Reindexa varios productos (``{product_id: {campo: valor}}``) con unas
+    pocas consultas, para los cambios masivos que no disparan señales.
+    Devuelve cuántos cambiaron.
+    """
+    from .models import ProductSearchDocument, ProductSearchPosting
+
+    current = dict(
+        ProductSearchDocument.objects.filter(product_id__in=values_by_id)
+        .values_list('product_id', 'signature')
+    )
+    new_documents, changed_documents, postings = [], [], []
+    for product_id, values in values_by_id.items():
+        signature = document_signature(values)
+        if current.get(product_id) == signature:
+            continue
+        frequencies, length = document_terms(values)
+        document = ProductSearchDocument(product_id=product_id, length=length, signature=signature)
+        (changed_documents if product_id in current else new_documents).append(document)
+        postings.extend((product_id, term, frequency) for term, frequency in frequencies.items())
+
+    with transaction.atomic():
+        if changed_documents:
+            ProductSearchPosting.objects.filter(document_id__in=[d.product_id for d in changed_documents]).delete()
+            ProductSearchDocument.objects.bulk_update(changed_documents, ['length', 'signature'])
+        ProductSearchDocument.objects.bulk_create(new_documents)
+        _insert_postings(postings)
+    return len(new_documents) + len(changed_documents)
+
+
+def _insert_postings(rows):
+    """
+    INSERT de postings ``(document_id, term, frequency)`` con ``executemany``.
+    Una importación genera decenas por producto y armar una instancia del
+    modelo para cada una es la mayor parte del costo de ``bulk_create``.
+    """
+    from .models import ProductSearchPosting
+
+    if not rows:
+        return
+    meta = ProductSearchPosting._meta
+    quote = connection.ops.quote_name
+    columns = [meta.get_field(name).column for name in ('document', 'term', 'frequency')]
+    sql = 'INSERT INTO %s (%s) VALUES (%%s, %%s, %%s)' % (
+        quote(meta.db_table), ', '.join(quote(column) for column in columns)
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def corpus_stats():
+    """(documentos indexados, largo promedio) para BM25, cacheados"""
+    from .models import ProductSearchDocument
+
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = ProductSearchDocument.objects.aggregate(total=Count('product_id'), avg_length=Avg('length'))
+        stats = (aggregate['total'], aggregate['avg_length'] or 1)
+        cache.set(STATS_CACHE_KEY, stats, getattr(settings, 'SEARCH_STATS_CACHE_TIMEOUT', 300))
+    return stats
+
+
+def search_products(query):
+    """
+    Productos que contienen algún término de ``query``, como una lista
+    ``[(product_id, score), ...]`` ordenada por score y luego por id descendente.
+    """
+    from .models import ProductSearchPosting
+
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    rows = list(
+        ProductSearchPosting.objects.filter(term__in=terms)
+        .values_list('document_id', 'term', 'frequency', 'document__length')
+    )
+    if not rows:
+        return []
+
+    total, avg_length = corpus_stats()
+    document_frequency = Counter(term for _, term, _, _ in rows)
+    # Con la cantidad cacheada desfasada, ningún término puede estar en más documentos que el total
+    total = max(total, *document_frequency.values())
+    idf = {
+        term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+        for term, df in document_frequency.items()
+    }
+
+    scores = Counter()
+    for product_id, term, frequency, length in rows:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores[product_id] += idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+    # El redondeo deja el score estable para usarlo en el cursor de paginación
+    return sorted(
+        ((product_id, round(score, 6)) for product_id, score in scores.items()),
+        key=lambda item: (item[1], item[0]),
+        reverse=True,
+    )
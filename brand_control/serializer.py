@@ -1,6 +1,64 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import *
 
+
+class SparseFieldsMixin:
+    """
+    Permite elegir los campos de la respuesta en las lecturas:
+
+    - ``?fields=a,b`` solo esos campos
+    - ``?omit=a,b`` todos menos esos
+    - ``?view=compact`` los de ``Meta.compact_fields``
+
+    ``get_only_fields()`` devuelve las columnas necesarias para que la vista
+    pida solo esas con ``.only()``. Los campos calculados declaran sus
+    columnas en ``Meta.field_sources``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.get_selected_fields()
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+    def get_selected_fields(self):
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = request.query_params
+        available = set(self.fields)
+        selected = None
+        if params.get('view') == 'compact':
+            selected = set(getattr(self.Meta, 'compact_fields', available))
+        if params.get('fields'):
+            requested = {name.strip() for name in params['fields'].split(',')}
+            selected = requested if selected is None else selected & requested
+        if params.get('omit'):
+            omitted = {name.strip() for name in params['omit'].split(',')}
+            selected = (available if selected is None else selected) - omitted
+        return None if selected is None else selected & available
+
+    def get_only_fields(self):
+        """Columnas del modelo que usan los campos elegidos, o None si son todas"""
+        if self.get_selected_fields() is None:
+            return None
+        model = self.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        sources = getattr(self.Meta, 'field_sources', {})
+        columns = {model._meta.pk.name}
+        for name, field in self.fields.items():
+            if name in sources:
+                columns.update(sources[name])
+                continue
+            source = field.source.split('.')[0]
+            if source == '*':
+                return None
+            if source in concrete:
+                columns.add(source)
+        return sorted(columns)
+
 # class UserSerializer(serializers.ModelSerializer):
 #     class Meta:
 #         model = User
@@ -8,11 +66,29 @@ from .models import *
 #         fields = '__all__'
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Se calcula con los agregados del producto, sin consultar la tabla de reseñas
+    rating_average = serializers.FloatField(read_only=True)
+
     class Meta:
         model = Product
         # fields = ('idproduct', 'name', 'description', 'price', 'image', 'stock', 'url_download', 'category')
         fields = '__all__'
+        read_only_fields = Product.REVIEW_STATS_FIELDS
+        compact_fields = ['id', 'name', 'price', 'image', 'stock', 'rating_average']
+        field_sources = {'rating_average': ['review_count', 'rating_sum']}
+
+
+class ProductBulkChangeSerializer(serializers.Serializer):
+    """Un cambio de la actualización masiva de productos"""
+    id = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    is_active = serializers.BooleanField(required=False)
+
+
+class OrderBulkCancelSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10_000)
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -22,11 +98,12 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         # fields = ('iduser', 'username', "password", "email",'phone', 'addres')
         fields = '__all__'
+        compact_fields = ['idorder', 'status', 'total', 'date']
 
 class OrderDetailsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -50,11 +127,15 @@ class OrderDetailsSerializer(serializers.ModelSerializer):
 #         # fields = ('iduser', 'username', "password", "email",'phone', 'addres')
 #         fields = '__all__'
 
-class ShoppCartSerializer(serializers.ModelSerializer):
+class ShoppCartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # En los listados viene anotado (ShoppCart.objects.with_totals()), sin consultas por carrito
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, source='get_total', read_only=True)
+
     class Meta:
         model = ShoppCart
         # fields = ('iduser', 'username', "password", "email",'phone', 'addres')
         fields = '__all__'
+        compact_fields = ['idshoppcart', 'user', 'updated_at', 'total']
 
 
 class ShoppCartDetailsSerializer(serializers.ModelSerializer):
@@ -62,11 +143,14 @@ class ShoppCartDetailsSerializer(serializers.ModelSerializer):
         model = ShoppCartDetails
         # fields = ('iduser', 'username', "password", "email",'phone', 'addres')
         fields = '__all__'
+        # Una cantidad negativa descontaría reservas de otros carritos
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
 
-class ReviewsSerializer(serializers.ModelSerializer):
+class ReviewsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Reviews
         # fields = ('iduser', 'username', "password", "email",'phone', 'addres')
         fields = '__all__'
+        compact_fields = ['idreviews', 'idproduct', 'rating', 'date']
 
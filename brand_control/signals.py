@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .fragments import category_fragments, product_fragments
+from .models import Category, OrderDetails, Product, record_catalog_changes
+from .search import INDEXED_FIELDS, index_product
+
+AUTOCOMPLETE_FIELDS = {'name', 'category_id', 'is_active'}
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, update_fields=None, **kwargs):
+    """Mantiene el índice de búsqueda al guardar un producto"""
+    # Los guardados parciales que no tocan texto (stock, precio...) no reindexan
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_product(instance)
+
+# Al borrar un producto su documento y postings se eliminan en cascada
+
+
+# El autocompletado en memoria se actualiza recién cuando la transacción
+# confirma, para no mostrar nombres de un guardado que luego se revierte
+
+@receiver(post_save, sender=Product)
+def update_product_autocomplete(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & AUTOCOMPLETE_FIELDS:
+        return
+    pk, name, category_id, is_active = instance.pk, instance.name, instance.category_id_id, instance.is_active
+    transaction.on_commit(lambda: autocomplete_index.update_product(pk, name, category_id, is_active))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_autocomplete(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete_index.remove_product(pk))
+
+
+@receiver(post_save, sender=Category)
+def update_category_autocomplete(sender, instance, **kwargs):
+    pk, name = instance.pk, instance.name
+    transaction.on_commit(lambda: autocomplete_index.update_category(pk, name))
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_autocomplete(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete_index.remove_category(pk))
+
+
+@receiver(post_save, sender=OrderDetails)
+def record_sale_autocomplete(sender, instance, created, **kwargs):
+    # ShoppCart.checkout usa bulk_create (sin señales) y registra sus ventas aparte
+    if created:
+        sales = {instance.idproduct_id: instance.quantity}
+        transaction.on_commit(lambda: autocomplete_index.record_sales(sales))
+
+
+# Fragmentos JSON cacheados (ver fragments.py). Se borran también al
+# confirmar, por si otra request volvió a cachear la versión anterior mientras
+# la transacción seguía abierta.
+
+def _invalidate_fragment(fragments, pk):
+    fragments.invalidate(pk)
+    transaction.on_commit(lambda: fragments.invalidate(pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_fragment(sender, instance, **kwargs):
+    _invalidate_fragment(product_fragments, instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_fragment(sender, instance, **kwargs):
+    _invalidate_fragment(category_fragments, instance.pk)
+
+
+# Registro de cambios de la sincronización (ver sync.py), en la misma
+# transacción que el guardado o el borrado. Los borrados son físicos: la
+# fila queda marcada como ``deleted`` para avisarle a los clientes.
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def record_catalog_change(sender, instance, **kwargs):
+    record_catalog_changes(sender._meta.model_name, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def record_catalog_deletion(sender, instance, **kwargs):
+    record_catalog_changes(sender._meta.model_name, [instance.pk], deleted=True)
@@ -0,0 +1,176 @@
+"""
+Sincronización incremental del catálogo (productos y categorías).
+
+El cliente guarda el ``token`` de la última respuesta y lo manda en la
+siguiente: recibe solo lo creado, modificado o borrado desde entonces. Sin
+token, o con uno anterior a los borrados que se conservan, la respuesta es
+una copia completa (``full``) y el cliente debe descartar lo que tenía.
+
+Los cambios salen de ``CatalogChange``: cada escritura de un producto o una
+categoría marca su fila en la misma transacción, sin número. Al empezar una
+sincronización ``assign_catalog_sequences`` numera, con un contador bloqueado,
+las filas que ya confirmaron; una transacción que confirma más tarde recibe
+un número mayor. El token guarda hasta qué número se leyó, así que ningún
+cambio queda detrás por haber tardado en confirmar (lo que sí pasaría con una
+marca de tiempo tomada antes del COMMIT).
+
+Cada sincronización fija un límite superior (``until``) y se recorre en
+páginas acotadas. La copia completa recorre categorías y después productos
+por id; la incremental recorre los cambios por (sequence, id). Mientras
+``has_more`` sea verdadero el token indica dónde seguir; en la última página
+pasa a ser ``until``, desde donde se pedirá la próxima vez.
+"""
+
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .models import CatalogChange, CatalogSyncState, Category, Product
+from .serializer import CategorySerializer, ProductSerializer
+
+TOKEN_SALT = 'brand_control.sync'
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# Filas numeradas por sentencia al asignar secuencias
+SEQUENCE_BATCH_SIZE = 5000
+
+# Modelo -> (modelo, serializer, clave en la respuesta); la copia completa los recorre en este orden
+STREAMS = {
+    'category': (Category, CategorySerializer, 'categories'),
+    'product': (Product, ProductSerializer, 'products'),
+}
+CHANGES = 'changes'
+
+
+def encode_token(state):
+    return signing.dumps(state, salt=TOKEN_SALT, compress=True)
+
+
+def decode_token(token):
+    try:
+        state = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        raise ValidationError({'since': 'Token de sincronización inválido'})
+    # Los tokens con fecha (anteriores al registro de cambios) piden copia completa
+    if isinstance(state.get('since'), str):
+        return {}
+    return state
+
+
+def assign_catalog_sequences():
+    """
+    Numera los cambios ya confirmados que todavía no tienen ``sequence`` y
+    devuelve el último número asignado.
+
+    El contador se bloquea durante toda la asignación, así los números
+    crecen en el orden en que se asignan. Las filas que otra transacción
+    tiene bloqueadas (sin confirmar) se saltean y reciben un número después.
+    Si no hay nada pendiente se lee el contador sin bloquearlo: los clientes
+    que solo leen no hacen cola detrás de un lock global.
+    """
+    if not CatalogChange.objects.filter(sequence__isnull=True).exists():
+        state = CatalogSyncState.objects.filter(id=1).values_list('sequence', 'pruned_through').first()
+        if state is not None:
+            return state
+    CatalogSyncState.objects.bulk_create([CatalogSyncState(id=1)], ignore_conflicts=True)
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        state = CatalogSyncState.objects.select_for_update().get(id=1)
+        while True:
+            pending = list(
+                CatalogChange.objects.select_for_update(skip_locked=skip_locked)
+                .filter(sequence__isnull=True).order_by('id')
+                .values_list('id', flat=True)[:SEQUENCE_BATCH_SIZE]
+            )
+            if not pending:
+                break
+            state.sequence += 1
+            CatalogChange.objects.filter(id__in=pending, sequence__isnull=True).update(sequence=state.sequence)
+            if len(pending) < SEQUENCE_BATCH_SIZE:
+                break
+        state.save(update_fields=['sequence'])
+    return state.sequence, state.pruned_through
+
+
+def catalog_changes(token, limit, request):
+    """Una página de cambios del catálogo a partir del token del cliente"""
+    state = decode_token(token) if token else {}
+    since = state.get('since')
+
+    if 'until' in state:
+        # Continuación de una sincronización en curso
+        until, full = state['until'], state['full']
+        stream, after = state['stream'], state['after']
+    else:
+        until, pruned_through = assign_catalog_sequences()
+        full = since is None or since < pruned_through
+        stream, after = (next(iter(STREAMS)) if full else CHANGES), None
+
+    data = {'full': full, 'categories': [], 'products': [], 'deleted': {'product': [], 'category': []}}
+    next_state = None
+    if full:
+        names = list(STREAMS)
+        remaining = limit
+        for name in names[names.index(stream):]:
+            rows = _read_full(name, after, remaining + 1)
+            after = None
+            if len(rows) > remaining:
+                rows = rows[:remaining]
+                next_state = {'stream': name, 'after': rows[-1].pk}
+            _, serializer_class, key = STREAMS[name]
+            data[key] = serializer_class(rows, many=True, context={'request': request}).data
+            remaining -= len(rows)
+            if next_state is None and remaining == 0 and name != names[-1]:
+                next_state = {'stream': names[names.index(name) + 1], 'after': None}
+            if next_state is not None:
+                break
+    else:
+        changes = _read_changes(since, until, after, limit + 1)
+        if len(changes) > limit:
+            changes = changes[:limit]
+            next_state = {'stream': CHANGES, 'after': [changes[-1].sequence, changes[-1].id]}
+        _add_changes(data, changes, request)
+
+    if next_state is None:
+        data['has_more'] = False
+        data['token'] = encode_token({'since': until})
+    else:
+        data['has_more'] = True
+        data['token'] = encode_token({'since': since, 'until': until, 'full': full, **next_state})
+    return data
+
+
+def _read_full(name, after, limit):
+    # Lo que cambie mientras tanto queda numerado después de ``until`` y
+    # vuelve a llegar en la próxima sincronización
+    queryset = STREAMS[name][0].objects.order_by('pk')
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    return list(queryset[:limit])
+
+
+def _read_changes(since, until, after, limit):
+    queryset = CatalogChange.objects.filter(sequence__gt=since, sequence__lte=until)
+    if after is not None:
+        sequence, pk = after
+        queryset = queryset.filter(Q(sequence__gt=sequence) | Q(sequence=sequence, id__gt=pk))
+    return list(queryset.order_by('sequence', 'id')[:limit])
+
+
+def _add_changes(data, changes, request):
+    ids = {name: [] for name in STREAMS}
+    for change in changes:
+        if change.deleted:
+            data['deleted'][change.model].append(change.object_id)
+        else:
+            ids[change.model].append(change.object_id)
+    for name, pks in ids.items():
+        if not pks:
+            continue
+        model, serializer_class, key = STREAMS[name]
+        found = model.objects.in_bulk(pks)
+        # Un objeto que ya no está se borró en una transacción que todavía no
+        # se numeró: el borrado llega en una próxima sincronización
+        rows = [found[pk] for pk in pks if pk in found]
+        data[key] = serializer_class(rows, many=True, context={'request': request}).data
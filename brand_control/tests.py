@@ -2,12 +2,40 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.request import Request
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from datetime import timedelta
 from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+import threading
+import csv
+import gzip
 import json
+import tempfile
 
-from .models import Category, Product, Order, OrderDetails, ShoppCart, ShoppCartDetails, StockMovement
+from .models import Category, Product, Order, OrderDetails, ShoppCart, ShoppCartDetails, StockMovement, Reviews, ProductSearchDocument, ProductSearchPosting, CatalogChange, StockReservation, StockReservationCounter, record_catalog_changes
+from .autocomplete import PrefixIndex, autocomplete_index
+from .exports import export_stream, iter_items
+from .fastlist import get_row_mapper
+from . import renderers
+from .fragments import product_fragments
+from .renderers import FastJSONParser, FastJSONRenderer
+from .search import STATS_CACHE_KEY, search_products
+from .sync import assign_catalog_sequences, encode_token
+from .views import ReviewsSerializerView
+from .serializer import ProductSerializer
 from user_control.models import Users
 
 User = get_user_model()
@@ -203,17 +231,20 @@ class CoreEcommerceTestCase(APITestCase):
         response = self.client.get(url)
         
         print(f"Respuesta del listado: {response.status_code}")
-        print(f"Cantidad de productos: {len(response.data)}")
         
         # Verificar que la respuesta fue exitosa
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
+        # El listado viene paginado por cursor
+        results = response.data['results']
+        print(f"Cantidad de productos: {len(results)}")
+        
         # Verificar que se obtuvieron productos
-        self.assertGreater(len(response.data), 0)
+        self.assertGreater(len(results), 0)
         
         # Verificar estructura de los datos
-        if len(response.data) > 0:
-            product = response.data[0]
+        if len(results) > 0:
+            product = results[0]
             self.assertIn('id', product)
             self.assertIn('name', product)
             self.assertIn('price', product)
@@ -580,6 +611,1752 @@ class StockManagementTestCase(APITestCase):
         print("✅ Producto marcado como inactivo (mejor práctica)")
 
 
+class KeysetPaginationTestCase(APITestCase):
+    """Pruebas para la paginación por cursor de los listados"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='pageuser',
+            email='page@example.com',
+            password='Page123!',
+            roles='cliente'
+        )
+        self.category = Category.objects.create(name='Paginación', description='Categoría de prueba')
+        self.products = [
+            Product.objects.create(
+                name=f'Producto {i}',
+                description='Producto paginado',
+                price=Decimal('10.00'),
+                stock=5,
+                category_id=self.category
+            )
+            for i in range(7)
+        ]
+        self.client.force_authenticate(user=self.user)
+    
+    def collect_pages(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+    
+    def test_pages_cover_all_products_once(self):
+        """Recorre todas las páginas sin repetir ni saltear productos"""
+        print("\n=== PRUEBA: PAGINACIÓN POR CURSOR ===")
+        
+        ids, pages = self.collect_pages(reverse('Product-list') + '?page_size=3')
+        
+        expected = [p.id for p in sorted(self.products, key=lambda p: (p.created_at, p.id), reverse=True)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+        print("✅ Paginación por cursor exitosa")
+    
+    def test_ties_in_created_at(self):
+        """Los empates en created_at no pierden ni repiten filas"""
+        same_time = timezone.now()
+        Product.objects.filter(pk__in=[p.pk for p in self.products[:4]]).update(created_at=same_time)
+        
+        ids, _ = self.collect_pages(reverse('Product-list') + '?page_size=2')
+        
+        self.assertEqual(sorted(ids), sorted(p.id for p in self.products))
+        self.assertEqual(len(ids), len(set(ids)))
+    
+    def test_seek_is_a_plain_comparison(self):
+        """El orden y el filtro del cursor no tienen ramas para NULL (el índice los resuelve)"""
+        first = self.client.get(reverse('Product-list') + '?page_size=3')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first.data['next'])
+        page_query = [q['sql'] for q in queries.captured_queries if 'ORDER BY' in q['sql']][-1]
+        self.assertNotIn('NULL', page_query)
+    
+    def test_page_size_is_capped(self):
+        """El tamaño de página no supera el máximo configurado"""
+        from .pagination import KeysetPagination
+        
+        response = self.client.get(reverse('Product-list') + '?page_size=100000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(response.data['results']), KeysetPagination.max_page_size)
+    
+    def test_invalid_cursor(self):
+        """Un cursor mal formado devuelve 404"""
+        response = self.client.get(reverse('Product-list') + '?cursor=no-es-un-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_other_viewsets_are_paginated(self):
+        """Los demás viewsets del router también quedan paginados"""
+        response = self.client.get(reverse('category-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('results', response.data)
+
+
+class AtomicStockTestCase(APITestCase):
+    """Pruebas del descuento de stock atómico"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='atomicuser',
+            email='atomic@example.com',
+            password='Atomic123!',
+            roles='cliente'
+        )
+        self.product = Product.objects.create(
+            name='Producto Caliente',
+            description='Muy vendido',
+            price=Decimal('50.00'),
+            stock=3
+        )
+    
+    def test_stale_instances_do_not_oversell(self):
+        """Dos instancias desactualizadas no pueden vender más que el stock"""
+        print("\n=== PRUEBA: DESCUENTO DE STOCK ATÓMICO ===")
+        
+        first = Product.objects.get(pk=self.product.pk)
+        second = Product.objects.get(pk=self.product.pk)
+        
+        self.assertTrue(first.update_stock(2, 'decrease'))
+        # La segunda instancia todavía cree que hay 3 unidades
+        self.assertEqual(second.stock, 3)
+        self.assertFalse(second.update_stock(2, 'decrease'))
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        print("✅ No hay sobreventa con instancias desactualizadas")
+    
+    def test_update_only_touches_stock_columns(self):
+        """El descuento no pisa otras columnas modificadas en paralelo"""
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(name='Nombre Nuevo')
+        
+        self.assertTrue(stale.update_stock(1, 'decrease'))
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Nombre Nuevo')
+        self.assertEqual(self.product.stock, 2)
+    
+    def test_order_detail_uses_conditional_update(self):
+        """OrderDetails registra el movimiento con el stock real de la base"""
+        order = Order.objects.create(user=self.user)
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.decrease_stock(self.product.pk, 1)
+        
+        OrderDetails.objects.create(idproduct=stale, idorder=order, quantity=2, price=Decimal('50.00'))
+        
+        movement = StockMovement.objects.get(product=self.product, movement_type='out')
+        self.assertEqual(movement.previous_stock, 2)
+        self.assertEqual(movement.new_stock, 0)
+        
+        with self.assertRaises(ValueError):
+            OrderDetails.objects.create(idproduct=stale, idorder=order, quantity=1, price=Decimal('50.00'))
+        self.assertEqual(OrderDetails.objects.filter(idorder=order).count(), 1)
+
+
+class CartCheckoutTestCase(APITestCase):
+    """Pruebas del checkout del carrito en una sola transacción"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='checkoutuser',
+            email='checkout@example.com',
+            password='Checkout123!',
+            roles='cliente'
+        )
+        self.products = [
+            Product.objects.create(
+                name=f'Producto {i}',
+                description='Producto del carrito',
+                price=Decimal('10.00') * (i + 1),
+                stock=10
+            )
+            for i in range(5)
+        ]
+        self.client.force_authenticate(user=self.user)
+    
+    def make_cart(self, lines):
+        cart = ShoppCart.objects.create(user=self.user)
+        for product, quantity in lines:
+            ShoppCartDetails.objects.create(idproduct=product, idshoppcart=cart, quantity=quantity)
+        return cart
+    
+    def test_checkout_creates_order(self):
+        """El checkout crea la orden, descuenta stock y vacía el carrito"""
+        print("\n=== PRUEBA: CHECKOUT DEL CARRITO ===")
+        
+        cart = self.make_cart([(self.products[0], 2), (self.products[1], 3)])
+        url = reverse('shoppcart-checkout', args=[cart.idshoppcart])
+        response = self.client.post(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(pk=response.data['idorder'])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.total, Decimal('80.00'))
+        self.assertEqual(order.orderdetails_set.count(), 2)
+        
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 8)
+        self.assertEqual(self.products[1].stock, 7)
+        
+        movement = StockMovement.objects.get(product=self.products[1])
+        self.assertEqual((movement.previous_stock, movement.new_stock), (10, 7))
+        self.assertFalse(cart.shoppcartdetails_set.exists())
+        print("✅ Checkout exitoso")
+    
+    def test_checkout_query_count_is_constant(self):
+        """La cantidad de consultas no depende de las líneas del carrito"""
+        small = self.make_cart([(self.products[0], 1)])
+        large = self.make_cart([(product, 1) for product in self.products])
+        
+        with CaptureQueriesContext(connection) as small_queries:
+            small.checkout()
+        with CaptureQueriesContext(connection) as large_queries:
+            large.checkout()
+        
+        self.assertEqual(len(small_queries), len(large_queries))
+    
+    def test_checkout_rolls_back_without_stock(self):
+        """Si un producto no alcanza no se descuenta nada"""
+        cart = self.make_cart([(self.products[0], 2), (self.products[1], 3)])
+        Product.objects.filter(pk=self.products[1].pk).update(stock=1)
+        
+        url = reverse('shoppcart-checkout', args=[cart.idshoppcart])
+        response = self.client.post(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 10)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.shoppcartdetails_set.count(), 2)
+
+
+class ReviewStatsTestCase(APITestCase):
+    """Pruebas de los agregados de reseñas por producto"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='reviewer',
+            email='reviewer@example.com',
+            password='Review123!',
+            roles='cliente'
+        )
+        self.product = Product.objects.create(name='Reseñado', description='Con reseñas', price=Decimal('20.00'))
+        self.other = Product.objects.create(name='Otro', description='Sin reseñas', price=Decimal('20.00'))
+        self.client.force_authenticate(user=self.user)
+    
+    def post_review(self, product, rating):
+        data = {'idproduct': product.id, 'user': self.user.id, 'rating': rating, 'comment': 'Comentario'}
+        response = self.client.post(reverse('Reviews-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['idreviews']
+    
+    def test_stats_follow_create_update_delete(self):
+        """Los agregados se actualizan al crear, editar y borrar reseñas"""
+        print("\n=== PRUEBA: AGREGADOS DE RESEÑAS ===")
+        
+        first = self.post_review(self.product, 5)
+        self.post_review(self.product, 3)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (2, 8))
+        self.assertEqual(self.product.rating_average, 4.0)
+        
+        url = reverse('Reviews-detail', args=[first])
+        self.client.patch(url, {'rating': 1}, format='json')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0})
+        
+        self.client.patch(url, {'idproduct': self.other.id}, format='json')
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.review_count, self.other.rating_1), (1, 1))
+        
+        self.client.delete(url)
+        self.other.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.other.review_count, 0)
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (1, 3))
+        print("✅ Agregados de reseñas actualizados")
+    
+    def test_update_uses_the_stored_rating(self):
+        """Si otra edición cambió la reseña después de cargarla, el delta sale de lo guardado"""
+        pk = self.post_review(self.product, 5)
+        stale = Reviews.objects.get(pk=pk)
+        # Edición concurrente: 5 -> 3, con sus agregados
+        Reviews.objects.filter(pk=pk).update(rating=3)
+        Product.objects.apply_review_delta(self.product.id, 5, -1)
+        Product.objects.apply_review_delta(self.product.id, 3, 1)
+        
+        with mock.patch.object(ReviewsSerializerView, 'get_object', return_value=stale):
+            response = self.client.patch(reverse('Reviews-detail', args=[pk]), {'rating': 4}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (1, 4))
+        
+        # Borrar una reseña que ya no existe no descuenta dos veces
+        Reviews.objects.filter(pk=pk).delete()
+        Product.objects.apply_review_delta(self.product.id, 4, -1)
+        with mock.patch.object(ReviewsSerializerView, 'get_object', return_value=stale):
+            self.client.delete(reverse('Reviews-detail', args=[pk]))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (0, 0))
+        
+        # Editar una reseña borrada mientras tanto no la vuelve a crear
+        with mock.patch.object(ReviewsSerializerView, 'get_object', return_value=stale):
+            response = self.client.patch(reverse('Reviews-detail', args=[pk]), {'rating': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Reviews.objects.filter(pk=pk).exists())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (0, 0))
+    
+    def test_product_serializer_does_not_query_reviews(self):
+        """El listado de productos expone los agregados sin leer las reseñas"""
+        self.post_review(self.product, 4)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('Product-detail', args=[self.product.id]))
+        
+        self.assertEqual(response.data['review_count'], 1)
+        self.assertEqual(response.data['rating_average'], 4.0)
+        self.assertFalse(any('brand_control_reviews' in q['sql'] for q in queries.captured_queries))
+    
+    def test_rebuild_command_repairs_stats(self):
+        """El comando de reconstrucción corrige agregados desfasados"""
+        Reviews.objects.create(idproduct=self.product, user=self.user, rating=2, comment='Directo')
+        Product.objects.filter(pk=self.other.pk).update(review_count=7, rating_sum=9)
+        
+        call_command('rebuild_review_stats', batch_size=1, stdout=StringIO())
+        
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_2), (1, 1))
+        self.assertEqual((self.other.review_count, self.other.rating_sum), (0, 0))
+
+
+class ProductSearchTestCase(APITestCase):
+    """Pruebas de la búsqueda de texto sobre productos"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create_user(
+            username='searcher',
+            email='searcher@example.com',
+            password='Search123!',
+            roles='cliente'
+        )
+        self.shirt = Product.objects.create(
+            name='Camiseta de algodón', description='Camiseta básica de manga corta', price=Decimal('15.00'), type='Ropa'
+        )
+        self.mug = Product.objects.create(
+            name='Taza para café', description='Taza de cerámica', price=Decimal('8.00'), type='Hogar'
+        )
+        self.bag = Product.objects.create(
+            name='Bolso', description='Bolso que combina con tus camisetas', price=Decimal('30.00'), type='Accesorios'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def search(self, query, **params):
+        response = self.client.get(reverse('Product-list'), {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+    
+    def test_search_ranks_by_relevance(self):
+        """Los resultados salen ordenados por BM25, con plurales y sin acentos"""
+        print("\n=== PRUEBA: BÚSQUEDA DE PRODUCTOS ===")
+        
+        results = self.search('CAMISETAS').data['results']
+        self.assertEqual([p['id'] for p in results], [self.shirt.id, self.bag.id])
+        
+        results = self.search('cafe').data['results']
+        self.assertEqual([p['id'] for p in results], [self.mug.id])
+        self.assertEqual(self.search('de la para').data['results'], [])
+        print("✅ Búsqueda con ranking funcionando")
+    
+    def test_index_follows_save_and_delete(self):
+        """El índice se actualiza al editar y al borrar productos"""
+        self.mug.name = 'Jarro térmico'
+        self.mug.save()
+        self.assertEqual(self.search('termico').data['results'][0]['id'], self.mug.id)
+        
+        self.shirt.delete()
+        results = self.search('camiseta').data['results']
+        self.assertEqual([p['id'] for p in results], [self.bag.id])
+        
+        # Un guardado parcial sin campos de texto no toca el índice
+        with CaptureQueriesContext(connection) as queries:
+            self.bag.stock = 3
+            self.bag.save(update_fields=['stock'])
+        index_tables = (ProductSearchDocument._meta.db_table, ProductSearchPosting._meta.db_table)
+        self.assertFalse([
+            q['sql'] for q in queries.captured_queries
+            if any(table in q['sql'] for table in index_tables)
+        ])
+    
+    def test_corpus_stats_are_cached(self):
+        """Las estadísticas de BM25 no se recalculan sobre toda la tabla en cada búsqueda"""
+        self.search('camiseta')
+        with CaptureQueriesContext(connection) as queries:
+            results = self.search('camiseta').data['results']
+        self.assertEqual([p['id'] for p in results], [self.shirt.id, self.bag.id])
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'AVG(' in q['sql'].upper()])
+        
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertIsNone(cache.get(STATS_CACHE_KEY))
+    
+    def test_search_pagination(self):
+        """El cursor de la búsqueda recorre todos los resultados sin repetir"""
+        for i in range(5):
+            Product.objects.create(name=f'Camiseta {i}', description='Estampada', price=Decimal('10.00'))
+        
+        seen = []
+        response = self.search('camiseta', page_size=3)
+        seen += [p['id'] for p in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [p['id'] for p in response.data['results']]
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+    
+    def test_rebuild_command(self):
+        """El comando reconstruye el índice completo"""
+        ProductSearchDocument.objects.all().delete()
+        self.assertEqual(self.search('taza').data['results'], [])
+        
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+        self.assertIn('Productos indexados: 3', out.getvalue())
+        self.assertEqual(self.search('taza').data['results'][0]['id'], self.mug.id)
+
+
+class AutocompleteTestCase(APITestCase):
+    """Pruebas del autocompletado en memoria"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='typer',
+            email='typer@example.com',
+            password='Typer123!',
+            roles='cliente'
+        )
+        self.category = Category.objects.create(name='Camisetas')
+        self.red = Product.objects.create(name='Camiseta roja', description='Roja', price=Decimal('10.00'), stock=50, category_id=self.category)
+        self.blue = Product.objects.create(name='Camiseta azul', description='Azul', price=Decimal('10.00'), stock=50, category_id=self.category)
+        self.cap = Product.objects.create(name='Gorra', description='Gorra', price=Decimal('5.00'), stock=50)
+        order = Order.objects.create(user=self.user, total=Decimal('30.00'))
+        OrderDetails.objects.create(idproduct=self.blue, idorder=order, quantity=3, price=Decimal('10.00'))
+        autocomplete_index.reset()
+        self.client.force_authenticate(user=self.user)
+        self.addCleanup(autocomplete_index.reset)
+    
+    def suggest(self, query):
+        response = self.client.get(reverse('Product-autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_prefix_ranked_by_sales(self):
+        """Los nombres que empiezan con el prefijo salen ordenados por ventas"""
+        print("\n=== PRUEBA: AUTOCOMPLETADO ===")
+        
+        data = self.suggest('CAMI')
+        self.assertEqual([p['id'] for p in data['products']], [self.blue.id, self.red.id])
+        self.assertEqual(data['categories'][0]['sales'], 3)
+        # También coincide con palabras intermedias del nombre
+        self.assertEqual([p['id'] for p in self.suggest('roj')['products']], [self.red.id])
+        
+        with CaptureQueriesContext(connection) as queries:
+            autocomplete_index.suggest('gor')
+        self.assertEqual(len(queries.captured_queries), 0)
+        print("✅ Autocompletado sin consultas a la base")
+    
+    def test_index_follows_signals(self):
+        """Altas, cambios, bajas y ventas se reflejan sin reconstruir el índice"""
+        autocomplete_index.build()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cap.name = 'Gorro de lana'
+            self.cap.save()
+            Product.objects.create(name='Gorra nueva', description='Nueva', price=Decimal('5.00'))
+            self.red.delete()
+        self.assertEqual([p['name'] for p in autocomplete_index.suggest('gorr')['products']], ['Gorra nueva', 'Gorro de lana'])
+        self.assertEqual(autocomplete_index.suggest('camiseta r')['products'], [])
+        
+        cart = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.cap, quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.checkout(user=self.user)
+        self.assertEqual(autocomplete_index.suggest('gorr')['products'][0]['sales'], 2)
+    
+    def test_stale_index_refreshes_in_background(self):
+        """Un índice vencido se rearma en un solo hilo aparte y mientras tanto se usa el anterior"""
+        autocomplete_index.build()
+        release = threading.Event()
+        calls = []
+        
+        def slow_build():
+            calls.append(threading.current_thread().name)
+            release.wait(5)
+        
+        with mock.patch.object(autocomplete_index, '_build', side_effect=slow_build):
+            autocomplete_index._built_at -= autocomplete_index.refresh_seconds + 1
+            for _ in range(3):
+                self.assertEqual([p['id'] for p in self.suggest('gorr')['products']], [self.cap.id])
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'autocomplete-refresh':
+                    thread.join(5)
+        self.assertEqual(calls, ['autocomplete-refresh'])
+    
+    def test_warm_builds_in_background_at_startup(self):
+        """Al arrancar el proceso el índice se arma en un hilo, sin esperar a la primera request"""
+        calls = []
+        with mock.patch.object(autocomplete_index, '_build', side_effect=lambda: calls.append(threading.current_thread().name)):
+            autocomplete_index.warm()
+            for thread in threading.enumerate():
+                if thread.name == 'autocomplete-build':
+                    thread.join(5)
+        self.assertEqual(calls, ['autocomplete-build'])
+        self.assertFalse(autocomplete_index._build_lock.locked())
+    
+    def test_sales_survive_deactivation(self):
+        """Un producto reactivado recupera sus ventas, también en su categoría"""
+        autocomplete_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blue.is_active = False
+            self.blue.save()
+        self.assertEqual([p['id'] for p in autocomplete_index.suggest('cami')['products']], [self.red.id])
+        self.assertEqual(autocomplete_index.suggest('cami')['categories'][0]['sales'], 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blue.is_active = True
+            self.blue.save()
+        data = autocomplete_index.suggest('cami')
+        self.assertEqual([(p['id'], p['sales']) for p in data['products']], [(self.blue.id, 3), (self.red.id, 0)])
+        self.assertEqual(data['categories'][0]['sales'], 3)
+    
+    def test_sales_only_drop_matching_cached_prefixes(self):
+        """Una venta descarta solo los prefijos cacheados del producto vendido"""
+        autocomplete_index.build()
+        autocomplete_index.suggest('gor')
+        autocomplete_index.suggest('cami')
+        autocomplete_index.record_sales({self.cap.id: 1})
+        cached = {prefix for prefix, _ in autocomplete_index.products._cache}
+        self.assertEqual(cached, {'cami'})
+        self.assertEqual(autocomplete_index.suggest('gor')['products'][0]['sales'], 1)
+    
+    def test_changes_during_build_are_replayed(self):
+        """Un cambio que llega mientras se lee la base no se pierde al reemplazar el índice"""
+        from_rows = PrefixIndex.from_rows
+        renamed = []
+        
+        def rename_while_building(rows):
+            if not renamed:
+                renamed.append(True)
+                autocomplete_index.update_product(self.cap.id, 'Gorro nuevo', None)
+            return from_rows(rows)
+        
+        with mock.patch.object(PrefixIndex, 'from_rows', side_effect=rename_while_building):
+            autocomplete_index.build()
+        self.assertEqual([p['name'] for p in autocomplete_index.suggest('gorr')['products']], ['Gorro nuevo'])
+
+
+class ProductFacetTestCase(APITestCase):
+    """Pruebas de los filtros y conteos por facet del listado de productos"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='facets',
+            email='facets@example.com',
+            password='Facets123!',
+            roles='cliente'
+        )
+        self.clothes = Category.objects.create(name='Ropa')
+        self.home = Category.objects.create(name='Hogar')
+        self.shirt = Product.objects.create(name='Camiseta', description='-', price=Decimal('15.00'), stock=5, type='Fisico', category_id=self.clothes)
+        self.jacket = Product.objects.create(name='Chaqueta', description='-', price=Decimal('80.00'), stock=0, type='Fisico', category_id=self.clothes)
+        self.ebook = Product.objects.create(name='Guía de estilo', description='-', price=Decimal('5.00'), stock=100, type='Digital', category_id=self.clothes)
+        self.mug = Product.objects.create(name='Taza', description='-', price=Decimal('8.00'), stock=3, type='Fisico', category_id=self.home)
+        self.client.force_authenticate(user=self.user)
+    
+    def list_ids(self, **params):
+        response = self.client.get(reverse('Product-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {p['id'] for p in response.data['results']}
+    
+    def test_filters(self):
+        """Cada filtro restringe el listado en el servidor"""
+        print("\n=== PRUEBA: FILTROS POR FACET ===")
+        
+        self.assertEqual(self.list_ids(category=self.clothes.id), {self.shirt.id, self.jacket.id, self.ebook.id})
+        self.assertEqual(self.list_ids(category=f'{self.clothes.id},{self.home.id}', type='Fisico', in_stock='true'), {self.shirt.id, self.mug.id})
+        self.assertEqual(self.list_ids(min_price='8', max_price='15'), {self.shirt.id, self.mug.id})
+        self.assertEqual(self.list_ids(in_stock='false'), {self.jacket.id})
+        
+        response = self.client.get(reverse('Product-list'), {'min_price': 'barato'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("✅ Filtros funcionando")
+    
+    def test_facet_counts_in_one_query(self):
+        """Los conteos salen de una sola consulta y cada facet ignora su propio filtro"""
+        url = reverse('Product-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'facets': 'true', 'type': 'Fisico', 'category': self.clothes.id})
+        # Versión de la página y de los facets para el ETag + listado + conteos
+        self.assertEqual(len(queries.captured_queries), 4)
+        
+        facets = response.data['facets']
+        self.assertEqual(facets['total'], 2)
+        counts = lambda name: {item['value']: item['count'] for item in facets[name]}
+        self.assertEqual(counts('type'), {'Fisico': 2, 'Digital': 1})
+        self.assertEqual(counts('category'), {self.clothes.id: 2, self.home.id: 1})
+        self.assertEqual(counts('price'), {'10-25': 1, '50-100': 1})
+        self.assertEqual(counts('in_stock'), {True: 1, False: 1})
+
+
+class SparseFieldsTestCase(APITestCase):
+    """Pruebas de ?fields=, ?omit= y ?view=compact"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='sparse',
+            email='sparse@example.com',
+            password='Sparse123!',
+            roles='cliente'
+        )
+        self.product = Product.objects.create(
+            name='Remera', description='Texto largo ' * 50, price=Decimal('12.50'), stock=4,
+            review_count=2, rating_sum=9
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_fields_narrow_payload_and_sql(self):
+        """Solo se devuelven y se leen las columnas pedidas"""
+        print("\n=== PRUEBA: CAMPOS DISPERSOS ===")
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('Product-list'), {'fields': 'id,name,rating_average'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'id': self.product.id, 'name': 'Remera', 'rating_average': 4.5})
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"description"', sql)
+        self.assertIn('"rating_sum"', sql)
+        print("✅ Respuesta y consulta reducidas")
+    
+    def test_omit_and_compact(self):
+        """``omit`` quita campos y ``view=compact`` usa la proyección para grillas"""
+        url = reverse('Product-detail', args=[self.product.id])
+        data = self.client.get(url, {'omit': 'description,url_download'}).data
+        self.assertNotIn('description', data)
+        self.assertIn('created_at', data)
+        
+        data = self.client.get(reverse('Product-list'), {'view': 'compact'}).data['results'][0]
+        self.assertEqual(set(data), {'id', 'name', 'price', 'image', 'stock', 'rating_average'})
+    
+    def test_writes_keep_every_field(self):
+        """Los parámetros no afectan la validación de escrituras"""
+        url = reverse('Product-detail', args=[self.product.id])
+        response = self.client.patch(f'{url}?fields=id', {'stock': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['stock'], 7)
+        self.assertIn('description', response.data)
+
+
+class ConditionalGetTestCase(APITestCase):
+    """Pruebas de ETag/Last-Modified en productos y órdenes"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='poller',
+            email='poller@example.com',
+            password='Poller123!',
+            roles='cliente'
+        )
+        self.product = Product.objects.create(name='Lámpara', description='-', price=Decimal('40.00'), stock=5)
+        self.other = Product.objects.create(name='Silla', description='-', price=Decimal('60.00'), stock=2)
+        self.client.force_authenticate(user=self.user)
+    
+    def test_detail_not_modified(self):
+        """El detalle responde 304 mientras el producto no cambie"""
+        print("\n=== PRUEBA: GET CONDICIONAL ===")
+        
+        url = reverse('Product-detail', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries.captured_queries), 1)
+        
+        self.product.update_stock(1, 'decrease')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        
+        self.assertEqual(self.client.get(reverse('Product-detail', args=['abc'])).status_code, status.HTTP_404_NOT_FOUND)
+        print("✅ Detalle con 304")
+    
+    def test_list_not_modified(self):
+        """El listado cambia de versión con ediciones, borrados y otros parámetros"""
+        url = reverse('Product-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        # Otros parámetros devuelven otro cuerpo, así que otro ETag
+        response = self.client.get(url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        # Borrar el producto más viejo no cambia la fecha más nueva pero sí las filas
+        self.product.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+    
+    def test_list_version_reads_only_the_page(self):
+        """La versión del listado sale de las filas de la página, sin agregar toda la tabla"""
+        url = reverse('Product-list')
+        etag = self.client.get(url, {'page_size': 1})['ETag']
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries.captured_queries), 1)
+        sql = queries.captured_queries[0]['sql'].upper()
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('MAX(', sql)
+        self.assertIn('LIMIT 2', sql)
+        
+        # Un cambio en otra página no invalida esta
+        self.product.update_stock(1, 'decrease')
+        response = self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self.other.update_stock(1, 'decrease')
+        response = self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], self.other.id)
+        
+        # Con facets el ETag también cubre los conteos de todo el queryset
+        category = Category.objects.create(name='Muebles', description='-')
+        params = {'page_size': 1, 'facets': 'true'}
+        etag = self.client.get(url, params)['ETag']
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.product.category_id = category
+        self.product.save()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], self.other.id)
+        self.assertIn({'value': category.id, 'count': 1}, response.data['facets']['category'])
+        
+        # La búsqueda también responde 304 con el mismo ranking
+        etag = self.client.get(url, {'q': 'silla'})['ETag']
+        response = self.client.get(url, {'q': 'silla'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class FragmentCacheTestCase(APITestCase):
+    """Pruebas de la caché de fragmentos JSON de productos y categorías"""
+    
+    def setUp(self):
+        cache.clear()
+        product_fragments.reset_metrics()
+        self.user = Users.objects.create_user(
+            username='fragments',
+            email='fragments@example.com',
+            password='Fragments123!',
+            roles='cliente'
+        )
+        self.category = Category.objects.create(name='Audio', description='Parlantes')
+        self.speaker = Product.objects.create(name='Parlante', description='Bluetooth', price=Decimal('99.90'), stock=4, category_id=self.category)
+        self.cable = Product.objects.create(name='Cable', description='Auxiliar ñandú', price=Decimal('3.50'), stock=40)
+        self.client.force_authenticate(user=self.user)
+    
+    def test_list_is_served_from_fragments(self):
+        """El segundo listado junta fragmentos sin serializar y devuelve el mismo JSON"""
+        print("\n=== PRUEBA: CACHÉ DE FRAGMENTOS ===")
+        
+        url = reverse('Product-list')
+        first = self.client.get(url)
+        with mock.patch.object(ProductSerializer, 'to_representation') as to_representation:
+            second = self.client.get(url)
+        to_representation.assert_not_called()
+        
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.content, second.content)
+        expected = ProductSerializer([self.cable, self.speaker], many=True, context={'request': Request(first.wsgi_request)}).data
+        self.assertEqual(json.loads(second.content)['results'], json.loads(json.dumps(expected, cls=DjangoJSONEncoder)))
+        self.assertEqual(product_fragments.metrics(), {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+        print("✅ Listado armado desde la caché")
+    
+    def test_changes_invalidate_fragments(self):
+        """Guardar, actualizar con update() y borrar invalidan los fragmentos"""
+        url = reverse('Product-list')
+        self.client.get(url)
+        
+        self.speaker.name = 'Parlante portátil'
+        self.speaker.save()
+        self.cable.update_stock(5, 'decrease')
+        Category.objects.filter(pk=self.category.pk).update(name='Sonido')
+        
+        results = {p['id']: p for p in json.loads(self.client.get(url).content)['results']}
+        self.assertEqual(results[self.speaker.id]['name'], 'Parlante portátil')
+        self.assertEqual(results[self.cable.id]['stock'], 35)
+        
+        self.cable.delete()
+        self.assertEqual(len(json.loads(self.client.get(url).content)['results']), 1)
+        
+        category_url = reverse('category-list')
+        self.client.get(category_url)
+        self.category.name = 'Audio y video'
+        self.category.save()
+        self.assertEqual(json.loads(self.client.get(category_url).content)['results'][0]['name'], 'Audio y video')
+        
+        # Un update() sin señales que mueve updated_at también deja viejo el fragmento
+        Category.objects.filter(pk=self.category.pk).update(name='Imagen', updated_at=timezone.now())
+        self.assertEqual(json.loads(self.client.get(category_url).content)['results'][0]['name'], 'Imagen')
+    
+    def test_file_based_backend(self):
+        """La caché funciona con un backend en archivos"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+            with override_settings(CACHES=backend):
+                url = reverse('Product-list')
+                first = self.client.get(url)
+                second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(product_fragments.metrics()['hits'], 2)
+
+
+class FastListTestCase(APITestCase):
+    """Pruebas del listado de productos armado con values()"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create_user(
+            username='fastlist',
+            email='fastlist@example.com',
+            password='Fastlist123!',
+            roles='cliente'
+        )
+        self.category = Category.objects.create(name='Audio', description='Parlantes')
+        self.speaker = Product.objects.create(
+            name='Parlante', description='Bluetooth', price=Decimal('99.9'), stock=4,
+            category_id=self.category, image='products/parlante.png'
+        )
+        Product.objects.apply_review_delta(self.speaker.id, 4, 1)
+        self.speaker.refresh_from_db()
+        self.cable = Product.objects.create(name='Cable', description='Auxiliar', price=Decimal('3.50'), stock=40, is_active=False)
+        self.client.force_authenticate(user=self.user)
+    
+    def test_mapper_matches_serializer(self):
+        """El mapper devuelve lo mismo que ProductSerializer (imagen, decimales, nulos, calculados)"""
+        print("\n=== PRUEBA: LISTADO CON VALUES() ===")
+        
+        request = Request(self.client.get(reverse('Product-list')).wsgi_request)
+        fields = list(ProductSerializer().fields)
+        mapper = get_row_mapper(ProductSerializer, fields)
+        self.assertIsNotNone(mapper)
+        
+        products = Product.objects.order_by('id')
+        expected = ProductSerializer(products, many=True, context={'request': request}).data
+        map_row = mapper.bind(request)
+        self.assertEqual([map_row(row) for row in products.values(*mapper.columns)], [dict(item) for item in expected])
+        print("✅ Salida idéntica al serializer")
+    
+    def test_list_does_not_build_instances(self):
+        """El listado (con y sin caché de fragmentos) no instancia productos ni usa el serializer"""
+        url = reverse('Product-list')
+        expected = ProductSerializer(
+            [self.cable, self.speaker], many=True,
+            context={'request': Request(self.client.get(url).wsgi_request)}
+        ).data
+        expected = json.loads(json.dumps(expected, cls=DjangoJSONEncoder))
+        cache.clear()
+        
+        with mock.patch.object(Product, 'from_db') as from_db, \
+                mock.patch.object(ProductSerializer, 'to_representation') as to_representation:
+            cached = self.client.get(url)
+            sparse = self.client.get(url, {'fields': 'id,price,rating_average'})
+        from_db.assert_not_called()
+        to_representation.assert_not_called()
+        
+        self.assertEqual(json.loads(cached.content)['results'], expected)
+        self.assertEqual(
+            sparse.data['results'],
+            [{key: item[key] for key in ('id', 'price', 'rating_average')} for item in expected]
+        )
+    
+    def test_benchmark_command(self):
+        """El benchmark verifica que ambas salidas coinciden"""
+        out = StringIO()
+        call_command('benchmark_product_list', rows=20, repeat=1, sample=20, stdout=out)
+        self.assertIn('mejora', out.getvalue())
+        self.assertEqual(Product.objects.count(), 2)
+
+
+class JSONRendererTestCase(APITestCase):
+    """Pruebas del renderer y parser JSON con orjson"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='renderer',
+            email='renderer@example.com',
+            password='Renderer123!',
+            roles='cliente'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def sample(self):
+        moment = timezone.now().replace(microsecond=123456)
+        return {
+            'price': Decimal('19.90'),
+            'created_at': moment,
+            'naive': moment.replace(tzinfo=None),
+            'day': moment.date(),
+            'label': gettext_lazy('Pendiente'),
+            'text': 'ñandú \u2028 fin',
+            'nested': [{1: 'clave entera'}, (1, 2.5, None, True)],
+            'big': 2 ** 70,
+        }
+    
+    def test_same_output_as_drf(self):
+        """Los bytes son los mismos que con el JSONRenderer de DRF"""
+        print("\n=== PRUEBA: RENDERER JSON ===")
+        
+        data = self.sample()
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        del data['big']
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=2'
+        self.assertEqual(FastJSONRenderer().render(data, indented), JSONRenderer().render(data, indented))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        print("✅ Misma salida que DRF")
+    
+    def test_fallback_without_orjson(self):
+        """Sin orjson se usa json estándar"""
+        data = self.sample()
+        body = JSONRenderer().render(data)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), body)
+            self.assertEqual(FastJSONParser().parse(BytesIO(body))['price'], 19.9)
+    
+    def test_parser(self):
+        """El parser lee JSON y responde 400 si el cuerpo es inválido"""
+        body = '{"name": "Categoría", "values": [1, 2.5, null]}'.encode('utf-8')
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), {'name': 'Categoría', 'values': [1, 2.5, None]})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"price": NaN}'))
+        latin = FastJSONParser().parse(BytesIO('{"name": "ñ"}'.encode('latin-1')), parser_context={'encoding': 'latin-1'})
+        self.assertEqual(latin, {'name': 'ñ'})
+        
+        url = reverse('category-list')
+        response = self.client.post(url, '{"name": "Audio",', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {'name': 'Audio', 'description': 'Parlantes'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content)['name'], 'Audio')
+    
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_json_renderer', rows=10, repeat=1, sample=10, stdout=out)
+        self.assertIn('Order', out.getvalue())
+        self.assertNotIn('no coinciden', out.getvalue())
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class CatalogSyncTestCase(APITestCase):
+    """Pruebas de la sincronización incremental del catálogo"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='sync',
+            email='sync@example.com',
+            password='Sync1234!',
+            roles='cliente'
+        )
+        self.audio = Category.objects.create(name='Audio', description='Parlantes')
+        self.video = Category.objects.create(name='Video', description='Pantallas')
+        self.products = [
+            Product.objects.create(name=f'Producto {i}', description='Prueba', price=Decimal('10.00'), category_id=self.audio)
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('sync-list')
+    
+    def sync(self, token=None, limit=2):
+        """Recorre todas las páginas y devuelve (páginas, token final)"""
+        pages = []
+        while True:
+            params = {'limit': limit, **({'since': token} if token else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            token = response.data['token']
+            if not response.data['has_more']:
+                return pages, token
+    
+    def test_full_then_incremental(self):
+        """La primera sincronización es completa y las siguientes traen solo los cambios"""
+        print("\n=== PRUEBA: SINCRONIZACIÓN DEL CATÁLOGO ===")
+        
+        pages, token = self.sync()
+        self.assertTrue(all(page['full'] for page in pages))
+        self.assertTrue(all(len(page['categories']) + len(page['products']) <= 2 for page in pages))
+        self.assertEqual([c['id'] for page in pages for c in page['categories']], [self.audio.id, self.video.id])
+        self.assertEqual([p['id'] for page in pages for p in page['products']], [p.id for p in self.products])
+        
+        pages, token = self.sync(token)
+        self.assertEqual(len(pages), 1)
+        self.assertFalse(pages[0]['full'])
+        self.assertEqual((pages[0]['categories'], pages[0]['products']), ([], []))
+        
+        self.products[0].update_stock(1, 'increase')
+        deleted_product, deleted_category = self.products[1].id, self.video.id
+        self.products[1].delete()
+        self.video.delete()
+        new = Category.objects.create(name='Gaming', description='Consolas')
+        
+        pages, token = self.sync(token, limit=1)
+        self.assertEqual([c['id'] for page in pages for c in page['categories']], [new.id])
+        products = [p for page in pages for p in page['products']]
+        self.assertEqual([(p['id'], p['stock']) for p in products], [(self.products[0].id, 1)])
+        self.assertEqual(sorted(i for page in pages for i in page['deleted']['product']), [deleted_product])
+        self.assertEqual([i for page in pages for i in page['deleted']['category']], [deleted_category])
+        
+        pages, _ = self.sync(token)
+        self.assertEqual(pages[0]['products'], [])
+        self.assertEqual(pages[0]['deleted'], {'product': [], 'category': []})
+        print("✅ Sincronización incremental funcionando")
+    
+    def test_changes_follow_commit_order_not_timestamps(self):
+        """Un cambio con updated_at viejo (transacción lenta) igual llega después del token"""
+        _, token = self.sync()
+        # Como una transacción que estampó la fecha hace una hora y recién ahora confirma
+        Product.objects.filter(pk=self.products[2].pk).update(stock=7, updated_at=timezone.now() - timedelta(hours=1))
+        record_catalog_changes('product', [self.products[2].pk])
+        self.assertIsNone(CatalogChange.objects.get(model='product', object_id=self.products[2].pk).sequence)
+        
+        pages, token = self.sync(token)
+        self.assertEqual([(p['id'], p['stock']) for p in pages[0]['products']], [(self.products[2].id, 7)])
+        pages, _ = self.sync(token)
+        self.assertEqual(pages[0]['products'], [])
+    
+    def test_sequences_are_assigned_in_order(self):
+        """Cada asignación numera solo lo pendiente, con números mayores a los anteriores"""
+        first, _ = assign_catalog_sequences()
+        self.assertFalse(CatalogChange.objects.filter(sequence__isnull=True).exists())
+        
+        # Sin pendientes solo se lee: nada de bloqueos ni escrituras sobre el contador
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(assign_catalog_sequences()[0], first)
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries.captured_queries))
+        
+        self.products[0].update_stock(1, 'increase')
+        second, _ = assign_catalog_sequences()
+        self.assertEqual(second, first + 1)
+        self.assertEqual(CatalogChange.objects.get(model='product', object_id=self.products[0].pk).sequence, second)
+    
+    def test_invalid_and_expired_tokens(self):
+        """Un token adulterado es un 400; uno anterior a los borrados conservados pide copia completa"""
+        response = self.client.get(self.url, {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Los tokens con fecha (anteriores al registro de cambios) también
+        old = encode_token({'since': (timezone.now() - timedelta(days=365)).isoformat()})
+        pages, _ = self.sync(old, limit=10)
+        self.assertTrue(pages[0]['full'])
+        self.assertEqual(len(pages[0]['products']), 3)
+    
+    def test_prune_tombstones(self):
+        """Podar borrados viejos obliga a copia completa a los tokens anteriores a ellos"""
+        _, before = self.sync()
+        self.products[0].delete()
+        _, after = self.sync(before)
+        
+        out = StringIO()
+        call_command('prune_catalog_tombstones', days=0, stdout=out)
+        self.assertIn('Borrados eliminados: 1', out.getvalue())
+        self.assertFalse(CatalogChange.objects.filter(deleted=True).exists())
+        
+        pages, _ = self.sync(before, limit=10)
+        self.assertTrue(pages[0]['full'])
+        pages, _ = self.sync(after, limit=10)
+        self.assertFalse(pages[0]['full'])
+
+
+class ExportTestCase(APITestCase):
+    """Pruebas de las exportaciones en streaming"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='exports',
+            email='exports@example.com',
+            password='Exports123!',
+            roles='cliente'
+        )
+        self.admin = Users.objects.create_user(
+            username='exports_admin',
+            email='exports_admin@example.com',
+            password='Exports123!',
+            roles='admin'
+        )
+        self.category = Category.objects.create(name='Audio', description='Parlantes')
+        self.products = [
+            Product.objects.create(
+                name=f'Producto "{i}", ñ', description='Línea 1\nLínea 2', price=Decimal('10.50'),
+                stock=10, category_id=self.category if i % 2 else None
+            )
+            for i in range(5)
+        ]
+        self.order = Order.objects.create(user=self.user, total=Decimal('21.00'))
+        OrderDetails.objects.create(idorder=self.order, idproduct=self.products[0], quantity=2, price=Decimal('10.50'))
+    
+    def expected_products(self, request=None):
+        return json.loads(json.dumps(
+            ProductSerializer(Product.objects.order_by('id'), many=True, context={'request': request}).data,
+            cls=DjangoJSONEncoder,
+        ))
+    
+    def test_ndjson_export_streams_in_chunks(self):
+        """NDJSON por lotes acotados, con el mismo contenido que la API"""
+        print("\n=== PRUEBA: EXPORTACIONES EN STREAMING ===")
+        
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(export_stream('products', 'ndjson', chunk_size=2))
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 3)
+        self.assertTrue(all('LIMIT 2' in sql for sql in selects))
+        
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected_products())
+        print("✅ Exportación NDJSON por lotes")
+    
+    def test_csv_and_gzip_over_http(self):
+        """El endpoint devuelve CSV en streaming, opcionalmente comprimido"""
+        self.client.force_authenticate(user=self.user)
+        url = reverse('Product-export')
+        
+        response = self.client.get(url, {'output': 'csv', 'category': self.category.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([int(row['id']) for row in rows], [self.products[1].id, self.products[3].id])
+        self.assertEqual(rows[0]['name'], 'Producto "1", ñ')
+        self.assertEqual(rows[0]['description'], 'Línea 1\nLínea 2')
+        
+        response = self.client.get(url, {'compress': 'gzip'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        expected = self.expected_products(Request(response.wsgi_request))
+        self.assertEqual([json.loads(line) for line in body.splitlines()], expected)
+        
+        self.assertEqual(self.client.get(url, {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_order_exports_require_admin(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(reverse('Order-export')).status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('OrderDetails-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        details = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(d['idorder'], d['quantity'], d['price']) for d in details], [(self.order.idorder, 2, '10.50')])
+    
+    def test_management_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/orders.ndjson.gz'
+            call_command('export_data', 'orders', '--gzip', '--file', path, stderr=StringIO())
+            with gzip.open(path, 'rt', encoding='utf-8') as exported:
+                orders = [json.loads(line) for line in exported]
+        self.assertEqual([order['idorder'] for order in orders], [self.order.idorder])
+        
+        out = StringIO()
+        call_command('export_data', 'products', '--output', 'csv', '--chunk-size', '2', stdout=out)
+        self.assertEqual(len(list(csv.DictReader(StringIO(out.getvalue())))), 5)
+    
+    def test_no_transaction_between_batches(self):
+        """Entre lote y lote no queda una transacción abierta"""
+        items = iter_items(Product.objects.all(), ProductSerializer, chunk_size=2)
+        savepoints = list(connection.savepoint_ids)
+        next(items)
+        self.assertEqual(connection.savepoint_ids, savepoints)
+        self.assertEqual(len(list(items)), 4)
+    
+    async def test_asgi_export_streams_asynchronously(self):
+        """Bajo ASGI la respuesta usa un iterador asíncrono en lugar de bufferizar"""
+        response = await self.async_client.post(
+            '/api/token/', {'username': 'exports', 'password': 'Exports123!'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = await self.async_client.get(
+            reverse('Product-export'), {'output': 'ndjson'},
+            headers={'Authorization': f"Bearer {response.json()['access']}"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 5)
+
+
+class ProductImportTestCase(APITestCase):
+    """Pruebas de la importación masiva de productos"""
+    
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.reset()
+        self.admin = Users.objects.create_user(
+            username='importer',
+            email='importer@example.com',
+            password='Importer123!',
+            roles='admin'
+        )
+        self.audio = Category.objects.create(name='Audio', description='Parlantes')
+        self.existing = Product.objects.create(
+            sku='SKU-1', name='Parlante viejo', description='Mono', price=Decimal('5.00'), stock=7
+        )
+        self.client.force_authenticate(user=self.admin)
+    
+    def test_csv_upsert_with_row_errors(self):
+        """Inserta, actualiza por sku y reporta errores por fila sin frenar el resto"""
+        print("\n=== PRUEBA: IMPORTACIÓN MASIVA ===")
+        
+        body = (
+            'sku,name,description,price,type,category\n'
+            'SKU-1,Parlante estéreo,Bluetooth,19.90,Audio,audio\n'
+            'SKU-2,Auricular,Inalámbrico,9.50,,\n'
+            'SKU-3,Sin precio,Falta,,,\n'
+            'SKU-4,Cable,Auxiliar,1.00,,Cocina\n'
+            'SKU-5,Funda,Tela,abc,,\n'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('Product-import'), body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {key: response.data[key] for key in ('rows', 'created', 'updated', 'error_count')},
+            {'rows': 5, 'created': 1, 'updated': 1, 'error_count': 3},
+        )
+        self.assertEqual([(e['row'], e['sku'], list(e['errors'])) for e in response.data['errors']],
+                         [(3, 'SKU-3', ['price']), (4, 'SKU-4', ['category']), (5, 'SKU-5', ['price'])])
+        # No hay consultas por fila
+        self.assertLess(len(queries), 20)
+        
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.price, self.existing.category_id_id), ('Parlante estéreo', Decimal('19.90'), self.audio.id))
+        # Las columnas que no vienen en el archivo no se pisan
+        self.assertEqual(self.existing.stock, 7)
+        created = Product.objects.get(sku='SKU-2')
+        self.assertEqual((created.type, created.stock, created.is_active), ('General', 0, True))
+        
+        # Índice de búsqueda y autocompletado al día aunque no hubo señales
+        self.assertEqual([pk for pk, _ in search_products('estereo')], [self.existing.id])
+        self.assertEqual([pk for pk, _ in search_products('auricular')], [created.id])
+        self.assertEqual([p['id'] for p in autocomplete_index.suggest('auri')['products']], [created.id])
+        print("✅ Importación con upsert y errores por fila")
+    
+    def test_ndjson_command_in_batches(self):
+        """El comando lee NDJSON por lotes y se queda con la última fila de un sku repetido"""
+        lines = [json.dumps({'sku': f'N-{i}', 'name': f'Producto {i}', 'description': 'x', 'price': '2.50', 'stock': i}) for i in range(5)]
+        lines.insert(2, '{roto')
+        lines.append(json.dumps({'sku': 'N-0', 'name': 'Producto 0 bis', 'description': 'x', 'price': '3.00'}))
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', encoding='utf-8') as source:
+            source.write('\n'.join(lines) + '\n')
+            source.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_products', source.name, '--batch-size', '2', stdout=out, stderr=err)
+        self.assertIn('creados: 5', out.getvalue())
+        self.assertIn('JSON inválido', err.getvalue())
+        self.assertEqual(Product.objects.filter(sku__startswith='N-').count(), 5)
+        product = Product.objects.get(sku='N-0')
+        self.assertEqual((product.name, product.price, product.stock), ('Producto 0 bis', Decimal('3.00'), 0))
+    
+    def test_multipart_upload_requires_admin(self):
+        upload = SimpleUploadedFile('catalogo.csv', b'sku,name,description,price\nM-1,Mouse,USB,4.00\n', content_type='text/csv')
+        response = self.client.post(reverse('Product-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.data['created'], 1)
+        
+        user = Users.objects.create_user(username='noadmin', email='noadmin@example.com', password='Noadmin123!', roles='cliente')
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('Product-import'), 'sku,name\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductBulkUpdateTestCase(APITestCase):
+    """Pruebas de la actualización masiva de precio, stock y estado"""
+    
+    def setUp(self):
+        self.admin = Users.objects.create_user(
+            username='bulkadmin',
+            email='bulkadmin@example.com',
+            password='Bulkadmin123!',
+            roles='admin'
+        )
+        self.products = Product.objects.bulk_create([
+            Product(name=f'Producto {i}', description='Prueba', price=Decimal('10.00'), stock=10)
+            for i in range(6)
+        ])
+        self.client.force_authenticate(user=self.admin)
+        self.url = reverse('Product-bulk-update')
+    
+    def test_bulk_update_with_adjustments(self):
+        """Los cambios se aplican por lotes y el stock deja movimientos de ajuste"""
+        print("\n=== PRUEBA: ACTUALIZACIÓN MASIVA ===")
+        
+        p = self.products
+        changes = [
+            {'id': p[0].id, 'price': '12.50'},
+            {'id': p[1].id, 'stock': 4},
+            {'id': p[2].id, 'stock': 15, 'price': '9.99', 'is_active': False},
+            {'id': p[3].id, 'stock': 10, 'price': '10.00'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.url}?reason=Recuento', changes, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'received': 4, 'updated': 3, 'stock_movements': 2})
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        
+        values = {row['id']: row for row in Product.objects.values('id', 'price', 'stock', 'is_active')}
+        self.assertEqual(values[p[0].id]['price'], Decimal('12.50'))
+        self.assertEqual(values[p[1].id]['stock'], 4)
+        self.assertEqual((values[p[2].id]['stock'], values[p[2].id]['price'], values[p[2].id]['is_active']), (15, Decimal('9.99'), False))
+        # Sin cambios reales no se toca la fila
+        self.assertEqual(Product.objects.get(pk=p[3].id).updated_at, p[3].updated_at)
+        
+        movements = StockMovement.objects.order_by('product_id').values_list('product_id', 'movement_type', 'quantity', 'previous_stock', 'new_stock', 'reason', 'user')
+        self.assertEqual(list(movements), [
+            (p[1].id, 'adjustment', -6, 10, 4, 'Recuento', self.admin.id),
+            (p[2].id, 'adjustment', 5, 10, 15, 'Recuento', self.admin.id),
+        ])
+        print("✅ Actualización masiva con movimientos de ajuste")
+    
+    def test_chunks_share_one_transaction(self):
+        """Un id inexistente en el último lote revierte también los anteriores"""
+        changes = [{'id': product.id, 'stock': 1} for product in self.products] + [{'id': 999999, 'stock': 1}]
+        with self.assertRaises(ValueError):
+            Product.objects.apply_bulk_changes(changes, chunk_size=2)
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {10})
+        self.assertFalse(StockMovement.objects.exists())
+        
+        updated, movements = Product.objects.apply_bulk_changes(changes[:-1], chunk_size=2)
+        self.assertEqual((updated, movements), (6, 6))
+    
+    def test_validation(self):
+        p = self.products
+        response = self.client.post(self.url, [{'id': p[0].id, 'stock': -1}, {'id': p[1].id, 'price': 'x'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual({int(index): list(error) for index, error in response.data.items()}, {0: ['stock'], 1: ['price']})
+        
+        response = self.client.post(self.url, [{'id': p[0].id, 'stock': 1}, {'id': p[0].id, 'stock': 2}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Product.objects.get(pk=p[0].id).stock, 10)
+        
+        self.assertEqual(self.client.post(self.url, [], format='json').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_bulk_update_with_jwt_claims_user(self):
+        """Con un JWT real el usuario viene de los claims (ClaimsUser) y el movimiento guarda su id"""
+        self.client.force_authenticate(user=None)
+        response = self.client.post('/api/token/', {'username': 'bulkadmin', 'password': 'Bulkadmin123!'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = self.client.post(
+            self.url, [{'id': self.products[0].id, 'stock': 7}], format='json',
+            HTTP_AUTHORIZATION=f"Bearer {response.data['access']}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(StockMovement.objects.get().user_id, self.admin.id)
+
+
+class OrderTotalsTestCase(APITestCase):
+    """Pruebas de los totales de órdenes y carritos calculados en la base"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='totals',
+            email='totals@example.com',
+            password='Totals123!',
+            roles='cliente'
+        )
+        self.mouse = Product.objects.create(name='Mouse', description='USB', price=Decimal('4.25'), stock=50)
+        self.teclado = Product.objects.create(name='Teclado', description='USB', price=Decimal('12.10'), stock=50)
+        self.client.force_authenticate(user=self.user)
+    
+    def test_calculate_total_with_one_aggregate(self):
+        """calculate_total hace un SUM y guarda solo total y updated_at"""
+        print("\n=== PRUEBA: TOTALES CON AGREGADOS ===")
+        
+        order = Order.objects.create(user=self.user, status='confirmed')
+        OrderDetails.objects.bulk_create([
+            OrderDetails(idorder=order, idproduct=self.mouse, quantity=3, price=Decimal('4.25')),
+            OrderDetails(idorder=order, idproduct=self.teclado, quantity=2, price=Decimal('12.10')),
+        ])
+        previous = order.updated_at
+        Order.objects.filter(pk=order.pk).update(status='shipped')
+        
+        with CaptureQueriesContext(connection) as queries:
+            total = order.calculate_total()
+        self.assertEqual(total, Decimal('36.95'))
+        self.assertEqual(len(queries), 2)
+        update = queries.captured_queries[1]['sql']
+        self.assertIn('"total"', update)
+        self.assertNotIn('"status"', update)
+        
+        order.refresh_from_db()
+        # El estado cambiado por otro proceso no se pisa con el valor viejo
+        self.assertEqual((order.total, order.status), (Decimal('36.95'), 'shipped'))
+        self.assertGreater(order.updated_at, previous)
+        self.assertEqual(Order.objects.create(user=self.user).calculate_total(), Decimal('0'))
+        print("✅ Total calculado con un solo SUM")
+    
+    def test_annotations_for_lists(self):
+        """with_totals() anota los totales y el listado de carritos no hace consultas por fila"""
+        carts = [ShoppCart.objects.create(user=self.user) for _ in range(4)]
+        for i, cart in enumerate(carts):
+            ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.mouse, quantity=i + 1)
+            ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.teclado, quantity=1)
+        empty = ShoppCart.objects.create(user=self.user)
+        
+        self.assertEqual(carts[1].get_total(), Decimal('20.60'))
+        totals = dict(ShoppCart.objects.with_totals().values_list('idshoppcart', 'items_total'))
+        self.assertEqual(totals, {
+            **{cart.idshoppcart: Decimal('4.25') * (i + 1) + Decimal('12.10') for i, cart in enumerate(carts)},
+            empty.idshoppcart: Decimal('0'),
+        })
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shoppcart-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(queries), 2)
+        listed = {item['idshoppcart']: item['total'] for item in response.data['results']}
+        self.assertEqual(listed[carts[3].idshoppcart], '29.10')
+        self.assertEqual(listed[empty.idshoppcart], '0.00')
+        
+        order = Order.objects.create(user=self.user)
+        OrderDetails.objects.bulk_create([OrderDetails(idorder=order, idproduct=self.mouse, quantity=2, price=Decimal('4.00'))])
+        self.assertEqual(Order.objects.with_totals().get(pk=order.pk).items_total, Decimal('8.00'))
+
+
+class OrderDetailsTotalTestCase(APITestCase):
+    """Pruebas del recálculo del total guardado de la orden desde la API de líneas"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='detailtotals',
+            email='detailtotals@example.com',
+            password='Totals123!',
+            roles='cliente'
+        )
+        self.mouse = Product.objects.create(name='Mouse', description='USB', price=Decimal('4.25'), stock=50)
+        self.order = Order.objects.create(user=self.user)
+        self.url = reverse('OrderDetails-list')
+        self.client.force_authenticate(user=self.user)
+    
+    def create_line(self, order, quantity):
+        response = self.client.post(self.url, {'idorder': order.idorder, 'idproduct': self.mouse.id, 'quantity': quantity, 'price': '4.25'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return reverse('OrderDetails-detail', args=[response.data['idorderdetails']])
+    
+    def test_order_details_keep_order_total(self):
+        """Crear, modificar o borrar una línea por la API actualiza el total de la orden"""
+        print("\n=== PRUEBA: TOTAL DE LA ORDEN DESDE SUS LÍNEAS ===")
+        
+        detail_url = self.create_line(self.order, 2)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('8.50'))
+        
+        self.client.patch(detail_url, {'quantity': 5}, format='json')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('21.25'))
+        
+        self.client.delete(detail_url)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('0'))
+        print("✅ El total sigue a las líneas")
+    
+    def test_moving_a_line_updates_both_orders(self):
+        """Pasar una línea a otra orden recalcula la de origen y la de destino"""
+        other = Order.objects.create(user=self.user)
+        self.create_line(self.order, 1)
+        detail_url = self.create_line(self.order, 2)
+        
+        response = self.client.patch(detail_url, {'idorder': other.idorder}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.order.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.order.total, other.total), (Decimal('4.25'), Decimal('8.50')))
+    
+    def test_line_is_rolled_back_when_total_fails(self):
+        """La línea y el total se guardan en la misma transacción"""
+        data = {'idorder': self.order.idorder, 'idproduct': self.mouse.id, 'quantity': 2, 'price': '4.25'}
+        with mock.patch.object(Order, 'calculate_total', side_effect=RuntimeError('falla')):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(OrderDetails.objects.filter(idorder=self.order).exists())
+        
+        detail_url = self.create_line(self.order, 2)
+        with mock.patch.object(Order, 'calculate_total', side_effect=RuntimeError('falla')):
+            response = self.client.delete(detail_url)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertTrue(OrderDetails.objects.filter(idorder=self.order).exists())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('8.50'))
+
+
+class OrderCancelTestCase(APITestCase):
+    """Pruebas de la cancelación de órdenes con restauración de stock por lotes"""
+    
+    def setUp(self):
+        self.admin = Users.objects.create_user(
+            username='canceladmin',
+            email='canceladmin@example.com',
+            password='Canceladmin123!',
+            roles='admin'
+        )
+        self.user = Users.objects.create_user(
+            username='cancelclient',
+            email='cancelclient@example.com',
+            password='Cancelclient123!',
+            roles='cliente'
+        )
+        self.products = Product.objects.bulk_create([
+            Product(name=f'Producto {i}', description='Prueba', price=Decimal('5.00'), stock=10)
+            for i in range(8)
+        ])
+    
+    def make_order(self, lines, status='pending'):
+        order = Order.objects.create(user=self.user, status=status)
+        OrderDetails.objects.bulk_create([
+            OrderDetails(idorder=order, idproduct=product, quantity=quantity, price=product.price)
+            for product, quantity in lines
+        ])
+        return order
+    
+    def test_cancel_order_batched(self):
+        """Las consultas no dependen de la cantidad de líneas y los movimientos encadenan el stock"""
+        print("\n=== PRUEBA: CANCELACIÓN CON STOCK POR LOTES ===")
+        
+        p = self.products
+        small = self.make_order([(p[0], 2)])
+        large = self.make_order([(product, 3) for product in p] + [(p[0], 1)])
+        
+        with CaptureQueriesContext(connection) as small_queries:
+            self.assertTrue(small.cancel_order())
+        with CaptureQueriesContext(connection) as large_queries:
+            self.assertTrue(large.cancel_order())
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(large.status, 'cancelled')
+        
+        stocks = dict(Product.objects.values_list('id', 'stock'))
+        self.assertEqual(stocks[p[0].id], 16)
+        self.assertTrue(all(stocks[product.id] == 13 for product in p[1:]))
+        
+        movements = list(
+            StockMovement.objects.filter(product=p[0], movement_type='in')
+            .order_by('id').values_list('previous_stock', 'new_stock', 'quantity', 'reason', 'user_id')
+        )
+        self.assertEqual([m[:3] for m in movements], [(10, 12, 2), (12, 15, 3), (15, 16, 1)])
+        self.assertEqual(movements[1][3], f'Restauración por cancelación de orden {large.idorder}')
+        self.assertTrue(all(m[4] == self.user.id for m in movements))
+        self.assertEqual(StockMovement.objects.filter(movement_type='in').count(), 10)
+        
+        # Una segunda cancelación no devuelve el stock otra vez
+        stale = Order.objects.get(pk=small.pk)
+        stale.status = 'pending'
+        self.assertFalse(stale.cancel_order())
+        self.assertEqual(stale.status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=p[0].id).stock, 16)
+        print("✅ Stock restaurado con un UPDATE y movimientos con bulk_create")
+    
+    def test_bulk_cancel_endpoint(self):
+        """bulk-cancel cancela solo las pendientes y requiere admin"""
+        p = self.products
+        pending = [self.make_order([(p[i], 1), (p[i + 1], 2)]) for i in range(3)]
+        shipped = self.make_order([(p[5], 4)], status='shipped')
+        url = reverse('Order-bulk-cancel')
+        ids = [order.idorder for order in pending] + [shipped.idorder, 999999]
+        
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.post(url, {'ids': ids}, format='json').status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(self.client.post(url, {'ids': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cancelled'], sorted(order.idorder for order in pending))
+        self.assertEqual(response.data['skipped'], sorted([shipped.idorder, 999999]))
+        
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 3)
+        self.assertEqual(Order.objects.get(pk=shipped.pk).status, 'shipped')
+        stocks = dict(Product.objects.values_list('id', 'stock'))
+        self.assertEqual([stocks[product.id] for product in p[:6]], [11, 13, 13, 12, 10, 10])
+        self.assertEqual(StockMovement.objects.filter(movement_type='in').count(), 6)
+
+
+class StockReservationTestCase(APITestCase):
+    """Pruebas de las reservas temporales de stock de los carritos"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='reserva',
+            email='reserva@example.com',
+            password='Reserva123!',
+            roles='cliente'
+        )
+        self.product = Product.objects.create(name='Consola', description='Edición limitada', price=Decimal('300.00'), stock=5)
+        self.other = Product.objects.create(name='Control', description='Inalámbrico', price=Decimal('40.00'), stock=8)
+        self.client.force_authenticate(user=self.user)
+    
+    def reserved(self, product):
+        return StockReservationCounter.objects.filter(product=product).values_list('reserved', flat=True).first() or 0
+    
+    def test_cart_lines_hold_stock(self):
+        """Cada línea reserva su cantidad sin tocar Product.stock y el disponible se descuenta"""
+        print("\n=== PRUEBA: RESERVAS DE STOCK EN CARRITOS ===")
+        
+        first, second = ShoppCart.objects.create(user=self.user), ShoppCart.objects.create(user=self.user)
+        line = ShoppCartDetails.objects.create(idshoppcart=first, idproduct=self.product, quantity=3)
+        self.assertEqual(self.reserved(self.product), 3)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).get_available_stock(), 2)
+        reservation = StockReservation.objects.get(line=line)
+        self.assertGreater(reservation.expires_at, timezone.now())
+        
+        # Otro carrito solo puede tomar lo que queda disponible
+        with self.assertRaises(ValueError):
+            ShoppCartDetails.objects.create(idshoppcart=second, idproduct=self.product, quantity=3)
+        self.assertFalse(second.shoppcartdetails_set.exists())
+        ShoppCartDetails.objects.create(idshoppcart=second, idproduct=self.product, quantity=2)
+        self.assertEqual(self.reserved(self.product), 5)
+        
+        # Cambiar la cantidad ajusta la reserva por la diferencia y la renueva
+        line.quantity = 1
+        line.save()
+        self.assertEqual(self.reserved(self.product), 3)
+        self.assertGreaterEqual(StockReservation.objects.get(line=line).expires_at, reservation.expires_at)
+        line.quantity = 4
+        with self.assertRaises(ValueError):
+            line.save()
+        self.assertEqual(StockReservation.objects.get(line=line).quantity, 1)
+        
+        response = self.client.get(reverse('Product-availability'), {'ids': f'{self.product.pk},{self.other.pk}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {str(self.product.pk): 2, str(self.other.pk): 8})
+        self.assertEqual(self.client.get(reverse('Product-availability'), {'ids': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Quitar la línea o vaciar el carrito libera la reserva
+        ShoppCartDetails.objects.get(pk=line.pk).delete()
+        self.assertEqual(self.reserved(self.product), 2)
+        second.clear_cart()
+        self.assertEqual(self.reserved(self.product), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        print("✅ Reservas con contador separado del stock")
+    
+    def test_checkout_converts_reservations(self):
+        """El checkout convierte las reservas en venta y las ventas directas respetan las ajenas"""
+        cart = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.product, quantity=4)
+        ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.other, quantity=2)
+        
+        # Solo queda 1 disponible: una venta directa de 2 no pasa
+        order = Order.objects.create(user=self.user)
+        with self.assertRaises(ValueError):
+            OrderDetails.objects.create(idorder=order, idproduct=self.product, quantity=2, price=Decimal('300.00'))
+        
+        cart.checkout(user=self.user)
+        stocks = dict(Product.objects.values_list('id', 'stock'))
+        self.assertEqual((stocks[self.product.pk], stocks[self.other.pk]), (1, 6))
+        self.assertEqual((self.reserved(self.product), self.reserved(self.other)), (0, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        
+        # Si la reserva venció y se liberó, el checkout valida contra el disponible
+        late = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=late, idproduct=self.other, quantity=5)
+        StockReservation.objects.all().release()
+        rival = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=rival, idproduct=self.other, quantity=4)
+        with self.assertRaises(ValueError):
+            late.checkout(user=self.user)
+        self.assertEqual(Product.objects.get(pk=self.other.pk).stock, 6)
+        self.assertEqual(self.reserved(self.other), 4)
+    
+    def test_sweeper_releases_expired_in_batches(self):
+        """El comando libera solo las reservas vencidas, por lotes"""
+        carts = [ShoppCart.objects.create(user=self.user) for _ in range(5)]
+        for cart in carts:
+            ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.other, quantity=1)
+        expired = StockReservation.objects.filter(line__idshoppcart__in=carts[:3])
+        StockReservation.objects.filter(pk__in=list(expired.values_list('pk', flat=True))).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        # Lo vencido ya no descuenta del disponible aunque siga en el contador
+        self.assertEqual(self.reserved(self.other), 5)
+        self.assertEqual(Product.objects.filter(pk=self.other.pk).with_available_stock().get().available_stock, 6)
+        
+        out = StringIO()
+        call_command('release_stock_reservations', batch_size=2, stdout=out)
+        self.assertIn('Reservas liberadas: 3', out.getvalue())
+        self.assertEqual(self.reserved(self.other), 2)
+        self.assertEqual(StockReservation.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.other.pk).get_available_stock(), 6)
+        
+        # Las líneas siguen en el carrito: al guardarlas vuelven a reservar
+        line = carts[0].shoppcartdetails_set.get()
+        line.save()
+        self.assertEqual(self.reserved(self.other), 3)
+    
+    def test_non_positive_quantities_are_rejected(self):
+        """Una línea con cantidad cero o negativa no descuenta reservas ajenas"""
+        holder = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=holder, idproduct=self.product, quantity=5)
+        
+        cart = ShoppCart.objects.create(user=self.user)
+        for quantity in (-5, 0):
+            response = self.client.post(reverse('shoppcartdetails-list'), {
+                'idshoppcart': cart.idshoppcart, 'idproduct': self.product.id, 'quantity': quantity
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('quantity', response.data)
+        
+        with self.assertRaises(ValueError):
+            ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.product, quantity=-5)
+        self.assertFalse(cart.shoppcartdetails_set.exists())
+        self.assertEqual(self.reserved(self.product), 5)
+        
+        holder.checkout(user=self.user)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 0)
+    
+    def test_expired_holds_are_reclaimed_without_sweeper(self):
+        """Una reserva vencida no bloquea el stock aunque el comando no haya corrido"""
+        abandoned = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=abandoned, idproduct=self.product, quantity=5)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).get_available_stock(), 5)
+        
+        # Reservar el mismo producto libera primero lo vencido
+        cart = ShoppCart.objects.create(user=self.user)
+        ShoppCartDetails.objects.create(idshoppcart=cart, idproduct=self.product, quantity=3)
+        self.assertEqual(self.reserved(self.product), 3)
+        self.assertFalse(StockReservation.objects.filter(line__idshoppcart=abandoned).exists())
+        
+        # Y también una venta directa
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(Product.objects.decrease_stock(self.product.pk, 5))
+        self.assertEqual(self.reserved(self.product), 0)
+        
+        # Lo mismo en el descuento en bloque del checkout
+        ShoppCartDetails.objects.create(idshoppcart=abandoned, idproduct=self.other, quantity=8)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(Product.objects.decrease_stock_bulk({self.other.pk: 8}))
+        self.assertEqual(self.reserved(self.other), 0)
+        self.assertEqual(Product.objects.get(pk=self.other.pk).stock, 0)
+
+
 if __name__ == '__main__':
     # Ejecutar pruebas específicas
     import django
@@ -11,6 +11,7 @@ router.register(r'OrderDetails', views.OrderDetailsSerializerView, basename='Ord
 router.register(r'shoppcart', views.ShoppCartSerializerView, basename='shoppcart') 
 router.register(r'shoppcartdetails', views.ShoppCartDetailsSerializerView, basename='shoppcartdetails') 
 router.register(r'Reviews', views.ReviewsSerializerView, basename='Reviews')
+router.register(r'sync', views.CatalogSyncView, basename='sync')
 
 
 urlpatterns = [
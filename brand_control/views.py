@@ -1,7 +1,24 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.shortcuts import render
-from rest_framework import viewsets
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 from .serializer import *
 from .models import *
+from .autocomplete import autocomplete_index
+from .exports import FORMATS, export_response
+from .fastlist import get_row_mapper
+from .filters import TRUE_VALUES, ProductFacetFilter
+from .imports import INPUT_FORMATS, import_products, read_rows
+from .fragments import FragmentListResponse, category_fragments, product_fragments
+from .search import search_products
+from .sync import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, catalog_changes
 from rest_framework import permissions, viewsets
 from user_control.permissions import IsAdminUserCustom
 
@@ -10,36 +27,428 @@ from user_control.permissions import IsAdminUserCustom
 #     queryset = User.objects.all()
 
 
-class ProductSerializerView(viewsets.ModelViewSet):
+# Elementos por pedido en la actualización masiva de productos
+BULK_UPDATE_MAX_ITEMS = 100_000
+AVAILABILITY_MAX_IDS = 1000
+
+
+class SparseFieldsViewMixin:
+    """Con ``?fields=``/``?omit=``/``?view=compact`` lee solo las columnas necesarias"""
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+        columns = self.get_serializer().get_only_fields()
+        if columns is None:
+            return queryset
+        # La paginación por keyset ordena y arma el cursor con estos campos
+        return queryset.only(*columns, *getattr(self, 'keyset_ordering', ()))
+
+
+class ConditionalGetMixin:
+    """
+    ETag y Last-Modified a partir de ``updated_at`` para ``retrieve`` y ``list``.
+
+    Antes de cargar o serializar nada se lee la versión: en el detalle el
+    ``updated_at`` del objeto, en el listado los (pk, ``updated_at``) de las
+    filas de la página pedida y si hay una siguiente. Es una lectura del
+    tamaño de la página por el mismo índice que el listado, no un agregado
+    sobre toda la tabla; un alta o un borrado dentro de la página cambia los
+    pks. Si el cuerpo trae algo calculado sobre todo el queryset (los facets
+    de productos), ``get_extra_version`` suma su versión al ETag. Si el
+    cliente ya tiene esa versión se responde 304. Los parámetros
+    de la URL forman parte del ETag porque cambian el cuerpo (filtros,
+    ``fields``, cursor...).
+    """
+    version_field = 'updated_at'
+    
+    def get_etag(self, *parts):
+        params = sorted(self.request.query_params.lists())
+        raw = repr((self.get_queryset().model._meta.label, parts, params))
+        return '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+    
+    def conditional_response(self, request, etag, last_modified):
+        """Devuelve un 304 si el cliente ya tiene esta versión, si no None"""
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response['ETag'] = etag
+        return response
+    
+    def set_validators(self, response, etag, last_modified):
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            versions = list(
+                self.filter_queryset(self.get_queryset())
+                .filter(**{self.lookup_field: lookup})
+                .values_list(self.version_field, flat=True)[:1]
+            )
+        except (TypeError, ValueError, ValidationError):
+            versions = None
+        if not versions:
+            # get_object() responde el 404 como siempre
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.get_etag(lookup, versions[0])
+        not_modified = self.conditional_response(request, etag, versions[0])
+        if not_modified is not None:
+            return not_modified
+        return self.set_validators(super().retrieve(request, *args, **kwargs), etag, versions[0])
+    
+    def list(self, request, *args, **kwargs):
+        versions, has_next = self.get_page_versions(request)
+        etag = self.get_etag(versions, has_next, self.get_extra_version(request))
+        # Un borrado no mueve la fecha más nueva: en listados solo vale el ETag
+        not_modified = self.conditional_response(request, etag, None)
+        if not_modified is not None:
+            return not_modified
+        last_modified = max((version for _, version in versions if version), default=None)
+        response = self.build_list_response(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+    
+    def get_page_versions(self, request):
+        """(pk, versión) de las filas de la página pedida y si hay una siguiente"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            return list(queryset.values_list('pk', self.version_field)), False
+        columns = {'pk', self.version_field, *getattr(self, 'keyset_ordering', ())}
+        rows = self.paginator.paginate_queryset(queryset.values(*columns), request, view=self)
+        return [(row['pk'], row[self.version_field]) for row in rows], self.paginator.has_next
+    
+    def get_extra_version(self, request):
+        """Versión de lo que el cuerpo incluye además de la página (p. ej. conteos); None si nada"""
+        return None
+    
+    def build_list_response(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class FragmentCacheMixin:
+    """Arma los listados con el JSON cacheado de cada objeto (ver fragments.py)"""
+    fragment_cache = None
+    
+    def list(self, request, *args, **kwargs):
+        if not self.fragment_cache.usable(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return FragmentListResponse(None, self.render_fragments(list(queryset)))
+        return FragmentListResponse(self.get_paginated_response([]).data, self.render_fragments(page))
+    
+    def render_fragments(self, items):
+        return self.fragment_cache.get_many(
+            items, self.request, lambda missing: self.get_serializer(missing, many=True).data
+        )
+
+
+class FastListMixin:
+    """
+    Listados con ``values()`` y un mapper compilado en lugar de instancias y
+    serializer (ver fastlist.py). Si el serializer no admite mapper se usa el
+    camino habitual.
+    """
+    
+    def get_row_mapper(self):
+        # El serializer ya aplica ?fields=/?omit=/?view=
+        return get_row_mapper(self.get_serializer_class(), list(self.get_serializer().fields))
+    
+    def list(self, request, *args, **kwargs):
+        mapper = self.get_row_mapper()
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+        
+        columns = set(mapper.columns) | set(getattr(self, 'keyset_ordering', ()))
+        fragments = getattr(self, 'fragment_cache', None)
+        use_fragments = fragments is not None and fragments.usable(request)
+        if use_fragments and fragments.version_field:
+            columns.add(fragments.version_field)
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        
+        map_row = mapper.bind(request)
+        if use_fragments:
+            data = fragments.get_many(rows, request, lambda missing: [map_row(row) for row in missing])
+            envelope = None if page is None else self.get_paginated_response([]).data
+            return FragmentListResponse(envelope, data)
+        data = [map_row(row) for row in rows]
+        return Response(data) if page is None else self.get_paginated_response(data)
+
+
+class ExportMixin:
+    """
+    ``GET .../export/?output=ndjson|csv&compress=gzip`` escribe la tabla
+    completa (con los filtros de la vista) en streaming, ver exports.py.
+    """
+    export_name = None
+    export_permission_classes = None
+    
+    def get_permissions(self):
+        if self.action == 'export' and self.export_permission_classes is not None:
+            return [permission() for permission in self.export_permission_classes]
+        return super().get_permissions()
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # No se usa ``format``: DRF lo reserva para elegir el renderer
+        output = request.query_params.get('output', 'ndjson')
+        if output not in FORMATS:
+            return Response({'error': f'Formato no soportado, opciones: {", ".join(FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('compress', '').lower() == 'gzip'
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(self.export_name, output, queryset, request, compress)
+
+
+class ProductSerializerView(ConditionalGetMixin, FastListMixin, FragmentCacheMixin, SparseFieldsViewMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
+    keyset_ordering = ('created_at', 'id')
     permission_classes = [permissions.IsAuthenticated]  # Cambiado para permitir usuarios autenticados
+    
+    filter_backends = [ProductFacetFilter]
+    fragment_cache = product_fragments
+    export_name = 'products'
+    
+    def build_list_response(self, request, *args, **kwargs):
+        """
+        Con ``?q=`` devuelve los productos ordenados por relevancia. Sin
+        búsqueda, ``?facets=true`` agrega los conteos por facet.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            response = super().build_list_response(request, *args, **kwargs)
+            if request.query_params.get('facets', '').lower() in TRUE_VALUES:
+                response.data['facets'] = ProductFacetFilter().facet_counts(request, self.get_queryset())
+            return response
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginator.paginate_ranking(self.search_ranking(query), queryset, request)
+        if self.fragment_cache.usable(request):
+            return FragmentListResponse(self.get_paginated_response([]).data, self.render_fragments(page))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def get_extra_version(self, request):
+        # Los facets (solo sin búsqueda) cuentan todo el queryset filtrado, no solo la página
+        if request.query_params.get('q', '').strip() or request.query_params.get('facets', '').lower() not in TRUE_VALUES:
+            return None
+        return ProductFacetFilter().facet_version(request, self.get_queryset(), self.version_field)
+    
+    def get_page_versions(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return super().get_page_versions(request)
+        queryset = self.filter_queryset(self.get_queryset()).only(self.version_field)
+        page = self.paginator.paginate_ranking(self.search_ranking(query), queryset, request)
+        return [(product.pk, getattr(product, self.version_field)) for product in page], self.paginator.has_next
+    
+    def search_ranking(self, query):
+        # El ETag y la página salen del mismo ranking: se calcula una vez por pedido
+        if getattr(self, '_ranking', None) is None:
+            self._ranking = search_products(query)
+        return self._ranking
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Sugerencias de productos y categorías por prefijo, sin consultar la base"""
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        return Response(autocomplete_index.suggest(request.query_params.get('q', ''), limit))
+    
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        Stock disponible para vender (stock menos lo reservado por carritos)
+        de ``?ids=1,2,3``: una lectura por clave primaria de cada producto.
+        """
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+        except ValueError:
+            return Response({'error': 'ids debe ser una lista de enteros separados por coma'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > AVAILABILITY_MAX_IDS:
+            return Response({'error': f'Indicar entre 1 y {AVAILABILITY_MAX_IDS} ids'}, status=status.HTTP_400_BAD_REQUEST)
+        available = Product.objects.filter(pk__in=ids).with_available_stock().values_list('id', 'available_stock')
+        return Response({str(pk): value for pk, value in available})
+    
+    @action(detail=False, methods=['post'], url_path='import', url_name='import', permission_classes=[IsAdminUserCustom])
+    def bulk_import(self, request):
+        """
+        Importa productos desde un CSV o NDJSON (ver imports.py), enviado como
+        cuerpo del pedido (``text/csv`` o ``application/x-ndjson``) o como
+        archivo ``file`` de un formulario multipart. El cuerpo se lee en
+        streaming, sin cargarlo entero en memoria.
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'error': 'Falta el archivo "file"'}, status=status.HTTP_400_BAD_REQUEST)
+            stream, name = upload, upload.name
+        else:
+            stream, name = request.stream, ''
+        input_format = request.query_params.get('input') or (
+            'csv' if content_type == 'text/csv' or name.endswith('.csv') else 'ndjson'
+        )
+        if input_format not in INPUT_FORMATS or stream is None:
+            return Response({'error': f'Formato no soportado, opciones: {", ".join(INPUT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        summary = import_products(read_rows(stream, input_format))
+        return Response(summary, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['post'], url_path='bulk-update', permission_classes=[IsAdminUserCustom])
+    def bulk_update(self, request):
+        """
+        Cambia precio, stock y/o estado de muchos productos en una sola
+        transacción: ``[{"id": 1, "price": "9.90", "stock": 12, "is_active": true}, ...]``.
+        Si algún elemento es inválido no se aplica ninguno.
+        """
+        serializer = ProductBulkChangeSerializer(data=request.data, many=True, allow_empty=False, max_length=BULK_UPDATE_MAX_ITEMS)
+        serializer.is_valid(raise_exception=True)
+        reason = request.query_params.get('reason') or 'Ajuste masivo'
+        try:
+            updated, movements = Product.objects.apply_bulk_changes(serializer.validated_data, user=request.user, reason=reason[:200])
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'received': len(serializer.validated_data),
+            'updated': updated,
+            'stock_movements': movements,
+        })
+    
+    @action(detail=False, methods=['get'], url_path='cache-metrics', permission_classes=[IsAdminUserCustom])
+    def cache_metrics(self, request):
+        """Aciertos y fallos de la caché de fragmentos JSON en este proceso"""
+        return Response({
+            'product': product_fragments.metrics(),
+            'category': category_fragments.metrics(),
+        })
 
 
-class CategorySerializerView(viewsets.ModelViewSet):
+class CategorySerializerView(FragmentCacheMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
+    keyset_ordering = ('id',)
+    fragment_cache = category_fragments
 
-class OrderSerializerView(viewsets.ModelViewSet):
+class CatalogSyncView(viewsets.ViewSet):
+    """
+    Cambios de productos y categorías desde el token ``since`` (ver sync.py).
+    Sin token devuelve una copia completa, también paginada.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def list(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            limit = DEFAULT_PAGE_SIZE
+        return Response(catalog_changes(request.query_params.get('since'), limit, request))
+
+class OrderSerializerView(ConditionalGetMixin, SparseFieldsViewMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     queryset = Order.objects.all()
+    keyset_ordering = ('created_at', 'idorder')
     permission_classes = [permissions.IsAuthenticated]  # Agregado para usuarios autenticados
+    export_name = 'orders'
+    export_permission_classes = [IsAdminUserCustom]
+    
+    @action(detail=False, methods=['post'], url_path='bulk-cancel', permission_classes=[IsAdminUserCustom])
+    def bulk_cancel(self, request):
+        """Cancela varias órdenes pendientes en una transacción: ``{"ids": [1, 2, ...]}``"""
+        serializer = OrderBulkCancelSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+        cancelled = Order.objects.filter(pk__in=ids).cancel()
+        return Response({'cancelled': cancelled, 'skipped': sorted(ids - set(cancelled))})
 
-class OrderDetailsSerializerView(viewsets.ModelViewSet):
+class OrderDetailsSerializerView(ExportMixin, viewsets.ModelViewSet):
     serializer_class = OrderDetailsSerializer
     queryset = OrderDetails.objects.all()
+    keyset_ordering = ('idorderdetails',)
+    export_name = 'order-details'
+    export_permission_classes = [IsAdminUserCustom]
+    
+    # El total guardado de la orden se recalcula en la misma transacción que la línea
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            serializer.save().idorder.calculate_total()
+    
+    def perform_update(self, serializer):
+        previous = serializer.instance.idorder
+        with transaction.atomic():
+            detail = serializer.save()
+            detail.idorder.calculate_total()
+            if previous.pk != detail.idorder_id:
+                previous.calculate_total()
+    
+    def perform_destroy(self, instance):
+        order = instance.idorder
+        with transaction.atomic():
+            instance.delete()
+            order.calculate_total()
 
-class ShoppCartSerializerView(viewsets.ModelViewSet):
+class ShoppCartSerializerView(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = ShoppCartSerializer
-    queryset = ShoppCart.objects.all()
+    queryset = ShoppCart.objects.with_totals()
+    keyset_ordering = ('created_at', 'idshoppcart')
     permission_classes = [permissions.IsAuthenticated]  # Agregado para usuarios autenticados
+    
+    @action(detail=True, methods=['post'])
+    def checkout(self, request, pk=None):
+        """Convierte el carrito en una orden en una sola transacción"""
+        cart = self.get_object()
+        try:
+            order = cart.checkout(user=request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 class ShoppCartDetailsSerializerView(viewsets.ModelViewSet):
     serializer_class = ShoppCartDetailsSerializer
     queryset = ShoppCartDetails.objects.all()
+    keyset_ordering = ('idshoppcartdetails',)
     permission_classes = [permissions.IsAuthenticated]  # Agregado para usuarios autenticados
 
-class ReviewsSerializerView(viewsets.ModelViewSet):
+class ReviewsSerializerView(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = ReviewsSerializer
     queryset = Reviews.objects.all()
-
+    keyset_ordering = ('date', 'idreviews')
+    
+    # Los agregados de Product se actualizan en la misma transacción que la reseña
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            review = serializer.save()
+            Product.objects.apply_review_delta(review.idproduct_id, review.rating, 1)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # La calificación anterior se relee con la fila bloqueada: la
+            # instancia se cargó antes y otra edición pudo cambiarla
+            previous = self.lock_review(serializer.instance.pk)
+            # Guardarla igual la volvería a insertar sin sumarla a los agregados
+            if previous is None:
+                raise NotFound('La reseña ya no existe')
+            review = serializer.save()
+            if previous != (review.idproduct_id, review.rating):
+                Product.objects.apply_review_delta(previous[0], previous[1], -1)
+                Product.objects.apply_review_delta(review.idproduct_id, review.rating, 1)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            previous = self.lock_review(instance.pk)
+            # Si otro pedido ya la borró, sus agregados ya se descontaron
+            if previous is not None:
+                Product.objects.apply_review_delta(previous[0], previous[1], -1)
+            instance.delete()
+    
+    def lock_review(self, pk):
+        """(producto, calificación) guardados de la reseña, con la fila bloqueada; None si ya no existe"""
+        return Reviews.objects.select_for_update().filter(pk=pk).values_list('idproduct_id', 'rating').first()
@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework.authentication import SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import TOKEN_VERSION_CACHE_KEY, Users, cache_token_version
+
+
+def share_user(request, user):
+    """
+    Guarda el usuario resuelto por DRF en el HttpRequest de Django.
+
+    ``AuthenticationMiddleware`` cachea el usuario de la sesión en
+    ``_cached_user``; al reutilizar ese mismo atributo el middleware, las vistas
+    y los permisos ven un único objeto y ``Users`` se consulta una sola vez.
+    """
+    django_request = getattr(request, '_request', request)
+    django_request.user = user
+    django_request._cached_user = user
+
+
+class SharedUserJWTAuthentication(JWTAuthentication):
+    """Autenticación JWT que comparte el usuario con el resto del request"""
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            share_user(request, result[0])
+        return result
+
+
+class ClaimsUser(TokenUser):
+    """
+    Usuario liviano construido con los claims firmados del JWT.
+
+    Expone lo que usan los permisos (``id``, ``roles``, ``company_id``,
+    ``is_active``) sin consultar la tabla ``users``.
+    """
+
+    @cached_property
+    def id(self):
+        # simplejwt guarda el id como texto; se normaliza al tipo de la PK
+        return Users._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def roles(self):
+        return self.token.get('roles')
+
+    @cached_property
+    def company_id(self):
+        return self.token.get('company')
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+    @property
+    def is_admin(self):
+        return self.roles == 'admin'
+
+    @property
+    def is_client(self):
+        return self.roles == 'cliente'
+
+    @property
+    def is_seller(self):
+        return self.roles == 'vendedor'
+
+    @property
+    def is_manager(self):
+        return self.roles == 'gerente'
+
+
+def token_claims(user):
+    """Claims que permiten reconstruir un ClaimsUser a partir del token"""
+    return {
+        'username': user.username,
+        'roles': user.roles,
+        'company': user.company_id,
+        'is_active': user.is_active,
+        'token_version': user.token_version,
+    }
+
+
+def current_token_version(user_id):
+    """Versión vigente de los tokens del usuario: caché y, si falta, la base"""
+    version = cache.get(TOKEN_VERSION_CACHE_KEY.format(user_id))
+    if version is None:
+        version = Users.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if version is None:
+            raise AuthenticationFailed('Usuario no encontrado', code='user_not_found')
+        cache_token_version(user_id, version)
+    return version
+
+
+class StatelessJWTAuthentication(SharedUserJWTAuthentication):
+    """
+    Autenticación JWT sin consulta a la base para tokens con claims de usuario.
+
+    Los tokens emitidos sin esos claims (anteriores a este cambio) siguen
+    resolviendo el usuario en la base. Con ``JWT_CHECK_TOKEN_VERSION`` se
+    compara la versión del token con la vigente para poder revocarlos.
+    """
+
+    def get_user(self, validated_token):
+        if 'roles' not in validated_token or 'token_version' not in validated_token:
+            return super().get_user(validated_token)
+
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed('Usuario inactivo', code='user_inactive')
+        if getattr(settings, 'JWT_CHECK_TOKEN_VERSION', True):
+            if validated_token['token_version'] != current_token_version(user.id):
+                raise AuthenticationFailed('Token revocado', code='token_revoked')
+        return user
+
+
+# Para vistas que necesitan la fila completa de Users (perfil, altas por admin)
+FULL_USER_AUTHENTICATION_CLASSES = [SessionAuthentication, SharedUserJWTAuthentication]
@@ -0,0 +1,153 @@
+"""
+Pool acotado para el hasheo de contraseñas.
+
+PBKDF2 consume decenas de ms de CPU por hash; hacerlo en el thread del request
+frena al resto de las requests del worker durante un pico de logins o
+registros. El pool limita cuántos hashes corren a la vez
+(``PASSWORD_HASH_WORKERS``) y cuántos pueden esperar (``PASSWORD_HASH_MAX_QUEUE``);
+si está lleno se rechaza enseguida con ``HashPoolSaturated`` en lugar de
+acumular requests. hashlib libera el GIL mientras calcula, así que los threads
+corren en paralelo.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashPoolSaturated(APIException):
+    """El pool de hasheo no acepta más trabajos por ahora (503 + Retry-After)"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Demasiadas operaciones de contraseña en curso, reintente en unos segundos'
+    default_code = 'password_hash_pool_saturated'
+    # El exception handler de DRF lo envía como Retry-After
+    wait = 1
+
+
+class PasswordHashPool:
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def submit(self, fn, *args):
+        """Encola ``fn(*args)``; lanza HashPoolSaturated si no hay lugar"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashPoolSaturated()
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._executor.submit(self._run, fn, args)
+        except Exception:
+            self._release(started=False)
+            raise
+
+    def _run(self, fn, args):
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            self._release(started=True)
+
+    def _release(self, started):
+        with self._lock:
+            self._pending -= 1
+            if started:
+                self._running -= 1
+                self._completed += 1
+        self._slots.release()
+
+    def call(self, fn, *args):
+        """Ejecuta en el pool y espera el resultado (vistas sincrónicas)"""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn, *args):
+        """Ejecuta en el pool sin bloquear el event loop (vistas async)"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queue_depth': self._pending - self._running,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    """Pool compartido por el proceso, creado con la configuración de settings"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PasswordHashPool(
+                    max_workers=getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 2,
+                    max_queue=getattr(settings, 'PASSWORD_HASH_MAX_QUEUE', 64),
+                )
+    return _pool
+
+
+def password_needs_rehash(encoded):
+    """Indica si el hash usa un algoritmo o parámetros desactualizados"""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != get_hasher().algorithm or hasher.must_update(encoded)
+
+
+def hash_password(password):
+    return get_hash_pool().call(make_password, password)
+
+
+def verify_password(user, password):
+    """
+    Verifica la contraseña de ``user`` en el pool.
+
+    Si es correcta y el hash está desactualizado lo recalcula (también en el
+    pool) y guarda solo la columna ``password``.
+    """
+    pool = get_hash_pool()
+    if not pool.call(check_password, password, user.password):
+        return False
+    if password_needs_rehash(user.password):
+        user.password = pool.call(make_password, password)
+        user.save(update_fields=['password'])
+    return True
+
+
+async def ahash_password(password):
+    return await get_hash_pool().run(make_password, password)
+
+
+async def averify_password(user, password):
+    """Versión async de verify_password"""
+    pool = get_hash_pool()
+    if not await pool.run(check_password, password, user.password):
+        return False
+    if password_needs_rehash(user.password):
+        user.password = await pool.run(make_password, password)
+        await user.asave(update_fields=['password'])
+    return True
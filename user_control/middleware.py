@@ -1,7 +1,11 @@
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
-from django.contrib.auth import get_user
-import json
+
+
+# Headers con la información de sesión que antes se agregaba al cuerpo JSON
+SESSION_ID_HEADER = 'X-Session-Id'
+SESSION_USER_HEADER = 'X-User-Id'
+SESSION_AUTHENTICATED_HEADER = 'X-Session-Authenticated'
 
 
 class SessionMiddleware(MiddlewareMixin):
@@ -9,38 +13,26 @@ class SessionMiddleware(MiddlewareMixin):
     Middleware personalizado para manejar sesiones y autenticación
     """
     
-    def process_request(self, request):
-        """Procesa la request antes de que llegue a la vista"""
-        # Asegurar que la sesión esté creada
-        if not request.session.session_key:
-            request.session.create()
-        
-        # Obtener el usuario autenticado
-        request.user = get_user(request)
-        
-        return None
+    # ``request.user`` lo resuelve de forma perezosa AuthenticationMiddleware y
+    # lo comparten SessionAuthentication y SharedUserJWTAuthentication, así que
+    # acá no se vuelve a consultar el usuario. La sesión tampoco se crea por
+    # adelantado: crearla insertaba una fila por cada request anónima.
     
     def process_response(self, request, response):
         """Procesa la response antes de enviarla al cliente"""
         
-        # Si es una respuesta JSON y el usuario está autenticado, agregar información de sesión
-        if hasattr(response, 'content_type') and response.content_type and 'application/json' in response.content_type:
-            try:
-                content = json.loads(response.content.decode('utf-8'))
-                if request.user.is_authenticated:
-                    content['session_info'] = {
-                        'session_id': request.session.session_key,
-                        'user_id': request.user.id,
-                        'authenticated': True
-                    }
-                else:
-                    content['session_info'] = {
-                        'session_id': request.session.session_key,
-                        'authenticated': False
-                    }
-                response.content = json.dumps(content, ensure_ascii=False).encode('utf-8')
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                pass
+        # La información de sesión viaja en headers: no hace falta volver a
+        # parsear y serializar el cuerpo, y funciona con respuestas streaming
+        user = getattr(request, 'user', None)
+        authenticated = bool(user is not None and user.is_authenticated)
+        session = getattr(request, 'session', None)
+        session_key = session.session_key if session is not None else None
+        
+        response[SESSION_AUTHENTICATED_HEADER] = 'true' if authenticated else 'false'
+        if session_key:
+            response[SESSION_ID_HEADER] = session_key
+        if authenticated:
+            response[SESSION_USER_HEADER] = str(user.id)
         
         # Configurar headers de seguridad para cookies
         if hasattr(response, 'cookies'):
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0002_alter_users_options_users_company_users_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:13
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+import user_control.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user_control', '0003_users_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='users',
+            managers=[
+                ('objects', user_control.models.UsersManager()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='users',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.NullIf(django.db.models.functions.text.Lower('email'), models.Value('')), name='users_email_ci_unique'),
+        ),
+    ]
@@ -1,5 +1,58 @@
-from django.contrib.auth.models import AbstractUser
+from django.conf import settings
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.core.cache import cache
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Lower, NullIf
+
+
+# Versión vigente de los JWT de cada usuario (ver user_control.authentication)
+TOKEN_VERSION_CACHE_KEY = 'user_control:token_version:{}'
+# Campos copiados a los claims del JWT (o que los invalidan): al cambiar se revocan los tokens
+TOKEN_CLAIM_FIELDS = ('roles', 'is_active', 'company_id', 'password')
+
+
+def cache_token_version(user_id, version):
+    timeout = getattr(settings, 'JWT_TOKEN_VERSION_CACHE_TIMEOUT', 60)
+    cache.set(TOKEN_VERSION_CACHE_KEY.format(user_id), version, timeout)
+
+def email_key():
+    """
+    Email en minúsculas, o NULL si está vacío. Es la expresión del índice
+    único users_email_ci_unique: los NULL no chocan entre sí, así varios
+    usuarios pueden no tener email (``email`` es opcional en AbstractUser).
+    """
+    return NullIf(Lower('email'), Value(''))
+
+
+class UsersManager(UserManager):
+    def by_identifier(self, identifier):
+        """Usuarios cuyo username o email (sin distinguir mayúsculas) coincide"""
+        # Misma expresión que el índice único users_email_ci_unique
+        query = Q(username=identifier)
+        if identifier:
+            query |= Q(email_key=identifier.lower())
+        return self.alias(email_key=email_key()).filter(query)
+    
+    def email_taken(self, email):
+        # Un email vacío no identifica a nadie
+        if not email:
+            return False
+        return self.alias(email_key=email_key()).filter(email_key=email.lower()).exists()
+
+    def create_user_with_hash(self, username, email, password_hash, **extra_fields):
+        """Igual que create_user pero con la contraseña ya hasheada (ver hashing.py)"""
+        extra_fields.setdefault('is_staff', False)
+        extra_fields.setdefault('is_superuser', False)
+        user = self.model(
+            username=self.model.normalize_username(username),
+            email=self.normalize_email(email),
+            **extra_fields
+        )
+        user.password = password_hash
+        user.save(using=self._db)
+        return user
+
 
 # Create your models here.
 class Users(AbstractUser):
@@ -20,14 +73,48 @@ class Users(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
+    # Se incrementa para revocar todos los JWT emitidos al usuario
+    token_version = models.PositiveIntegerField(default=0)
+    
+    objects = UsersManager()
+    
     class Meta:
         verbose_name = 'Usuario'
         verbose_name_plural = 'Usuarios'
         db_table = 'users'
+        constraints = [
+            models.UniqueConstraint(email_key(), name='users_email_ci_unique'),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.roles})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._token_claims = instance.loaded_token_claims()
+        return instance
+    
+    def loaded_token_claims(self):
+        # Solo los campos cargados: leer uno diferido haría otra consulta
+        return {name: self.__dict__[name] for name in TOKEN_CLAIM_FIELDS if name in self.__dict__}
+    
+    def token_claims_changed(self, update_fields=None):
+        loaded = getattr(self, '_token_claims', {})
+        if update_fields is not None:
+            names = {self._meta.get_field(name).attname for name in update_fields}
+            loaded = {name: value for name, value in loaded.items() if name in names}
+        return any(self.__dict__.get(name, value) != value for name, value in loaded.items())
+    
+    def save(self, *args, **kwargs):
+        # Rol, estado, empresa y contraseña viajan en el JWT o lo invalidan:
+        # si cambian, los tokens emitidos dejan de valer (también al renovarlos)
+        revoke = self.pk is not None and self.token_claims_changed(kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+        if revoke:
+            self.revoke_tokens()
+        self._token_claims = self.loaded_token_claims()
+    
     @property
     def is_admin(self):
         return self.roles == 'admin'
@@ -44,3 +131,8 @@ class Users(AbstractUser):
     def is_manager(self):
         return self.roles == 'gerente'
     
+    def revoke_tokens(self):
+        """Invalida los JWT emitidos hasta ahora incrementando la versión"""
+        Users.objects.filter(pk=self.pk).update(token_version=F('token_version') + 1)
+        self.refresh_from_db(fields=['token_version'])
+        cache_token_version(self.pk, self.token_version)
@@ -18,9 +18,10 @@ class IsOwnerOrAdmin(BasePermission):
         if request.user.is_authenticated and request.user.is_admin:
             return True
         
-        # El propietario puede acceder a sus propios datos
-        if hasattr(obj, 'user'):
-            return obj.user == request.user
+        # El propietario puede acceder a sus propios datos (se comparan ids para
+        # que funcione también con el usuario construido desde el JWT)
+        if hasattr(obj, 'user_id'):
+            return obj.user_id == request.user.id
         elif hasattr(obj, 'id'):
             return obj.id == request.user.id
         
@@ -42,8 +43,8 @@ class IsCompanyMember(BasePermission):
             return True
         
         # Verificar si pertenece a la misma empresa
-        if hasattr(obj, 'company') and obj.company:
-            return obj.company == request.user.company
+        if getattr(obj, 'company_id', None):
+            return obj.company_id == request.user.company_id
         
         return False
     
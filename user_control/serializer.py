@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from .models import Users
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .models import Users, cache_token_version
+from .hashing import hash_password
 from brand_control import models as control_model
 
 
@@ -18,6 +22,11 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         fields = ['username', 'email', 'password', 'password2', 'first_name', 'last_name', 'phone', 'address', 'roles']
         extra_kwargs = {'email': {'required': True}}
 
+    def validate_email(self, value):
+        if Users.objects.email_taken(value):
+            raise serializers.ValidationError("Ya existe un usuario con este email.")
+        return value
+
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({"password": "Las contraseñas no coinciden."})
@@ -27,7 +36,10 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         validated_data.pop('password2')
         # Asegurar que el rol sea 'cliente' por defecto
         validated_data['roles'] = validated_data.get('roles', 'cliente')
-        return Users.objects.create_user(**validated_data)
+        # La vista async ya trae el hash calculado; si no, se calcula en el pool
+        password = validated_data.pop('password')
+        password_hash = validated_data.pop('password_hash', None) or hash_password(password)
+        return Users.objects.create_user_with_hash(password_hash=password_hash, **validated_data)
 
 
 class UserCreateByAdminSerializer(serializers.ModelSerializer):
@@ -44,6 +56,11 @@ class UserCreateByAdminSerializer(serializers.ModelSerializer):
         fields = ['username', 'email', 'password', 'password2', 'first_name', 'last_name', 'phone', 'address', 'roles']
         extra_kwargs = {'email': {'required': True}}
 
+    def validate_email(self, value):
+        if Users.objects.email_taken(value):
+            raise serializers.ValidationError("Ya existe un usuario con este email.")
+        return value
+
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({"password": "Las contraseñas no coinciden."})
@@ -53,7 +70,8 @@ class UserCreateByAdminSerializer(serializers.ModelSerializer):
         validated_data.pop('password2')
         # Asignar la empresa del admin que crea el usuario
         validated_data['company'] = self.context['request'].user
-        return Users.objects.create_user(**validated_data)
+        password_hash = hash_password(validated_data.pop('password'))
+        return Users.objects.create_user_with_hash(password_hash=password_hash, **validated_data)
 
 
 class UserDetailSerializer(serializers.ModelSerializer):
@@ -81,3 +99,42 @@ class BranchCreateByAdminSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         company = self.context['request'].user
         return control_model.Branch.objects.create(company=company, **validated_data)
+
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """Emite JWT con los claims que usa StatelessJWTAuthentication."""
+
+    @classmethod
+    def get_token(cls, user):
+        from .authentication import token_claims
+
+        token = super().get_token(user)
+        token.payload.update(token_claims(user))
+        # La versión recién leída evita la consulta en la primera request
+        cache_token_version(user.pk, user.token_version)
+        return token
+
+
+class TokenRefreshWithClaimsSerializer(TokenRefreshSerializer):
+    """
+    Renueva el access token con los claims vigentes del usuario, no con los
+    copiados en el refresh. Un refresh de una versión revocada no se acepta.
+    """
+
+    def validate(self, attrs):
+        from .authentication import token_claims
+
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs['refresh'])
+        user = Users.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        if refresh.payload.get('token_version', user.token_version) != user.token_version:
+            raise AuthenticationFailed('Token revocado', code='token_revoked')
+        access = refresh.access_token
+        access.payload.update(token_claims(user))
+        data['access'] = str(access)
+        cache_token_version(user.pk, user.token_version)
+        return data
@@ -0,0 +1,246 @@
+"""
+Motor de sesiones con caché en dos niveles y escritura solo ante cambios.
+
+Las sesiones se leen de una caché local al proceso (unos pocos segundos de
+vida), luego de la caché compartida (``SESSION_CACHE_ALIAS``) y, si
+``SESSION_WRITE_THROUGH`` está activo, de la tabla de sesiones de Django como
+respaldo durable. Si el backend de ``SESSION_CACHE_ALIAS`` vive en la memoria
+de cada proceso (LocMemCache) no hay nivel compartido: un logout en un worker
+no se vería en los demás, así que se lee y escribe directamente en la base. ``save()`` solo escribe cuando cambiaron los datos o cuando
+el vencimiento guardado quedó más de ``SESSION_SLIDE_INTERVAL`` segundos atrás
+del que correspondería, así ``SESSION_SAVE_EVERY_REQUEST`` deja de generar un
+UPDATE por request.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+
+KEY_PREFIX = 'user_control.sessions.'
+# Backends cuyo contenido es propio de cada proceso: no sirven como nivel compartido
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+logger = logging.getLogger('django.contrib.sessions')
+
+
+class LocalSessionCache:
+    """Caché LRU en memoria del proceso con un tiempo de vida corto"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'SESSION_LOCAL_CACHE_TTL', 2)
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalSessionCache()
+
+
+def shared_session_cache():
+    """La caché de ``SESSION_CACHE_ALIAS`` si la comparten todos los procesos, si no None"""
+    alias = settings.SESSION_CACHE_ALIAS
+    if settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_BACKENDS:
+        return None
+    return caches[alias]
+
+
+class SessionStore(DBStore):
+    """
+    Sesiones en caché local + compartida, con escritura opcional a la base.
+
+    Cada entrada de caché guarda los datos serializados y el vencimiento
+    (timestamp). Los datos serializados sirven también como huella para
+    detectar si la sesión cambió durante el request.
+    """
+
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = shared_session_cache()
+        # (datos serializados, vencimiento) tal como se leyeron del almacenamiento
+        self._stored_state = None
+        super().__init__(session_key)
+
+    @property
+    def write_through(self):
+        # Sin caché compartida la base es el único almacenamiento común
+        return getattr(settings, 'SESSION_WRITE_THROUGH', True) or self._cache is None
+
+    @property
+    def slide_interval(self):
+        return getattr(settings, 'SESSION_SLIDE_INTERVAL', 300)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def _dumps(self, data):
+        return self.serializer().dumps(data)
+
+    def _loads(self, payload):
+        return self.serializer().loads(payload)
+
+    def _read_entry(self, key):
+        entry = local_cache.get(key)
+        if entry is not None:
+            return entry
+        try:
+            entry = self._cache.get(key) if self._cache is not None else None
+        except Exception:
+            # Algunos backends fallan con claves inválidas (ver #17810 de Django)
+            entry = None
+        if entry is None and self.write_through:
+            s = self._get_session_from_db()
+            if s:
+                entry = {
+                    'data': self._dumps(self.decode(s.session_data)),
+                    'expires': s.expire_date.timestamp(),
+                }
+                self._write_cache(key, entry)
+        if entry is not None:
+            local_cache.set(key, entry)
+        return entry
+
+    def _write_cache(self, key, entry, must_create=False):
+        if self._cache is None:
+            return True
+        timeout = max(int(entry['expires'] - time.time()), 1)
+        try:
+            if must_create:
+                return self._cache.add(key, entry, timeout)
+            self._cache.set(key, entry, timeout)
+        except Exception:
+            if must_create and not self.write_through:
+                raise
+            logger.exception('Error saving to cache (%s)', self._cache)
+        return True
+
+    def load(self):
+        entry = self._read_entry(self.cache_key)
+        if entry is None or entry['expires'] <= time.time():
+            self._session_key = None
+            return {}
+        self._stored_state = (entry['data'], entry['expires'])
+        return self._loads(entry['data'])
+
+    def needs_save(self, payload, expires):
+        """Indica si hay que persistir: datos distintos o vencimiento a deslizar"""
+        if self._stored_state is None:
+            return True
+        stored_payload, stored_expires = self._stored_state
+        return payload != stored_payload or expires - stored_expires >= self.slide_interval
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        payload = self._dumps(data)
+        expires = time.time() + self.get_expiry_age()
+        if not must_create and not self.needs_save(payload, expires):
+            return
+
+        key = self.cache_key
+        entry = {'data': payload, 'expires': expires}
+        if self.write_through:
+            # La base es la fuente durable: si la clave ya existe lanza CreateError
+            super().save(must_create)
+            self._write_cache(key, entry)
+        elif not self._write_cache(key, entry, must_create=must_create):
+            raise CreateError
+        local_cache.set(key, entry)
+        self._stored_state = (payload, expires)
+
+    def exists(self, session_key):
+        if not session_key:
+            return False
+        key = self.cache_key_prefix + session_key
+        if local_cache.get(key) is not None or (self._cache is not None and key in self._cache):
+            return True
+        return self.write_through and super().exists(session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        if self.write_through:
+            super().delete(session_key)
+        key = self.cache_key_prefix + session_key
+        if self._cache is not None:
+            self._cache.delete(key)
+        local_cache.delete(key)
+        if session_key == self.session_key:
+            self._stored_state = None
+
+    def flush(self):
+        """Borra la sesión actual del almacenamiento y regenera la clave"""
+        self.clear()
+        self.delete(self.session_key)
+        self._session_key = None
+
+    # Las variantes async reutilizan la implementación sincrónica
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+    async def aexists(self, session_key):
+        return await sync_to_async(self.exists)(session_key)
+
+    async def adelete(self, session_key=None):
+        return await sync_to_async(self.delete)(session_key)
+
+    async def aflush(self):
+        return await sync_to_async(self.flush)()
+
+    @classmethod
+    def clear_expired(cls):
+        if getattr(settings, 'SESSION_WRITE_THROUGH', True) or shared_session_cache() is None:
+            super().clear_expired()
+
+    @classmethod
+    async def aclear_expired(cls):
+        await sync_to_async(cls.clear_expired)()
@@ -4,8 +4,27 @@ from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.http import StreamingHttpResponse
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+from unittest import mock
 import json
+import tempfile
+import threading
+import time
 
+from .hashing import HashPoolSaturated, PasswordHashPool, password_needs_rehash
+from .authentication import ClaimsUser, StatelessJWTAuthentication, token_claims
+from .middleware import SessionMiddleware
+from .permissions import IsAdminUserCustom, IsCompanyMember, IsOwnerOrAdmin
+from .sessions import SessionStore as CachedSessionStore, local_cache
 from .models import Users
 from brand_control.models import Category, Product, ShoppCart
 
@@ -466,6 +485,493 @@ class UserManagementTestCase(APITestCase):
         print("✅ Flujo completo de autenticación exitoso")
 
 
+class SessionMiddlewareTestCase(APITestCase):
+    """Pruebas del middleware de sesión"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='sessionuser',
+            email='session@example.com',
+            password='Session123!',
+            roles='cliente'
+        )
+    
+    def test_anonymous_request_does_not_create_session(self):
+        """Una request anónima no inserta sesiones ni modifica el cuerpo"""
+        print("\n=== PRUEBA: MIDDLEWARE DE SESIÓN ANÓNIMA ===")
+        
+        response = self.client.get('/api/user/test/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(response['X-Session-Authenticated'], 'false')
+        self.assertNotIn('session_info', json.loads(response.content))
+        print("✅ Sin sesiones creadas para requests anónimas")
+    
+    def test_authenticated_session_headers(self):
+        """Las requests autenticadas reciben la información de sesión en headers"""
+        self.client.login(username='sessionuser', password='Session123!')
+        
+        response = self.client.get('/api/user/session-status/')
+        
+        self.assertEqual(response['X-Session-Authenticated'], 'true')
+        self.assertEqual(response['X-User-Id'], str(self.user.id))
+        self.assertEqual(response['X-Session-Id'], self.client.session.session_key)
+        self.assertNotIn('session_info', json.loads(response.content))
+    
+    def test_streaming_response_is_not_consumed(self):
+        """El middleware no lee el contenido de respuestas streaming"""
+        request = RequestFactory().get('/api/user/test/')
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        response = StreamingHttpResponse(iter([b'{"a": ', b'1}']), content_type='application/json')
+        
+        response = SessionMiddleware(lambda r: response).process_response(request, response)
+        
+        self.assertEqual(b''.join(response.streaming_content), b'{"a": 1}')
+
+
+class SingleUserLookupTestCase(APITestCase):
+    """Pruebas de la resolución única del usuario por request"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='lookupuser',
+            email='lookup@example.com',
+            password='Lookup123!',
+            roles='admin'
+        )
+    
+    def count_user_queries(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user_queries = [q for q in queries.captured_queries if 'FROM "users"' in q['sql']]
+        return response, len(user_queries)
+    
+    def test_session_request_loads_user_once(self):
+        """Con sesión, middleware, autenticación y permisos comparten el usuario"""
+        print("\n=== PRUEBA: UNA CONSULTA DE USUARIO POR REQUEST (SESIÓN) ===")
+        
+        self.client.login(username='lookupuser', password='Lookup123!')
+        response, user_queries = self.count_user_queries('/api/user/protected/')
+        
+        self.assertEqual(user_queries, 1)
+        self.assertEqual(response['X-User-Id'], str(self.user.id))
+        print("✅ Usuario resuelto una sola vez")
+    
+    def test_jwt_request_loads_user_once(self):
+        """Con JWT, el middleware ve el mismo usuario sin volver a consultarlo"""
+        token = AccessToken.for_user(self.user)
+        
+        response, user_queries = self.count_user_queries(
+            '/api/user/protected/', HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+        
+        self.assertEqual(user_queries, 1)
+        self.assertEqual(response['X-Session-Authenticated'], 'true')
+        self.assertEqual(response['X-User-Id'], str(self.user.id))
+
+
+@override_settings(SESSION_ENGINE='user_control.sessions', SESSION_WRITE_THROUGH=True, SESSION_SLIDE_INTERVAL=300)
+class CachedSessionEngineTestCase(TestCase):
+    """Pruebas del motor de sesiones en caché con escritura ante cambios"""
+    
+    def setUp(self):
+        # El nivel compartido necesita una caché común a los procesos
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }})
+        shared.enable()
+        self.addCleanup(shared.disable)
+        cache.clear()
+        local_cache.clear()
+    
+    def create_session(self, **data):
+        session = CachedSessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+    
+    def test_unchanged_session_is_not_written(self):
+        """Guardar una sesión sin cambios no toca la base ni la caché"""
+        print("\n=== PRUEBA: SESIÓN SIN CAMBIOS ===")
+        
+        key = self.create_session(user='1')
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+        
+        session = CachedSessionStore(key)
+        with self.assertNumQueries(0):
+            self.assertEqual(session['user'], '1')
+            session.save()
+        print("✅ Sin escrituras para sesiones sin cambios")
+    
+    def test_changed_session_is_written_through(self):
+        """Los cambios se guardan en la caché y en la base"""
+        key = self.create_session(user='1')
+        
+        session = CachedSessionStore(key)
+        session['cart'] = 5
+        session.save()
+        
+        local_cache.clear()
+        cache.clear()
+        self.assertEqual(CachedSessionStore(key)['cart'], 5)
+    
+    def test_expiry_slides_after_interval(self):
+        """El vencimiento se renueva cuando pasó el intervalo de deslizamiento"""
+        key = self.create_session(user='1')
+        stored = Session.objects.get(session_key=key).expire_date
+        
+        later = time.time() + 600
+        with mock.patch('user_control.sessions.time.time', return_value=later):
+            session = CachedSessionStore(key)
+            session['user']
+            session.save()
+        
+        self.assertGreater(Session.objects.get(session_key=key).expire_date, stored)
+    
+    def test_shared_cache_without_database(self):
+        """Sin write-through la sesión vive solo en la caché"""
+        with self.settings(SESSION_WRITE_THROUGH=False):
+            key = self.create_session(user='2')
+            local_cache.clear()
+            self.assertEqual(CachedSessionStore(key)['user'], '2')
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+    
+    def test_delete_removes_every_tier(self):
+        """Borrar la sesión la quita de todos los niveles"""
+        key = self.create_session(user='3')
+        CachedSessionStore(key).delete()
+        
+        self.assertFalse(CachedSessionStore().exists(key))
+        self.assertEqual(CachedSessionStore(key).load(), {})
+    
+    def test_process_local_cache_is_not_a_shared_tier(self):
+        """Con LocMemCache se lee la base: un logout en otro worker se ve enseguida"""
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.settings(SESSION_WRITE_THROUGH=False):
+                key = self.create_session(user='4')
+            self.assertTrue(Session.objects.filter(session_key=key).exists())
+            self.assertIsNone(cache.get(CachedSessionStore.cache_key_prefix + key))
+            
+            # Otro worker borra la sesión: solo queda su copia local de pocos segundos
+            Session.objects.filter(session_key=key).delete()
+            local_cache.clear()
+            self.assertEqual(CachedSessionStore(key).load(), {})
+    
+    def test_authenticated_reads_do_not_update_session(self):
+        """Las lecturas autenticadas no generan UPDATE de la sesión"""
+        Users.objects.create_user(username='cacheduser', email='cached@example.com', password='Cached123!')
+        self.client.login(username='cacheduser', password='Cached123!')
+        self.client.get('/api/user/session-status/')
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user/session-status/')
+        
+        self.assertTrue(response.json()['authenticated'])
+        self.assertFalse(any('django_session' in q['sql'] for q in queries.captured_queries))
+
+
+class StatelessJWTTestCase(APITestCase):
+    """Pruebas de la autenticación JWT basada en claims"""
+    
+    def setUp(self):
+        cache.clear()
+        self.company = Users.objects.create_user(
+            username='empresa',
+            email='empresa@example.com',
+            password='Empresa123!',
+            roles='admin'
+        )
+        self.user = Users.objects.create_user(
+            username='jwtuser',
+            email='jwt@example.com',
+            password='Jwt12345!',
+            roles='vendedor',
+            company=self.company
+        )
+    
+    def obtain_access_token(self, username, password):
+        response = self.client.post('/api/token/', {'username': username, 'password': password}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['access']
+    
+    def test_catalog_read_without_user_queries(self):
+        """Una lectura autenticada con JWT no consulta la tabla de usuarios"""
+        print("\n=== PRUEBA: JWT SIN CONSULTA DE USUARIO ===")
+        
+        token = self.obtain_access_token('jwtuser', 'Jwt12345!')
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('Product-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('FROM "users"' in q['sql'] for q in queries.captured_queries))
+        print("✅ Usuario armado desde los claims del token")
+    
+    def test_revoked_token_is_rejected(self):
+        """Revocar los tokens del usuario invalida los ya emitidos"""
+        token = self.obtain_access_token('jwtuser', 'Jwt12345!')
+        self.user.revoke_tokens()
+        
+        # DRF responde 403 porque SessionAuthentication no define WWW-Authenticate
+        response = self.client.get(reverse('Product-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        # Con la caché vacía la versión se verifica contra la base
+        cache.clear()
+        response = self.client.get(reverse('Product-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_claim_changes_revoke_tokens(self):
+        """Cambiar rol o estado invalida los tokens emitidos y sus renovaciones"""
+        response = self.client.post('/api/token/', {'username': 'empresa', 'password': 'Empresa123!'}, format='json')
+        access, refresh = response.data['access'], response.data['refresh']
+        bulk_url = reverse('Product-bulk-update')
+        
+        self.company.roles = 'cliente'
+        self.company.save()
+        response = self.client.post(bulk_url, [], format='json', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        # Guardar otros campos (o el último login) no revoca nada
+        access = self.obtain_access_token('jwtuser', 'Jwt12345!')
+        self.user.phone = '555-1234'
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('Product-list'), HTTP_AUTHORIZATION=f'Bearer {access}').status_code, status.HTTP_200_OK)
+        
+        user = Users.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        response = self.client.get(reverse('Product-list'), HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_refresh_uses_current_claims(self):
+        """El access renovado lleva los claims vigentes, no los copiados en el refresh"""
+        response = self.client.post('/api/token/', {'username': 'jwtuser', 'password': 'Jwt12345!'}, format='json')
+        refresh = response.data['refresh']
+        # Cambio sin pasar por save(): no se revoca, pero la renovación lo ve
+        Users.objects.filter(pk=self.user.pk).update(roles='gerente')
+        
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.data['access'])['roles'], 'gerente')
+        
+        self.user.revoke_tokens()
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_permissions_work_with_claims_user(self):
+        """Los permisos personalizados funcionan con el usuario de los claims"""
+        token = AccessToken.for_user(self.user)
+        for claim, value in token_claims(self.user).items():
+            token[claim] = value
+        claims_user = StatelessJWTAuthentication().get_user(token)
+        request = RequestFactory().get('/')
+        request.user = claims_user
+        
+        self.assertIsInstance(claims_user, ClaimsUser)
+        self.assertFalse(IsAdminUserCustom().has_permission(request, None))
+        self.assertTrue(IsCompanyMember().has_object_permission(request, None, self.user))
+        self.assertTrue(IsOwnerOrAdmin().has_object_permission(request, None, ShoppCart(user=self.user)))
+        self.assertFalse(IsOwnerOrAdmin().has_object_permission(request, None, ShoppCart(user=self.company)))
+    
+    def test_profile_still_loads_full_user(self):
+        """El perfil sigue devolviendo los datos completos del usuario"""
+        token = self.obtain_access_token('jwtuser', 'Jwt12345!')
+        
+        response = self.client.get('/api/user/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'jwt@example.com')
+
+
+class LoginLookupTestCase(APITestCase):
+    """Pruebas de la búsqueda de usuario en el login"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='loginuser',
+            email='Login.User@example.com',
+            password='Login123!',
+            roles='cliente'
+        )
+    
+    def test_login_reads_user_once(self):
+        """El login resuelve el identificador con una sola consulta"""
+        print("\n=== PRUEBA: LOGIN CON UNA SOLA CONSULTA ===")
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/user/login/', {
+                'identifier': 'login.user@EXAMPLE.com',
+                'password': 'Login123!'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['username'], 'loginuser')
+        user_selects = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "users"' in q['sql']
+        ]
+        self.assertEqual(len(user_selects), 1)
+        print("✅ Login resuelto con una consulta")
+    
+    def test_username_has_priority_over_email(self):
+        """Si el identificador es username de uno y email de otro, gana el username"""
+        Users.objects.create_user(username='other@example.com', email='other2@example.com', password='Other123!')
+        Users.objects.create_user(username='someone', email='other@example.com', password='Someone123!')
+        
+        response = self.client.post('/api/user/login/', {
+            'identifier': 'other@example.com',
+            'password': 'Other123!'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['email'], 'other2@example.com')
+    
+    def test_email_is_unique_case_insensitive(self):
+        """No se puede registrar un email que solo difiere en mayúsculas"""
+        response = self.client.post('/api/user/register/', {
+            'username': 'duplicado',
+            'email': 'login.user@example.com',
+            'password': 'Password123!',
+            'password2': 'Password123!',
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.data)
+    
+    def test_users_without_email(self):
+        """Varios usuarios pueden no tener email; el vacío no cuenta como repetido ni identifica"""
+        Users.objects.create_user(username='sinemail1', password='Sinemail123!')
+        Users.objects.create_superuser(username='sinemail2', email='', password='Sinemail123!')
+        
+        self.assertFalse(Users.objects.email_taken(''))
+        self.assertEqual(list(Users.objects.by_identifier('')), [])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Users.objects.create_user(username='duplicado', email='LOGIN.USER@example.com', password='Password123!')
+
+
+class PasswordHashPoolTestCase(APITestCase):
+    """Pruebas del pool acotado de hasheo y de las vistas async de login/registro"""
+    
+    def setUp(self):
+        self.user = Users.objects.create_user(
+            username='hashuser',
+            email='hash@example.com',
+            password='Hash123!',
+            roles='cliente'
+        )
+    
+    def test_pool_rejects_when_full(self):
+        """Con los workers ocupados y la cola llena se rechaza sin esperar"""
+        print("\n=== PRUEBA: POOL DE HASHEO SATURADO ===")
+        
+        pool = PasswordHashPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        first = pool.submit(release.wait)
+        second = pool.submit(release.wait)
+        
+        with self.assertRaises(HashPoolSaturated):
+            pool.submit(release.wait)
+        metrics = pool.metrics()
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertEqual(metrics['running'] + metrics['queue_depth'], 2)
+        
+        release.set()
+        first.result(timeout=5)
+        second.result(timeout=5)
+        self.assertEqual(pool.metrics()['completed'], 2)
+        self.assertEqual(pool.metrics()['queue_depth'], 0)
+        print("✅ Pool acotado rechaza trabajos cuando está lleno")
+    
+    def test_saturated_login_returns_503(self):
+        """El login sincrónico responde 503 con Retry-After si el pool está lleno"""
+        full_pool = PasswordHashPool(max_workers=1, max_queue=0)
+        full_pool._slots.acquire()
+        
+        with mock.patch('user_control.hashing.get_hash_pool', return_value=full_pool):
+            response = self.client.post('/api/user/login/', {
+                'identifier': 'hashuser',
+                'password': 'Hash123!'
+            }, format='json')
+            async_response = self.client.post('/api/user/async/login/', {
+                'identifier': 'hashuser',
+                'password': 'Hash123!'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(async_response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(async_response['Retry-After'], '1')
+    
+    def test_async_login(self):
+        """El login async valida la contraseña en el pool e inicia la sesión"""
+        print("\n=== PRUEBA: LOGIN ASYNC ===")
+        
+        response = self.client.post('/api/user/async/login/', {
+            'identifier': 'HASH@example.com',
+            'password': 'Hash123!'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['user']['username'], 'hashuser')
+        self.assertTrue(data['session_id'])
+        self.assertEqual(self.client.get('/api/user/profile/').status_code, status.HTTP_200_OK)
+        
+        response = self.client.post('/api/user/async/login/', {
+            'identifier': 'hashuser',
+            'password': 'Incorrecta1!'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("✅ Login async funcionando")
+    
+    def test_async_register(self):
+        """El registro async crea el usuario con la contraseña hasheada en el pool"""
+        response = self.client.post('/api/user/async/register/', {
+            'username': 'asyncuser',
+            'email': 'async@example.com',
+            'password': 'Async123!',
+            'password2': 'Async123!',
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = Users.objects.get(username='asyncuser')
+        self.assertTrue(user.check_password('Async123!'))
+        self.assertEqual(user.roles, 'cliente')
+        
+        response = self.client.post('/api/user/async/register/', {
+            'username': 'asyncuser2',
+            'email': 'ASYNC@example.com',
+            'password': 'Async123!',
+            'password2': 'Async123!',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.json())
+    
+    def test_outdated_hash_is_upgraded_on_login(self):
+        """Un hash con parámetros viejos se recalcula al iniciar sesión"""
+        hasher = PBKDF2PasswordHasher()
+        self.user.password = hasher.encode('Hash123!', hasher.salt(), iterations=1000)
+        self.user.save(update_fields=['password'])
+        
+        response = self.client.post('/api/user/login/', {
+            'identifier': 'hashuser',
+            'password': 'Hash123!'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertFalse(password_needs_rehash(self.user.password))
+
+
 if __name__ == '__main__':
     # Ejecutar pruebas específicas
     import django
@@ -8,11 +8,14 @@ router.register(r'register', views.UserRegisterView, basename='register')
 urlpatterns = [
     path('', include(router.urls)),
     path('login/', views.LoginView.as_view(), name='login'),
+    path('async/login/', views.AsyncLoginView.as_view(), name='async-login'),
+    path('async/register/', views.AsyncRegisterView.as_view(), name='async-register'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
     path('profile/', views.UserProfileView.as_view(), name='profile'),
     path('session-status/', views.SessionStatusView.as_view(), name='session-status'),
     path('protected/', views.ProtectedView.as_view(), name='protected'),
     path('admin/create-user/', views.CreateUserByAdminView.as_view(), name='admin-create-user'),
     path('admin/create-branch/', views.CreateBranchByAdminView.as_view(), name='admin-create-branch'),
+    path('admin/password-hash-metrics/', views.PasswordHashPoolMetricsView.as_view(), name='password-hash-metrics'),
     path('test/', views.TestView.as_view(), name='test'),
 ]
@@ -1,4 +1,9 @@
-from django.contrib.auth import authenticate, login, logout
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import alogin, login, logout
+from django.http import JsonResponse
+from django.views import View
 from rest_framework import viewsets, generics, status, permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -19,6 +24,8 @@ from .serializer import (
     UserUpdateSerializer,
 )
 from .permissions import IsAdminUserCustom
+from .authentication import FULL_USER_AUTHENTICATION_CLASSES
+from .hashing import HashPoolSaturated, ahash_password, averify_password, get_hash_pool, verify_password
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -110,23 +117,20 @@ class LoginView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Buscar usuario por username o email
-            user_obj = None
-            try:
-                user_obj = Users.objects.get(username=identifier)
-            except Users.DoesNotExist:
-                try:
-                    user_obj = Users.objects.get(email=identifier)
-                except Users.DoesNotExist:
-                    return Response(
-                        {"error": "Usuario no encontrado"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-            # Autenticar usuario
-            user = authenticate(request, username=user_obj.username, password=password)
-
-            if user and user.is_active:
+            # Buscar usuario por username o email en una sola consulta indexada
+            candidates = list(Users.objects.by_identifier(identifier)[:2])
+            if not candidates:
+                return Response(
+                    {"error": "Usuario no encontrado"}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # Si el identificador coincide con un username y con el email de
+            # otro usuario, tiene prioridad el username (como antes)
+            user = next((u for u in candidates if u.username == identifier), candidates[0])
+
+            # Verificar la contraseña sobre el mismo objeto, sin authenticate();
+            # el hash corre en el pool acotado (503 si está saturado)
+            if user.is_active and verify_password(user, password):
                 login(request, user)
                 
                 # Serializar datos del usuario para la respuesta
@@ -143,6 +147,8 @@ class LoginView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
                 
+        except HashPoolSaturated:
+            raise
         except Exception as e:
             return Response(
                 {"error": f"Error en el login: {str(e)}"}, 
@@ -150,6 +156,90 @@ class LoginView(APIView):
             )
 
 
+def _json_body(request):
+    """Devuelve el cuerpo JSON como dict, o None si no es válido"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _saturated_response(exc):
+    response = JsonResponse({"error": str(exc.detail)}, status=exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLoginView(View):
+    """
+    Login async con la misma respuesta que LoginView.
+
+    Pensada para servirse por ASGI (BrandFlow/asgi.py): mientras el pool hashea
+    la contraseña el event loop sigue atendiendo otras requests.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request):
+        data = _json_body(request)
+        if data is None:
+            return JsonResponse({"error": "JSON inválido"}, status=status.HTTP_400_BAD_REQUEST)
+
+        identifier = data.get("identifier")
+        password = data.get("password")
+        if not identifier or not password:
+            return JsonResponse(
+                {"error": "Se requiere 'identifier' y 'password'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        candidates = [u async for u in Users.objects.by_identifier(identifier)[:2]]
+        if not candidates:
+            return JsonResponse({"error": "Usuario no encontrado"}, status=status.HTTP_400_BAD_REQUEST)
+        user = next((u for u in candidates if u.username == identifier), candidates[0])
+
+        try:
+            valid = user.is_active and await averify_password(user, password)
+        except HashPoolSaturated as exc:
+            return _saturated_response(exc)
+        if not valid:
+            return JsonResponse(
+                {"error": "Credenciales incorrectas o usuario inactivo"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        await alogin(request, user)
+        return JsonResponse({
+            "message": "Login exitoso",
+            "user": UserDetailSerializer(user).data,
+            "session_id": request.session.session_key,
+        }, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRegisterView(View):
+    """Registro async: valida con UserRegisterSerializer y hashea en el pool"""
+    http_method_names = ['post']
+
+    async def post(self, request):
+        data = _json_body(request)
+        if data is None:
+            return JsonResponse({"error": "JSON inválido"}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = UserRegisterSerializer(data=data)
+        # La validación consulta la base (username/email únicos)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            password_hash = await ahash_password(serializer.validated_data['password'])
+        except HashPoolSaturated as exc:
+            return _saturated_response(exc)
+        user = await sync_to_async(serializer.save)(password_hash=password_hash)
+        return JsonResponse(UserDetailSerializer(user).data, status=status.HTTP_201_CREATED)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 @extend_schema(
     tags=['authentication'],
@@ -188,6 +278,7 @@ class LogoutView(APIView):
 )
 class UserProfileView(APIView):
     """Vista para obtener y actualizar el perfil del usuario"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -209,6 +300,7 @@ class UserProfileView(APIView):
 
 class SessionStatusView(APIView):
     """Vista para verificar el estado de la sesión"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
     permission_classes = [AllowAny]
     
     def get(self, request):
@@ -228,6 +320,7 @@ class SessionStatusView(APIView):
 
 class ProtectedView(APIView):
     """Vista protegida para probar autenticación"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -253,6 +346,7 @@ class ProtectedView(APIView):
 )
 class CreateUserByAdminView(generics.CreateAPIView):
     """Vista para que un admin cree usuarios"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
     serializer_class = UserCreateByAdminSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminUserCustom]
 
@@ -276,6 +370,7 @@ class CreateUserByAdminView(generics.CreateAPIView):
 )
 class CreateBranchByAdminView(generics.CreateAPIView):
     """Vista para que un admin cree sucursales"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
     serializer_class = BranchCreateByAdminSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminUserCustom]
 
@@ -286,6 +381,20 @@ class CreateBranchByAdminView(generics.CreateAPIView):
         serializer.save()
 
 
+@extend_schema(
+    tags=['users'],
+    summary='Métricas del pool de contraseñas (Admin)',
+    description='Workers, hashes en curso, profundidad de la cola y rechazos por saturación',
+)
+class PasswordHashPoolMetricsView(APIView):
+    """Vista para que un admin vea el estado del pool de hasheo"""
+    authentication_classes = FULL_USER_AUTHENTICATION_CLASSES
+    permission_classes = [permissions.IsAuthenticated, IsAdminUserCustom]
+
+    def get(self, request):
+        return Response(get_hash_pool().metrics())
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class TestView(APIView):
     """Vista de prueba para verificar que todo funciona"""